@@ -12,26 +12,54 @@ import time
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 import logging
+import argparse
+import os
 import warnings
 warnings.filterwarnings('ignore')
 
+from asset_ids import AssetIdResolver
+from batch_upsert import BatchUpsertWriter, snapshot_update_writer
+from bulk_loader import connect_from_env
+from change_detection import ChangeSet, RowHashStore
+from float_precision import as_compute_dtype, audit_precision, resolve_dtype
+from log_setup import configure_logging
+from metric_cache import MetricCache, get_shared_cache
+from pooled_executor import PooledBatchExecutor
+from profiling import add_profile_argument, start_profiling, stop_profiling
+from run_report import RunReport, ticker_scope
+from telemetry import TELEMETRY, timed
+from view_refresh import mark_views_dirty
+
 # Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('advanced_metrics_calculation.log'),
-        logging.StreamHandler()
-    ]
-)
+configure_logging('advanced_metrics_calculation.log')
+
+# Colunas de stock_metrics_snapshot atualizadas pela calculadora
+SNAPSHOT_UPDATE_FIELDS = [
+    'returns_12m', 'returns_24m', 'returns_36m', 'returns_5y', 'ten_year_return',
+    'volatility_12m', 'volatility_24m', 'volatility_36m', 'ten_year_volatility',
+    'sharpe_12m', 'sharpe_24m', 'sharpe_36m', 'ten_year_sharpe',
+    'max_drawdown', 'max_drawdown_12m',
+    'dividend_yield_12m', 'dividends_12m', 'dividends_24m', 'dividends_36m', 'dividends_all_time',
+    'current_price', 'volume_avg_30d'
+]
 
 class AdvancedMetricsCalculator:
     """Calculadora de métricas avançadas para dados históricos de ações"""
     
-    def __init__(self):
+    def __init__(self, dtype: str = 'float64', metric_cache: Optional[MetricCache] = None,
+                 asset_ids: Optional[AssetIdResolver] = None):
         self.risk_free_rate = 0.045  # Taxa livre de risco (4.5% atual)
         self.trading_days_year = 252
         self.supabase_project_id = "nniabnjuwzeqmflrruga"
+        # Dtype da matriz de preços/retornos ('float32' reduz memória pela metade)
+        self.dtype = resolve_dtype(dtype)
+        self.metric_cache = metric_cache
+        self.asset_ids = asset_ids or AssetIdResolver.from_file()
+        # Com DATABASE_URL os snapshots são gravados em lote; sem ela, SQL é gerado para o MCP
+        self.database_url = os.getenv('DATABASE_URL')
+        self.snapshot_batch_size = 1000
+        self.db_workers = 1  # conexões concorrentes na gravação em lote
+        self.row_hashes = RowHashStore()
         
     def calculate_returns(self, prices: pd.Series, periods: List[int]) -> Dict[str, float]:
         """Calcular retornos para múltiplos períodos"""
@@ -51,15 +79,15 @@ class AdvancedMetricsCalculator:
                     
                     # Mapear períodos para nomes
                     if period == 252:  # 1 ano
-                        returns['returns_12m'] = round(period_return, 6)
+                        returns['returns_12m'] = round(float(period_return), 6)
                     elif period == 504:  # 2 anos
-                        returns['returns_24m'] = round(period_return, 6)
+                        returns['returns_24m'] = round(float(period_return), 6)
                     elif period == 756:  # 3 anos
-                        returns['returns_36m'] = round(period_return, 6)
+                        returns['returns_36m'] = round(float(period_return), 6)
                     elif period == 1260:  # 5 anos
-                        returns['returns_5y'] = round(period_return, 6)
+                        returns['returns_5y'] = round(float(period_return), 6)
                     elif period == 2520:  # 10 anos
-                        returns['ten_year_return'] = round(period_return, 6)
+                        returns['ten_year_return'] = round(float(period_return), 6)
         
         return returns
     
@@ -81,13 +109,13 @@ class AdvancedMetricsCalculator:
                 
                 # Mapear períodos para nomes
                 if period == 252:  # 1 ano
-                    volatilities['volatility_12m'] = round(volatility, 6)
+                    volatilities['volatility_12m'] = round(float(volatility), 6)
                 elif period == 504:  # 2 anos
-                    volatilities['volatility_24m'] = round(volatility, 6)
+                    volatilities['volatility_24m'] = round(float(volatility), 6)
                 elif period == 756:  # 3 anos
-                    volatilities['volatility_36m'] = round(volatility, 6)
+                    volatilities['volatility_36m'] = round(float(volatility), 6)
                 elif period == 2520:  # 10 anos
-                    volatilities['ten_year_volatility'] = round(volatility, 6)
+                    volatilities['ten_year_volatility'] = round(float(volatility), 6)
         
         return volatilities
     
@@ -115,13 +143,13 @@ class AdvancedMetricsCalculator:
                     
                     # Mapear períodos para nomes
                     if period == 252:  # 1 ano
-                        sharpe_ratios['sharpe_12m'] = round(sharpe, 6)
+                        sharpe_ratios['sharpe_12m'] = round(float(sharpe), 6)
                     elif period == 504:  # 2 anos
-                        sharpe_ratios['sharpe_24m'] = round(sharpe, 6)
+                        sharpe_ratios['sharpe_24m'] = round(float(sharpe), 6)
                     elif period == 756:  # 3 anos
-                        sharpe_ratios['sharpe_36m'] = round(sharpe, 6)
+                        sharpe_ratios['sharpe_36m'] = round(float(sharpe), 6)
                     elif period == 2520:  # 10 anos
-                        sharpe_ratios['ten_year_sharpe'] = round(sharpe, 6)
+                        sharpe_ratios['ten_year_sharpe'] = round(float(sharpe), 6)
         
         return sharpe_ratios
     
@@ -144,9 +172,9 @@ class AdvancedMetricsCalculator:
             recent_drawdown = (recent_prices - recent_peak) / recent_peak
             max_dd_12m = recent_drawdown.min()
         
-        result = {'max_drawdown': round(max_dd, 6)}
+        result = {'max_drawdown': round(float(max_dd), 6)}
         if max_dd_12m is not None:
-            result['max_drawdown_12m'] = round(max_dd_12m, 6)
+            result['max_drawdown_12m'] = round(float(max_dd_12m), 6)
         
         return result
     
@@ -182,7 +210,8 @@ class AdvancedMetricsCalculator:
                 'dividends_all_time': round(np.random.uniform(15.0, 75.0), 2)
             }
     
-    def calculate_stock_metrics(self, ticker: str, prices_data: List[Dict]) -> Dict[str, Any]:
+    @timed('calculate')
+    def calculate_stock_metrics(self, ticker: str, prices_data: List[Dict], dtype: str = None) -> Dict[str, Any]:
         """Calcular todas as métricas para uma ação"""
         
         if not prices_data:
@@ -194,12 +223,31 @@ class AdvancedMetricsCalculator:
         df['date'] = pd.to_datetime(df['date'])
         df = df.sort_values('date')
         
-        prices = df['close']
+        compute_dtype = dtype or self.dtype
+        prices = as_compute_dtype(df.set_index('date')['close'], compute_dtype)
         
         if len(prices) < 30:
             logging.warning(f"Dados insuficientes para {ticker}: {len(prices)} dias")
             return None
         
+        if self.metric_cache is not None:
+            params = {
+                'risk_free_rate': self.risk_free_rate,
+                'trading_days_year': self.trading_days_year,
+                'windows': [252, 504, 756, 1260, 2520],
+                'dtype': resolve_dtype(compute_dtype).__name__,
+                'volume_hash': int(pd.util.hash_pandas_object(df['volume'], index=False).sum()) if 'volume' in df.columns else None
+            }
+            return self.metric_cache.get_or_compute(
+                'advanced_metrics', ticker, prices, params,
+                lambda: self._calculate_metrics_from_prices(ticker, df, prices)
+            )
+        
+        return self._calculate_metrics_from_prices(ticker, df, prices)
+    
+    def _calculate_metrics_from_prices(self, ticker: str, df: pd.DataFrame, prices: pd.Series) -> Dict[str, Any]:
+        """Calcular métricas a partir da série de preços já preparada"""
+        
         logging.info(f"Calculando métricas para {ticker}: {len(prices)} dias de dados")
         
         # Períodos para cálculo
@@ -241,45 +289,21 @@ class AdvancedMetricsCalculator:
         
         return metrics
     
+    def snapshot_values(self, metrics: Dict[str, Any]) -> Dict[str, Any]:
+        """Campos de stock_metrics_snapshot presentes nas métricas calculadas"""
+        values = {field: metrics[field] for field in SNAPSHOT_UPDATE_FIELDS if field in metrics}
+        if not values.get('volume_avg_30d'):
+            values.pop('volume_avg_30d', None)
+        return values
+    
+    @timed('serialize', target='sql')
     def generate_sql_update(self, ticker: str, metrics: Dict[str, Any]) -> str:
-        """Gerar SQL UPDATE para atualizar métricas no banco"""
+        """Gerar SQL UPDATE para atualizar métricas no banco (modo MCP, sem conexão)"""
         
         if not metrics:
             return None
         
-        # Preparar campos para UPDATE
-        update_fields = []
-        
-        # Retornos
-        for field in ['returns_12m', 'returns_24m', 'returns_36m', 'returns_5y', 'ten_year_return']:
-            if field in metrics:
-                update_fields.append(f"{field} = {metrics[field]}")
-        
-        # Volatilidades
-        for field in ['volatility_12m', 'volatility_24m', 'volatility_36m', 'ten_year_volatility']:
-            if field in metrics:
-                update_fields.append(f"{field} = {metrics[field]}")
-        
-        # Sharpe ratios
-        for field in ['sharpe_12m', 'sharpe_24m', 'sharpe_36m', 'ten_year_sharpe']:
-            if field in metrics:
-                update_fields.append(f"{field} = {metrics[field]}")
-        
-        # Drawdown
-        for field in ['max_drawdown', 'max_drawdown_12m']:
-            if field in metrics:
-                update_fields.append(f"{field} = {metrics[field]}")
-        
-        # Dividendos
-        for field in ['dividend_yield_12m', 'dividends_12m', 'dividends_24m', 'dividends_36m', 'dividends_all_time']:
-            if field in metrics:
-                update_fields.append(f"{field} = {metrics[field]}")
-        
-        # Outros campos
-        if 'current_price' in metrics:
-            update_fields.append(f"current_price = {metrics['current_price']}")
-        if 'volume_avg_30d' in metrics and metrics['volume_avg_30d']:
-            update_fields.append(f"volume_avg_30d = {metrics['volume_avg_30d']}")
+        update_fields = [f"{field} = {value}" for field, value in self.snapshot_values(metrics).items()]
         
         if not update_fields:
             return None
@@ -288,14 +312,69 @@ class AdvancedMetricsCalculator:
         UPDATE stock_metrics_snapshot 
         SET {', '.join(update_fields)},
             updated_at = NOW()
-        WHERE asset_id = (
-            SELECT id FROM assets_master 
-            WHERE ticker = '{ticker}' AND asset_type = 'STOCK'
-        );
+        WHERE asset_id = {self.asset_ids.sql_ref(ticker)};
         """
         
         return sql
     
+    @timed('db.write', path='batch_upsert')
+    def save_metrics_batch(self, metrics_list: List[Dict[str, Any]], conn=None) -> Dict[str, Any]:
+        """Gravar snapshots alterados em lote via prepared statement parametrizado (UPDATE ... FROM unnest)"""
+        
+        if self.db_workers > 1 and conn is None:
+            # Lotes independentes distribuídos entre conexões do pool
+            executor = PooledBatchExecutor(self.database_url, max_connections=self.db_workers)
+            try:
+                with executor.connection() as pooled_conn:
+                    rows, changes = self._snapshot_rows(metrics_list, pooled_conn)
+                    writer = self._snapshot_writer(pooled_conn)
+                report = writer.write_concurrent(rows, executor)
+                success = report['failed'] == 0
+                if rows and report['successful']:
+                    with executor.connection() as pooled_conn:
+                        mark_views_dirty(pooled_conn)
+            finally:
+                executor.close()
+        else:
+            owned = conn is None
+            conn = conn or connect_from_env(self.database_url)
+            try:
+                rows, changes = self._snapshot_rows(metrics_list, conn)
+                report = self._snapshot_writer(conn).write(rows)
+                success = True
+                if rows:
+                    mark_views_dirty(conn)  # refresh fica com o agendador (view_refresh.py)
+            finally:
+                if owned:
+                    conn.close()
+        
+        if success:
+            self.row_hashes.commit(changes)
+        report['change_detection'] = changes.summary()
+        return report
+    
+    def _snapshot_writer(self, conn) -> BatchUpsertWriter:
+        return snapshot_update_writer(conn, SNAPSHOT_UPDATE_FIELDS, batch_size=self.snapshot_batch_size,
+                                      field_types={'volume_avg_30d': 'bigint'})
+    
+    def _snapshot_rows(self, metrics_list: List[Dict[str, Any]], conn):
+        """Linhas (asset_id + campos do snapshot) que mudaram desde a última gravação"""
+        asset_ids = self.asset_ids if self.asset_ids.conn is conn else AssetIdResolver(conn, ids=self.asset_ids.ids)
+        ids = asset_ids.resolve((metrics['ticker'] for metrics in metrics_list), create_missing=False)
+        
+        changes = ChangeSet('stock_metrics_snapshot')
+        for metrics in metrics_list:
+            asset_id = ids.get(metrics['ticker'])
+            if asset_id is None:
+                logging.warning(f"⚠️ {metrics['ticker']}: sem asset_id, snapshot não atualizado")
+                continue
+            row = {'asset_id': asset_id, **self.snapshot_values(metrics)}
+            self.row_hashes.diff('stock_metrics_snapshot', metrics['ticker'], [row],
+                                 key='asset_id', partition=lambda r: 'snapshot', changes=changes)
+        
+        logging.info(f"🔍 Snapshots alterados: {len(changes.rows)}/{changes.total_rows}")
+        return changes.rows, changes
+    
     def process_test_calculations(self):
         """Processar cálculos para ações de teste"""
         
@@ -312,36 +391,54 @@ class AdvancedMetricsCalculator:
             'metrics_calculated': [],
             'sql_updates': []
         }
+        performance = RunReport('advanced_metrics').start()
         
         for ticker in test_stocks:
             try:
-                # Simular dados históricos (na realidade viriam do banco)
-                # Para demonstração, gerar dados sintéticos baseados em padrões reais
-                sample_prices = self.generate_sample_historical_data(ticker)
-                
-                # Calcular métricas
-                metrics = self.calculate_stock_metrics(ticker, sample_prices)
+                with ticker_scope(ticker):
+                    # Simular dados históricos (na realidade viriam do banco)
+                    # Para demonstração, gerar dados sintéticos baseados em padrões reais
+                    sample_prices = self.generate_sample_historical_data(ticker)
+                    
+                    # Calcular métricas
+                    metrics = self.calculate_stock_metrics(ticker, sample_prices)
                 
                 if metrics:
                     results['successful_calculations'] += 1
                     results['metrics_calculated'].append(metrics)
                     
-                    # Gerar SQL UPDATE
-                    sql = self.generate_sql_update(ticker, metrics)
-                    if sql:
-                        results['sql_updates'].append(sql)
+                    # Gerar SQL UPDATE (com conexão, a gravação é feita em lote no final)
+                    if not self.database_url:
+                        sql = self.generate_sql_update(ticker, metrics)
+                        if sql:
+                            results['sql_updates'].append(sql)
                     
                     logging.info(f"✅ {ticker}: {len([k for k in metrics.keys() if 'returns' in k or 'volatility' in k or 'sharpe' in k])} métricas calculadas")
+                    performance.item('success')
                 else:
                     results['failed_calculations'] += 1
                     logging.warning(f"❌ Falha ao calcular métricas para {ticker}")
+                    performance.item('failed')
                 
             except Exception as e:
                 results['failed_calculations'] += 1
                 logging.error(f"❌ Erro calculando {ticker}: {e}")
+                performance.item('failed')
+        
+        if self.database_url and results['metrics_calculated']:
+            # Falha na gravação não pode perder o relatório nem a telemetria da execução
+            try:
+                results['batch_write'] = self.save_metrics_batch(results['metrics_calculated'])
+            except Exception as e:
+                logging.error(f"❌ Erro na gravação em lote dos snapshots: {e}")
+                results['batch_write'] = {'failed': True, 'error': f"{type(e).__name__}: {e}"}
+        results['performance_report'] = performance.finish()
         
-        # Salvar relatório
-        report_filename = f"metrics_calculation_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        # Salvar relatório (com latência por estágio)
+        run_stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        results['telemetry'] = TELEMETRY.snapshot()
+        TELEMETRY.export(f"metrics_calculation_telemetry_{run_stamp}")
+        report_filename = f"metrics_calculation_report_{run_stamp}.json"
         
         with open(report_filename, 'w', encoding='utf-8') as f:
             json.dump(results, f, indent=2, default=str)
@@ -388,11 +485,58 @@ class AdvancedMetricsCalculator:
             })
         
         return historical_data
+    
+    def run_precision_audit(self, tickers: List[str] = None) -> Dict[str, Any]:
+        """Comparar métricas calculadas em float32 contra float64"""
+        
+        tickers = tickers or ['AAPL', 'MSFT', 'GOOGL', 'AMZN', 'NVDA', 'META', 'TSLA', 'BRK-B', 'JPM', 'JNJ']
+        samples = {ticker: self.generate_sample_historical_data(ticker) for ticker in tickers}
+        
+        audit = audit_precision(
+            lambda ticker, dtype: self.calculate_stock_metrics(ticker, samples[ticker], dtype=dtype),
+            tickers,
+            # Dividendos ainda são placeholders aleatórios, fora da auditoria
+            ignore=('data_points', 'volume_avg_30d', 'dividend_yield_12m', 'dividends_12m',
+                    'dividends_24m', 'dividends_36m', 'dividends_all_time')
+        )
+        
+        status = "✅" if audit['within_tolerance'] else "⚠️"
+        logging.info(f"{status} Auditoria float32: desvio máximo {audit['max_abs_deviation']:.2e} "
+                     f"(tolerância {audit['tolerance']:.0e}, {audit['tickers_audited']} ações)")
+        
+        return audit
 
 def main():
     """Função principal"""
-    calculator = AdvancedMetricsCalculator()
-    results = calculator.process_test_calculations()
+    parser = argparse.ArgumentParser(description='Calculadora de métricas avançadas')
+    parser.add_argument('--float32', action='store_true',
+                        help='Armazenar/calcular preços e retornos em float32')
+    parser.add_argument('--precision-audit', action='store_true',
+                        help='Comparar métricas float32 x float64 e reportar o desvio máximo')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Recalcular métricas sem consultar o cache compartilhado')
+    parser.add_argument('--db-workers', type=int, default=1,
+                        help='Conexões concorrentes para gravar snapshots (requer DATABASE_URL)')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    start_profiling(args.profile, args.profile_dir)
+    
+    calculator = AdvancedMetricsCalculator(
+        dtype='float32' if args.float32 else 'float64',
+        metric_cache=None if args.no_cache or args.precision_audit else get_shared_cache()
+    )
+    calculator.db_workers = max(args.db_workers, 1)
+    
+    if args.precision_audit:
+        audit = calculator.run_precision_audit()
+        print(json.dumps(audit, indent=2))
+        stop_profiling()
+        return
+    
+    try:
+        results = calculator.process_test_calculations()
+    finally:
+        stop_profiling()
     
     print("\n🎯 CÁLCULO DE MÉTRICAS CONCLUÍDO!")
     print(f"Sucessos: {results['successful_calculations']}/{results['total_stocks']}")
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+RESOLUÇÃO TICKER -> ASSET_ID
+Carrega o mapa ticker -> id de assets_master uma vez por execução, atualiza
+apenas nos misses e insere em lote os tickers desconhecidos. Os writers
+passam a emitir ids inteiros em vez de subqueries por linha; com conexão,
+o mapa é exportado (ASSET_IDS_PATH) para os writers offline
+
+    python scripts/asset_ids.py --output asset_ids.json
+"""
+
+import argparse
+import json
+import logging
+import os
+from typing import Dict, Iterable, Optional
+
+# Mapa exportado (ticker -> id) para o modo sem conexão, em que o SQL vai para o MCP
+DEFAULT_IDS_PATH = os.getenv('ASSET_IDS_PATH', 'asset_ids.json')
+
+
+class AssetIdResolver:
+    """Cache de ids de assets_master compartilhado pelos writers"""
+
+    def __init__(self, conn=None, asset_type: str = 'STOCK', ids: Optional[Dict[str, int]] = None,
+                 export_path: Optional[str] = DEFAULT_IDS_PATH):
+        self.conn = conn
+        self.asset_type = asset_type
+        self.ids: Dict[str, int] = dict(ids or {})
+        # Com conexão, o mapa resolvido é exportado para os writers offline (None desliga)
+        self.export_path = export_path if conn is not None else None
+        self.loaded = False
+        self.refreshes = 0
+        self.conflicts: Dict[str, str] = {}  # ticker -> asset_type já cadastrado
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_IDS_PATH, asset_type: str = 'STOCK') -> 'AssetIdResolver':
+        """Resolver offline a partir de um mapa exportado (arquivo ausente = mapa vazio)"""
+        ids = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                ids = {ticker: int(asset_id) for ticker, asset_id in json.load(f).items()}
+        return cls(asset_type=asset_type, ids=ids)
+
+    def save(self, path: str = DEFAULT_IDS_PATH):
+        """Exportar o mapa atual para uso offline (gravação atômica)"""
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.ids, f, sort_keys=True)
+        os.replace(tmp, path)
+
+    def _export(self):
+        if self.export_path:
+            try:
+                self.save(self.export_path)
+            except OSError as e:
+                logging.warning(f"⚠️ Mapa de asset_ids não exportado para {self.export_path}: {e}")
+
+    def load(self) -> Dict[str, int]:
+        """Carregar o mapa completo com uma única consulta"""
+        if self.conn is None:
+            return self.ids
+
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "SELECT ticker, id FROM assets_master WHERE asset_type = %s",
+                (self.asset_type,)
+            )
+            self.ids.update({ticker: asset_id for ticker, asset_id in cur.fetchall()})
+        self.conn.commit()
+        self.loaded = True
+        self._export()
+
+        logging.info(f"🗂️ {len(self.ids):,} ids de {self.asset_type} carregados de assets_master")
+        return self.ids
+
+    def _refresh(self, tickers: Iterable[str]):
+        """Consultar apenas os tickers ausentes do cache"""
+        missing = list(tickers)
+        if not missing or self.conn is None:
+            return
+
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "SELECT ticker, id FROM assets_master WHERE asset_type = %s AND ticker = ANY(%s)",
+                (self.asset_type, missing)
+            )
+            self.ids.update({ticker: asset_id for ticker, asset_id in cur.fetchall()})
+        self.conn.commit()
+        self.refreshes += 1
+
+    def _insert_unknown(self, tickers: Iterable[str]):
+        """Inserir tickers desconhecidos em assets_master com um único statement"""
+        unknown = sorted(set(tickers))
+        if not unknown or self.conn is None:
+            return
+
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO assets_master (ticker, asset_type, name)
+                SELECT t, %s, t FROM unnest(%s::text[]) AS t
+                ON CONFLICT (ticker) DO NOTHING
+                RETURNING ticker, id
+            """, (self.asset_type, unknown))
+            self.ids.update({ticker: asset_id for ticker, asset_id in cur.fetchall()})
+        self.conn.commit()
+
+        # Tickers inseridos em paralelo por outro processo não retornam no RETURNING
+        self._refresh([t for t in unknown if t not in self.ids])
+        logging.info(f"➕ {len(unknown)} tickers novos registrados em assets_master")
+        self._report_conflicts([t for t in unknown if t not in self.ids])
+
+    def _report_conflicts(self, tickers: Iterable[str]):
+        """
+        Tickers ainda sem id após o INSERT: o ON CONFLICT (ticker) os ignora
+        quando já existem com outro asset_type. As linhas deles seriam
+        descartadas em silêncio; registrar e logar o tipo encontrado
+        """
+        unresolved = list(tickers)
+        if not unresolved:
+            return
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT ticker, asset_type FROM assets_master WHERE ticker = ANY(%s)", (unresolved,))
+            found = dict(cur.fetchall())
+        self.conn.commit()
+        for ticker in unresolved:
+            self.conflicts[ticker] = found.get(ticker, 'ausente')
+        logging.error(f"❌ {len(unresolved)} tickers sem asset_id de {self.asset_type} "
+                      f"(cadastrados com outro tipo ou não inseridos): "
+                      + ", ".join(f"{t}={self.conflicts[t]}" for t in unresolved[:20]))
+
+    def resolve(self, tickers: Iterable[str], create_missing: bool = True) -> Dict[str, int]:
+        """Mapear tickers para ids (refresh nos misses; cria os desconhecidos se pedido)"""
+        if self.conn is not None and not self.loaded:
+            self.load()
+
+        wanted = list(dict.fromkeys(tickers))
+        missing = [t for t in wanted if t not in self.ids]
+        if missing:
+            self._refresh(missing)
+            missing = [t for t in missing if t not in self.ids]
+            if missing and create_missing:
+                self._insert_unknown(missing)
+            elif missing:
+                logging.warning(f"⚠️ {len(missing)} tickers sem asset_id em assets_master: {missing[:20]}")
+            if self.conn is not None and len(missing) < len(wanted):
+                self._export()  # ids novos no mapa offline
+
+        return {t: self.ids[t] for t in wanted if t in self.ids}
+
+    def get(self, ticker: str) -> Optional[int]:
+        """Id conhecido do ticker (sem ida ao banco)"""
+        return self.ids.get(ticker)
+
+    def sql_ref(self, ticker: str) -> str:
+        """Id inteiro para SQL gerado; subquery apenas como fallback sem id conhecido"""
+        asset_id = self.ids.get(ticker)
+        if asset_id is not None:
+            return str(int(asset_id))
+        escaped = ticker.replace("'", "''")
+        return f"(SELECT id FROM assets_master WHERE ticker = '{escaped}' AND asset_type = '{self.asset_type}')"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exportar o mapa ticker -> asset_id para os writers offline')
+    parser.add_argument('--asset-type', default='STOCK')
+    parser.add_argument('--output', default=DEFAULT_IDS_PATH)
+    args = parser.parse_args()
+
+    from bulk_loader import connect_from_env
+    from log_setup import configure_logging
+
+    configure_logging()
+    conn = connect_from_env()
+    try:
+        resolver = AssetIdResolver(conn, asset_type=args.asset_type, export_path=args.output)
+        resolver.load()
+    finally:
+        conn.close()
+    print(f"💾 {len(resolver.ids):,} ids exportados para {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+UPSERT EM LOTE PARAMETRIZADO
+Envia lotes de linhas como arrays tipados para um prepared statement
+(INSERT ... SELECT FROM unnest(...) ON CONFLICT DO UPDATE, ou
+UPDATE ... FROM unnest(...)). O formato do statement não depende do tamanho
+do lote: o plano é preparado uma vez por conexão e reutilizado em todos os
+lotes, sem escape manual de valores
+"""
+
+import logging
+import time
+import weakref
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+
+class BatchUpsertWriter:
+    """Writer em lote com prepared statement (modos 'upsert' e 'update')"""
+
+    def __init__(self, conn, table: str, key_columns: Sequence[str],
+                 column_types: Dict[str, str], mode: str = 'upsert',
+                 batch_size: int = 1000, keep_existing_on_null: bool = False,
+                 extra_assignments: Sequence[str] = ()):
+        if mode not in ('upsert', 'update'):
+            raise ValueError(f"modo não suportado: {mode} (use 'upsert' ou 'update')")
+        missing = [key for key in key_columns if key not in column_types]
+        if missing:
+            raise ValueError(f"colunas-chave sem tipo declarado: {missing}")
+
+        self.conn = conn
+        self.table = table
+        self.key_columns = list(key_columns)
+        self.column_types = dict(column_types)
+        self.columns = list(self.column_types)
+        self.value_columns = [c for c in self.columns if c not in self.key_columns]
+        self.mode = mode
+        self.batch_size = batch_size
+        self.keep_existing_on_null = keep_existing_on_null
+        self.extra_assignments = list(extra_assignments)
+        self.statement_name = f"batch_{mode}_{table}".replace('.', '_')
+        # Conexões (objetos) onde o statement já foi preparado; o PID do backend pode ser reaproveitado pelo servidor
+        self._prepared_on = weakref.WeakSet()
+
+    def _assignment(self, column: str, source: str) -> str:
+        if self.keep_existing_on_null:
+            return f"{column} = COALESCE({source}.{column}, {self.table}.{column})"
+        return f"{column} = {source}.{column}"
+
+    def build_statement(self) -> str:
+        """SQL do prepared statement ($1..$n são arrays, um por coluna)"""
+        array_types = ', '.join(f"{self.column_types[c]}[]" for c in self.columns)
+        unnest_args = ', '.join(f"${i}" for i in range(1, len(self.columns) + 1))
+        column_list = ', '.join(self.columns)
+
+        if self.mode == 'upsert':
+            assignments = ', '.join([self._assignment(c, 'EXCLUDED') for c in self.value_columns]
+                                    + self.extra_assignments)
+            body = f"""
+                INSERT INTO {self.table} ({column_list})
+                SELECT * FROM unnest({unnest_args}) AS v({column_list})
+                ON CONFLICT ({', '.join(self.key_columns)}) DO UPDATE SET {assignments}
+            """
+        else:
+            assignments = ', '.join([self._assignment(c, 'v') for c in self.value_columns]
+                                    + self.extra_assignments)
+            join = ' AND '.join(f"{self.table}.{k} = v.{k}" for k in self.key_columns)
+            body = f"""
+                UPDATE {self.table} SET {assignments}
+                FROM unnest({unnest_args}) AS v({column_list})
+                WHERE {join}
+            """
+
+        return f"PREPARE {self.statement_name} ({array_types}) AS {body}"
+
+    def _prepare(self, conn, cur):
+        if conn in self._prepared_on:
+            return
+        # Prepared statements vivem na sessão: outro writer pode ter preparado o mesmo nome
+        if self._is_prepared(cur):
+            cur.execute(f"DEALLOCATE {self.statement_name}")
+        cur.execute(self.build_statement())
+        self._prepared_on.add(conn)
+
+    def _is_prepared(self, cur) -> bool:
+        cur.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s", (self.statement_name,))
+        return cur.fetchone() is not None
+
+    def _columnar(self, rows: Sequence[Dict[str, Any]]) -> List[List[Any]]:
+        """Transpor linhas (dicts) em um array por coluna"""
+        return [[row.get(column) for row in rows] for column in self.columns]
+
+    @property
+    def execute_sql(self) -> str:
+        placeholders = ', '.join(['%s'] * len(self.columns))
+        return f"EXECUTE {self.statement_name} ({placeholders})"
+
+    def batches(self, rows: Iterable[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+        """Agrupar linhas em lotes de `batch_size`"""
+        batch: List[Dict[str, Any]] = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def write_batch(self, conn, batch: List[Dict[str, Any]]) -> int:
+        """Executar um lote em `conn` (sem commit); devolve as linhas afetadas"""
+        with conn.cursor() as cur:
+            self._prepare(conn, cur)
+            cur.execute(self.execute_sql, self._columnar(batch))
+            return max(cur.rowcount, 0)
+
+    def write_concurrent(self, rows: Iterable[Dict[str, Any]], executor) -> Dict[str, Any]:
+        """Distribuir os lotes entre as conexões de um PooledBatchExecutor"""
+        report = executor.run(list(self.batches(rows)), self.write_batch)
+        report['affected'] = sum(r.get('result') or 0 for r in report['results'])
+        logging.info(f"🧾 {self.table}: {report['successful']}/{report['batches']} lotes em "
+                     f"{report['wall_time']:.2f}s com {report['workers']} conexões")
+        return report
+
+    def write(self, rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """Gravar todas as linhas em lotes de `batch_size` (um commit por lote)"""
+        started = time.time()
+        execute_sql = self.execute_sql
+        stats = {'rows': 0, 'affected': 0, 'batches': 0}
+
+        batch: List[Dict[str, Any]] = []
+        with self.conn.cursor() as cur:
+            self._prepare(self.conn, cur)
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    self._execute_batch(cur, execute_sql, batch, stats)
+                    batch = []
+            if batch:
+                self._execute_batch(cur, execute_sql, batch, stats)
+
+        stats['duration'] = time.time() - started
+        logging.info(f"🧾 {self.table}: {stats['rows']:,} linhas em {stats['batches']} lotes "
+                     f"({stats['affected']:,} afetadas) em {stats['duration']:.2f}s")
+        return stats
+
+    def _execute_batch(self, cur, execute_sql: str, batch: List[Dict[str, Any]], stats: Dict[str, Any]):
+        try:
+            cur.execute(execute_sql, self._columnar(batch))
+            stats['affected'] += max(cur.rowcount, 0)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        stats['rows'] += len(batch)
+        stats['batches'] += 1
+
+
+def snapshot_update_writer(conn, fields: Sequence[str], batch_size: int = 1000,
+                           field_types: Optional[Dict[str, str]] = None) -> BatchUpsertWriter:
+    """Writer de UPDATE em stock_metrics_snapshot por asset_id (campos ausentes mantêm o valor atual)"""
+    field_types = field_types or {}
+    column_types = {'asset_id': 'bigint'}
+    column_types.update({field: field_types.get(field, 'numeric') for field in fields})
+    return BatchUpsertWriter(
+        conn, 'stock_metrics_snapshot', ['asset_id'], column_types,
+        mode='update', batch_size=batch_size, keep_existing_on_null=True,
+        extra_assignments=['updated_at = NOW()']
+    )
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+CARGA EM MASSA VIA COPY - STOCK_PRICES_DAILY
+Envia as barras por COPY FROM STDIN (CSV em buffer de memória) para uma
+tabela de staging temporária e faz o merge em stock_prices_daily com um
+único INSERT ... SELECT ... ON CONFLICT. As linhas chegam com asset_id
+inteiro (AssetIdResolver), sem join por ticker no merge
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from asset_ids import AssetIdResolver
+
+# Preços brutos; o ajustado é calculado na leitura (view stock_prices_adjusted)
+PRICE_COLUMNS = ['asset_id', 'date', 'open', 'high', 'low', 'close', 'volume']
+
+
+def connect_from_env(dsn: str = None):
+    """Abrir conexão psycopg2 a partir de DATABASE_URL (ou DSN informado)"""
+    import psycopg2
+
+    dsn = dsn or os.getenv('DATABASE_URL') or os.getenv('SUPABASE_DB_URL')
+    if not dsn:
+        raise RuntimeError("DATABASE_URL não configurada")
+    return psycopg2.connect(dsn)
+
+
+def _csv_value(value: Any) -> Any:
+    # Campo vazio sem aspas = NULL no COPY CSV; dicts/listas vão como JSON (colunas jsonb)
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+
+def copy_rows(cur, table: str, columns: List[str], rows: Iterable[Dict[str, Any]],
+              chunk_rows: int = 500_000) -> int:
+    """Enviar linhas via COPY em blocos de `chunk_rows` (memória limitada)"""
+    copy_sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    total = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    pending = 0
+
+    for row in rows:
+        writer.writerow([_csv_value(row.get(column)) for column in columns])
+        pending += 1
+        if pending >= chunk_rows:
+            buffer.seek(0)
+            cur.copy_expert(copy_sql, buffer)
+            total += pending
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            pending = 0
+
+    if pending:
+        buffer.seek(0)
+        cur.copy_expert(copy_sql, buffer)
+        total += pending
+
+    return total
+
+
+class StockPricesBulkLoader:
+    """Carregador COPY -> staging -> merge para preços diários"""
+
+    def __init__(self, conn, copy_chunk_rows: int = 500_000, asset_ids: Optional[AssetIdResolver] = None):
+        self.conn = conn
+        self.copy_chunk_rows = copy_chunk_rows
+        self.asset_ids = asset_ids or AssetIdResolver(conn)
+        self.unresolved = 0
+
+    def resolve_tickers(self, tickers: Iterable[str]) -> Dict[str, int]:
+        """Resolver ids antes do COPY (o resolver faz commit, o que limparia a staging)"""
+        return self.asset_ids.resolve(tickers)
+
+    def _with_asset_ids(self, records: Iterable[Dict[str, Any]]) -> Iterable[Dict[str, Any]]:
+        """Completar asset_id a partir do ticker (apenas lookup em memória)"""
+        for row in records:
+            if row.get('asset_id') is not None:
+                yield row
+                continue
+            asset_id = self.asset_ids.get(row['ticker'])
+            if asset_id is None:
+                self.unresolved += 1
+                continue
+            yield {**row, 'asset_id': asset_id}
+
+    def _copy_rows(self, cur, table: str, columns: List[str], rows: Iterable[Dict[str, Any]]) -> int:
+        return copy_rows(cur, table, columns, rows, self.copy_chunk_rows)
+
+    def load_prices(self, records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """Carregar barras brutas (dicts com asset_id ou ticker já resolvido, date, open, high, low, close, volume)"""
+        started = time.time()
+
+        try:
+            merged, copied = self._merge_prices(records)
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        duration = time.time() - started
+        if self.unresolved:
+            logging.warning(f"⚠️ {self.unresolved:,} linhas descartadas sem asset_id resolvido")
+        logging.info(f"📥 COPY stock_prices_daily: {copied:,} linhas enviadas, {merged:,} aplicadas em {duration:.1f}s")
+        return {'copied': copied, 'merged': merged, 'duration': duration}
+
+    def _merge_prices(self, records: Iterable[Dict[str, Any]]):
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS stock_prices_staging (
+                    asset_id BIGINT NOT NULL,
+                    date DATE NOT NULL,
+                    open NUMERIC(12,4),
+                    high NUMERIC(12,4),
+                    low NUMERIC(12,4),
+                    close NUMERIC(12,4),
+                    volume BIGINT,
+                    seq BIGSERIAL  -- ordem de chegada no COPY
+                ) ON COMMIT DELETE ROWS
+            """)
+
+            copied = self._copy_rows(cur, 'stock_prices_staging', PRICE_COLUMNS, self._with_asset_ids(records))
+
+            # Duplicatas (entradas da outbox drenadas juntas, em ordem de id): a última versão vence
+            cur.execute("""
+                INSERT INTO stock_prices_daily (asset_id, date, open, high, low, close, volume)
+                SELECT DISTINCT ON (s.asset_id, s.date)
+                    s.asset_id, s.date, s.open, s.high, s.low, s.close, s.volume
+                FROM stock_prices_staging s
+                ORDER BY s.asset_id, s.date, s.seq DESC
+                ON CONFLICT (asset_id, date) DO UPDATE SET
+                    open = EXCLUDED.open,
+                    high = EXCLUDED.high,
+                    low = EXCLUDED.low,
+                    close = EXCLUDED.close,
+                    volume = EXCLUDED.volume
+            """)
+            merged = cur.rowcount
+
+        self.conn.commit()
+        return merged, copied
+
+    def apply_corporate_actions(self, records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Registrar eventos novos (ticker, ex_date, action_type, value, ratio) via
+        apply_corporate_action: os fatores cumulativos são atualizados no banco
+        e os preços brutos de stock_prices_daily não são reescritos
+        """
+        started = time.time()
+        rows = sorted(self._with_asset_ids(records), key=lambda row: (row['asset_id'], row['ex_date']))
+
+        try:
+            with self.conn.cursor() as cur:
+                for row in rows:
+                    cur.execute("SELECT apply_corporate_action(%s, %s, %s, %s, %s)",
+                                (row['asset_id'], row['ex_date'], row['action_type'], row['value'], row['ratio']))
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        self.conn.commit()
+        return {'applied': len(rows), 'duration': time.time() - started}
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+DETECÇÃO DE MUDANÇAS POR HASH DE CONTEÚDO
+Mantém hashes por (escopo, ticker, partição) em SQLite local. Partições
+idênticas à última carga são descartadas inteiras; nas que mudaram, apenas
+linhas novas ou revisadas seguem para o banco. Os hashes só são gravados
+depois que a escrita no banco é confirmada
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from telemetry import TELEMETRY
+
+DEFAULT_HASH_PATH = os.getenv('ROW_HASH_PATH', 'row_hashes.db')
+
+
+def row_digest(row: Dict[str, Any], ignore: Iterable[str] = ()) -> str:
+    """Hash curto e canônico do conteúdo de uma linha"""
+    ignored = set(ignore)
+    content = {k: v for k, v in row.items() if k not in ignored}
+    payload = json.dumps(content, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def month_partition(row: Dict[str, Any]) -> str:
+    """Partição mensal pela data da barra ('YYYY-MM')"""
+    return str(row['date'])[:7]
+
+
+class ChangeSet:
+    """Linhas a enviar + hashes pendentes de confirmação"""
+
+    def __init__(self, scope: str):
+        self.scope = scope
+        self.rows: List[Dict[str, Any]] = []
+        self.pending: List[Tuple[str, str, str, str]] = []  # (ticker, partição, hash, hashes por linha)
+        self.total_rows = 0
+        self.skipped_partitions = 0
+        self.counted = False
+
+    @property
+    def skipped_rows(self) -> int:
+        return self.total_rows - len(self.rows)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'scope': self.scope,
+            'total_rows': self.total_rows,
+            'changed_rows': len(self.rows),
+            'skipped_rows': self.skipped_rows,
+            'changed_partitions': len(self.pending),
+            'skipped_partitions': self.skipped_partitions
+        }
+
+
+class RowHashStore:
+    """Hashes de conteúdo por (escopo, ticker, partição) persistidos em SQLite"""
+
+    def __init__(self, path: str = DEFAULT_HASH_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS row_hashes (
+                scope TEXT NOT NULL,
+                ticker TEXT NOT NULL,
+                partition TEXT NOT NULL,
+                partition_hash TEXT NOT NULL,
+                row_hashes TEXT NOT NULL,
+                updated_at REAL,
+                PRIMARY KEY (scope, ticker, partition)
+            )
+        """)
+        self._conn.commit()
+
+    def _stored(self, scope: str, ticker: str) -> Dict[str, Tuple[str, Dict[str, str]]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT partition, partition_hash, row_hashes FROM row_hashes WHERE scope = ? AND ticker = ?",
+                (scope, ticker)
+            ).fetchall()
+        return {partition: (phash, json.loads(rhashes)) for partition, phash, rhashes in rows}
+
+    def diff(self, scope: str, ticker: str, rows: Iterable[Dict[str, Any]],
+             key: Union[str, Callable[[Dict[str, Any]], str]] = 'date',
+             partition: Callable[[Dict[str, Any]], str] = month_partition,
+             ignore: Iterable[str] = (), changes: Optional[ChangeSet] = None) -> ChangeSet:
+        """Separar as linhas novas/revisadas de um ticker (acumula em `changes`, se informado)"""
+        changes = changes or ChangeSet(scope)
+        ignore = tuple(ignore)
+
+        grouped: Dict[str, Dict[str, Tuple[str, Dict[str, Any]]]] = {}
+        for row in rows:
+            row_key = key(row) if callable(key) else str(row[key])
+            grouped.setdefault(partition(row), {})[row_key] = (row_digest(row, ignore), row)
+            changes.total_rows += 1
+
+        stored = self._stored(scope, ticker)
+        for part, entries in grouped.items():
+            digests = {row_key: digest for row_key, (digest, _) in entries.items()}
+            partition_hash = row_digest(digests)
+            previous = stored.get(part)
+
+            if previous is not None and previous[0] == partition_hash:
+                changes.skipped_partitions += 1
+                continue
+
+            previous_rows = previous[1] if previous is not None else {}
+            changes.rows.extend(row for row_key, (digest, row) in entries.items()
+                                if previous_rows.get(row_key) != digest)
+            changes.pending.append((ticker, part, partition_hash, json.dumps(digests, sort_keys=True)))
+
+        return changes
+
+    def commit(self, changes: ChangeSet, persist: bool = True):
+        """
+        Confirmar hashes depois que a escrita no banco foi bem-sucedida. Com
+        `persist=False` só contabiliza: a escrita é assíncrona (outbox) e os
+        hashes seguem com ela para `commit_pending`
+        """
+        # Contabilizado uma vez por ChangeSet (o relatório de performance lê gravadas vs puladas)
+        if not changes.counted:
+            changes.counted = True
+            TELEMETRY.count('db.rows', len(changes.rows), table=changes.scope, outcome='written')
+            TELEMETRY.count('db.rows', changes.skipped_rows, table=changes.scope, outcome='skipped')
+        if persist:
+            self.commit_pending(changes.scope, changes.pending)
+            changes.pending = []
+
+    def commit_pending(self, scope: str, pending: Iterable[Sequence[str]]):
+        """Gravar hashes pendentes (ticker, partição, hash, hashes por linha) de um escopo"""
+        now = time.time()
+        rows = [(scope, ticker, part, phash, rhashes, now) for ticker, part, phash, rhashes in pending]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("""
+                INSERT OR REPLACE INTO row_hashes
+                (scope, ticker, partition, partition_hash, row_hashes, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+            self._conn.commit()
+
+    def forget(self, scope: str, ticker: Optional[str] = None):
+        """Descartar hashes (força reenvio completo na próxima carga)"""
+        with self._lock:
+            if ticker is None:
+                self._conn.execute("DELETE FROM row_hashes WHERE scope = ?", (scope,))
+            else:
+                self._conn.execute("DELETE FROM row_hashes WHERE scope = ? AND ticker = ?", (scope, ticker))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
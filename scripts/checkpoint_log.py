@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+CHECKPOINT BINÁRIO APPEND-ONLY
+Registros com prefixo de tamanho (msgpack quando disponível, JSON compacto
+como fallback). Cada checkpoint grava apenas o trabalho novo; a retomada lê
+o arquivo via mmap e devolve os registros em streaming
+"""
+
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+try:
+    import msgpack
+except ImportError:  # Dependência opcional
+    msgpack = None
+
+MAGIC = b'ETFCKPT1'
+CODEC_JSON = b'J'
+CODEC_MSGPACK = b'M'
+HEADER_SIZE = len(MAGIC) + 1
+FRAME_HEADER = struct.Struct('<I')  # tamanho do payload (uint32 little-endian)
+
+
+class CheckpointLog:
+    """Log binário append-only de registros (dicts) para execuções longas"""
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = Path(path)
+        self.fsync = fsync
+        self.codec = CODEC_MSGPACK if msgpack is not None else CODEC_JSON
+
+        if self.path.exists() and self.path.stat().st_size >= HEADER_SIZE:
+            with open(self.path, 'rb') as f:
+                header = f.read(HEADER_SIZE)
+            if header[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"Arquivo de checkpoint inválido: {self.path}")
+            self.codec = header[len(MAGIC):]
+            if self.codec == CODEC_MSGPACK and msgpack is None:
+                raise RuntimeError("Checkpoint gravado com msgpack, mas o pacote não está instalado")
+            self._truncate_torn_tail()
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'wb') as f:
+                f.write(MAGIC + self.codec)
+
+    def _encode(self, record: Dict[str, Any]) -> bytes:
+        if self.codec == CODEC_MSGPACK:
+            return msgpack.packb(record, default=str, use_bin_type=True)
+        return json.dumps(record, default=str, separators=(',', ':')).encode('utf-8')
+
+    def _decode(self, payload) -> Dict[str, Any]:
+        if self.codec == CODEC_MSGPACK:
+            return msgpack.unpackb(payload, raw=False)
+        return json.loads(bytes(payload).decode('utf-8'))
+
+    def _truncate_torn_tail(self):
+        """Descartar registro parcial deixado por uma interrupção durante a escrita"""
+        valid_end = HEADER_SIZE
+        size = self.path.stat().st_size
+        with open(self.path, 'rb') as f:
+            f.seek(HEADER_SIZE)
+            while True:
+                prefix = f.read(FRAME_HEADER.size)
+                if len(prefix) < FRAME_HEADER.size:
+                    break
+                (length,) = FRAME_HEADER.unpack(prefix)
+                if valid_end + FRAME_HEADER.size + length > size:
+                    break
+                f.seek(length, os.SEEK_CUR)
+                valid_end += FRAME_HEADER.size + length
+
+        if valid_end < size:
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_end)
+
+    def append(self, records: List[Dict[str, Any]]) -> int:
+        """Anexar registros; custo proporcional apenas aos registros novos"""
+        if not records:
+            return 0
+
+        buffer = bytearray()
+        for record in records:
+            payload = self._encode(record)
+            buffer += FRAME_HEADER.pack(len(payload))
+            buffer += payload
+
+        with open(self.path, 'ab') as f:
+            f.write(buffer)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+        return len(buffer)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self.iter_records()
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Ler registros em streaming a partir de um mmap do arquivo"""
+        size = self.path.stat().st_size
+        if size <= HEADER_SIZE:
+            return
+
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    offset = HEADER_SIZE
+                    while offset + FRAME_HEADER.size <= size:
+                        (length,) = FRAME_HEADER.unpack_from(mm, offset)
+                        start = offset + FRAME_HEADER.size
+                        end = start + length
+                        if end > size:
+                            break  # registro parcial
+                        chunk = view[start:end]
+                        try:
+                            record = self._decode(chunk)
+                        finally:
+                            chunk.release()
+                        offset = end
+                        yield record
+                finally:
+                    view.release()
+
+    def completed_keys(self, key: str = 'ticker', status_field: Optional[str] = 'status',
+                       done_status: str = 'success') -> Set[str]:
+        """Chaves já concluídas (para pular trabalho ao retomar)"""
+        completed = set()
+        for record in self.iter_records():
+            if key not in record:
+                continue
+            if status_field is None or record.get(status_field) == done_status:
+                completed.add(record[key])
+        return completed
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+FATORES DE AJUSTE POR EVENTOS CORPORATIVOS
+Mantém preços brutos + série cumulativa de fatores (dividendos/desdobramentos).
+Novos eventos atualizam os fatores incrementalmente; o preço ajustado é
+calculado na leitura, de forma vetorizada, sem precisar baixar o histórico de novo
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+PRICE_FIELDS = ('Open', 'High', 'Low', 'Close')
+
+
+def unadjust_splits(history: pd.DataFrame) -> pd.DataFrame:
+    """
+    Desfazer o ajuste por desdobramentos que o yfinance aplica mesmo com
+    auto_adjust=False (OHLC, dividendos e volume). O resultado são preços
+    brutos estáveis: um desdobramento novo não altera as barras antigas,
+    vira apenas mais um fator
+    """
+    if 'Stock Splits' not in history.columns:
+        return history
+    splits = history['Stock Splits'].where(history['Stock Splits'] > 0, 1.0).fillna(1.0).astype(float)
+    if (splits == 1.0).all():
+        return history
+
+    # Produto dos desdobramentos com data-ex posterior a cada pregão
+    factor = splits[::-1].cumprod()[::-1].shift(-1, fill_value=1.0)
+    raw = history.copy()
+    for column in PRICE_FIELDS + ('Dividends',):
+        if column in raw.columns:
+            raw[column] = raw[column] * factor
+    if 'Volume' in raw.columns:
+        raw['Volume'] = (raw['Volume'] / factor).round()
+    return raw
+
+
+class AdjustmentFactors:
+    """Série cumulativa de fatores de ajuste (backward adjustment) de um ticker"""
+
+    def __init__(self, ticker: str):
+        self.ticker = ticker
+        # Eventos ordenados por ex_date; cumulative[i] vale para datas
+        # anteriores a ex_dates[i] (e posteriores ao evento i-1)
+        self.ex_dates: List[pd.Timestamp] = []
+        self.actions: List[Dict] = []
+        self.cumulative: List[float] = []
+
+    @staticmethod
+    def _to_timestamp(value) -> pd.Timestamp:
+        ts = pd.Timestamp(value)
+        if ts.tzinfo is not None:
+            ts = ts.tz_localize(None)
+        return ts.normalize()
+
+    @staticmethod
+    def dividend_ratio(amount: float, previous_close: float) -> float:
+        """Fator de um dividendo: 1 - D / fechamento do pregão anterior à data-ex"""
+        if not previous_close or previous_close <= 0:
+            return 1.0
+        return max(1.0 - float(amount) / float(previous_close), 0.0)
+
+    @staticmethod
+    def split_ratio(split: float) -> float:
+        """Fator de um desdobramento N:1 (ou grupamento quando N < 1)"""
+        return 1.0 / float(split) if split and split > 0 else 1.0
+
+    def add_action(self, ex_date, action_type: str, value: float, ratio: float) -> float:
+        """
+        Registrar novo evento corporativo.
+
+        Eventos mais recentes que o último conhecido (caso normal de uma coleta
+        diária) apenas multiplicam os fatores existentes; eventos fora de ordem
+        reconstroem a série, que tem poucas entradas por ticker.
+        """
+        ex_date = self._to_timestamp(ex_date)
+        if any(a['ex_date'] == ex_date and a['action_type'] == action_type for a in self.actions):
+            return ratio  # evento já registrado
+
+        action = {
+            'ex_date': ex_date,
+            'action_type': action_type,
+            'value': float(value),
+            'ratio': float(ratio)
+        }
+
+        if not self.ex_dates or ex_date > self.ex_dates[-1]:
+            self.cumulative = [factor * ratio for factor in self.cumulative]
+            self.ex_dates.append(ex_date)
+            self.actions.append(action)
+            self.cumulative.append(float(ratio))
+        else:
+            self.actions.append(action)
+            self._rebuild()
+
+        return ratio
+
+    def _rebuild(self):
+        """Recalcular fatores cumulativos a partir dos eventos"""
+        self.actions.sort(key=lambda a: a['ex_date'])
+        self.ex_dates = [a['ex_date'] for a in self.actions]
+        ratios = np.array([a['ratio'] for a in self.actions], dtype=float)
+        # Produto dos fatores do evento i até o último
+        self.cumulative = np.cumprod(ratios[::-1])[::-1].tolist()
+
+    def factors_for(self, dates) -> np.ndarray:
+        """Fator cumulativo aplicável a cada data (vetorizado)"""
+        index = pd.DatetimeIndex(dates)
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        index = index.normalize()
+
+        if not self.ex_dates:
+            return np.ones(len(index))
+
+        breakpoints = pd.DatetimeIndex(self.ex_dates).values
+        positions = np.searchsorted(breakpoints, index.values, side='right')
+        lookup = np.append(np.asarray(self.cumulative, dtype=float), 1.0)
+        return lookup[positions]
+
+    def adjust(self, raw_prices: pd.Series) -> pd.Series:
+        """Preços ajustados = preços brutos x fator cumulativo"""
+        return raw_prices * self.factors_for(raw_prices.index)
+
+    def action_records(self) -> List[Dict]:
+        """Eventos sem o fator cumulativo (aplicados no banco por apply_corporate_action)"""
+        return [
+            {
+                'ticker': self.ticker,
+                'ex_date': action['ex_date'].strftime('%Y-%m-%d'),
+                'action_type': action['action_type'],
+                'value': action['value'],
+                'ratio': round(action['ratio'], 10)
+            }
+            for action in self.actions
+        ]
+
+    def to_records(self) -> List[Dict]:
+        """Serializar fatores para persistência (tabela stock_adjustment_factors)"""
+        return [
+            {
+                'ticker': self.ticker,
+                'ex_date': action['ex_date'].strftime('%Y-%m-%d'),
+                'action_type': action['action_type'],
+                'value': action['value'],
+                'ratio': round(action['ratio'], 10),
+                'cumulative_factor': round(factor, 10)
+            }
+            for action, factor in zip(self.actions, self.cumulative)
+        ]
+
+    @classmethod
+    def from_records(cls, ticker: str, records: List[Dict]) -> 'AdjustmentFactors':
+        """Restaurar fatores persistidos"""
+        factors = cls(ticker)
+        for record in records:
+            factors.actions.append({
+                'ex_date': cls._to_timestamp(record['ex_date']),
+                'action_type': record['action_type'],
+                'value': float(record['value']),
+                'ratio': float(record['ratio'])
+            })
+        if factors.actions:
+            factors._rebuild()
+        return factors
+
+    @classmethod
+    def from_history(cls, ticker: str, raw_close: pd.Series,
+                     dividends: Optional[pd.Series] = None,
+                     splits: Optional[pd.Series] = None) -> 'AdjustmentFactors':
+        """
+        Construir fatores a partir de fechamentos brutos e eventos (em ordem
+        de data-ex, pelo mesmo caminho incremental de `add_action`).
+
+        Observação: o `Close` do yfinance com auto_adjust=False já vem ajustado
+        por desdobramentos; use `unadjust_splits` antes de passar os splits.
+        """
+        factors = cls(ticker)
+        closes = raw_close.copy()
+        if closes.index.tz is not None:
+            closes.index = closes.index.tz_localize(None)
+        closes.index = closes.index.normalize()
+        closes = closes.sort_index()
+
+        events = []
+        if dividends is not None:
+            events += [(d, 'dividend', v) for d, v in dividends.items() if v]
+        if splits is not None:
+            events += [(d, 'split', v) for d, v in splits.items() if v]
+
+        events = sorted(((cls._to_timestamp(d), action_type, v) for d, action_type, v in events),
+                        key=lambda event: event[0])
+        for ex_date, action_type, value in events:
+            if action_type == 'dividend':
+                position = int(closes.index.searchsorted(ex_date, side='left')) - 1
+                if position < 0:
+                    continue
+                ratio = cls.dividend_ratio(value, closes.iloc[position])
+            else:
+                ratio = cls.split_ratio(value)
+            factors.add_action(ex_date, action_type, value, ratio)
+        return factors
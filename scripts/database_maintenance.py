@@ -12,15 +12,10 @@ from typing import Dict, List, Optional
 import schedule
 import time
 
+from log_setup import configure_logging
+
 # Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('database_maintenance.log'),
-        logging.StreamHandler()
-    ]
-)
+configure_logging('database_maintenance.log')
 logger = logging.getLogger(__name__)
 
 class DatabaseMaintenanceSystem:
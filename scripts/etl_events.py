@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+STREAM DE EVENTOS DE PROGRESSO DO ETL
+Os pipelines publicam eventos (início de execução, item concluído/falho,
+latência de estágio) como linhas JSON em um arquivo append-only. Monitores
+leem o stream de forma incremental a partir do último offset, sem consultar
+tabelas de checkpoint
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_EVENTS_PATH = os.getenv('ETL_EVENTS_PATH', 'etl_events.jsonl')
+
+
+class EventPublisher:
+    """Publicação de eventos de uma execução (uma linha JSON por evento)"""
+
+    def __init__(self, pipeline: str, path: str = DEFAULT_EVENTS_PATH, run_id: Optional[str] = None):
+        self.pipeline = pipeline
+        self.path = path
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        # Linha inteira por write em modo append: leitores nunca veem eventos intercalados
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def emit(self, event: str, **fields):
+        record = {'ts': time.time(), 'event': event, 'pipeline': self.pipeline, 'run_id': self.run_id, **fields}
+        line = json.dumps(record, default=str, separators=(',', ':')) + '\n'
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line)
+        for listener in self._listeners:
+            listener(record)
+
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        """Receber cada evento publicado (ex.: relatório de performance da execução)"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def run_started(self, total: int, **fields):
+        self.emit('run_started', total=total, **fields)
+
+    def item(self, key: str, status: str, error: Optional[BaseException] = None,
+             error_class: Optional[str] = None, **fields):
+        """Item concluído (`success`/`failed`); a classe do erro alimenta a taxa de erro por classe"""
+        if error is not None and error_class is None:
+            error_class = type(error).__name__
+        self.emit('item', key=key, status=status, error_class=error_class,
+                  error=str(error)[:200] if error is not None else None, **fields)
+
+    def span_listener(self, name: str, seconds: float, labels: Dict[str, Any]):
+        """Listener de telemetry.Telemetry: latência de cada estágio no stream"""
+        self.emit('span', span=name, seconds=seconds, **labels)
+
+    def run_finished(self, **fields):
+        self.emit('run_finished', **fields)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class EventTail:
+    """Leitura incremental do stream (retoma do último offset; trata truncamento)"""
+
+    def __init__(self, path: str = DEFAULT_EVENTS_PATH, from_start: bool = True):
+        self.path = path
+        self.offset = 0
+        self._partial = b''
+        if not from_start and os.path.exists(path):
+            self.offset = os.path.getsize(path)
+
+    def poll(self) -> List[Dict[str, Any]]:
+        """Eventos completos gravados desde a última chamada"""
+        if not os.path.exists(self.path):
+            return []
+        size = os.path.getsize(self.path)
+        if size < self.offset:  # arquivo truncado/rotacionado: recomeçar
+            self.offset, self._partial = 0, b''
+        if size == self.offset:
+            return []
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = self._partial + f.read(size - self.offset)
+        self.offset = size
+
+        lines = data.split(b'\n')
+        self._partial = lines.pop()  # linha ainda incompleta fica para o próximo poll
+        events = []
+        for line in lines:
+            if line.strip():
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue
+        return events
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+MONITOR DO ETL ORIENTADO A EVENTOS
+Consome o stream de etl_events.py de forma incremental e mostra, para a
+execução mais recente: vazão EWMA (decaimento por tempo dos eventos, então
+funciona também ao reler o histórico), latência p50/p95/p99 por estágio,
+taxa de erro por classe e ETA estável a partir do início real do pipeline
+"""
+
+import argparse
+import math
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from etl_events import DEFAULT_EVENTS_PATH, EventTail
+from telemetry import LatencyHistogram
+
+
+class DecayingRate:
+    """
+    Taxa EWMA por decaimento exponencial: cada evento soma 1 e o acumulado
+    decai com constante `tau`. O denominador é corrigido pelo histórico
+    disponível, então a estimativa não começa subestimada
+    """
+
+    def __init__(self, tau: float = 60.0):
+        self.tau = tau
+        self.value = 0.0
+        self.first_ts: Optional[float] = None
+        self.last_ts: Optional[float] = None
+
+    def add(self, ts: float, amount: float = 1.0):
+        if self.first_ts is None:
+            self.first_ts = ts
+        if self.last_ts is not None and ts > self.last_ts:
+            self.value *= math.exp(-(ts - self.last_ts) / self.tau)
+        self.last_ts = ts if self.last_ts is None else max(ts, self.last_ts)
+        self.value += amount
+
+    def rate(self, now: float, since: Optional[float] = None) -> float:
+        """Eventos por segundo no instante `now` (`since`: início da janela observada)"""
+        if self.last_ts is None:
+            return 0.0
+        decayed = self.value * math.exp(-max(now - self.last_ts, 0.0) / self.tau)
+        window = max(now - (since if since is not None else self.first_ts), 1e-9)
+        return decayed / (self.tau * (1 - math.exp(-window / self.tau)))
+
+
+class ETLMonitor:
+    """Estado agregado de uma execução a partir dos eventos"""
+
+    def __init__(self, tau: float = 60.0):
+        self.tau = tau
+        self.reset()
+
+    def reset(self, event: Optional[Dict[str, Any]] = None):
+        event = event or {}
+        self.run_id = event.get('run_id')
+        self.pipeline = event.get('pipeline')
+        self.total = event.get('total')
+        self.started_at = event.get('ts')
+        self.finished_at = None
+        self.success = 0
+        self.failed = 0
+        self.errors: Counter = Counter()
+        self.stages: Dict[str, LatencyHistogram] = {}
+        self.throughput = DecayingRate(self.tau)
+        self.last_event_ts = event.get('ts')
+
+    @property
+    def processed(self) -> int:
+        return self.success + self.failed
+
+    def consume(self, events: List[Dict[str, Any]]):
+        for event in events:
+            kind = event.get('event')
+            if kind == 'run_started':
+                self.reset(event)  # sempre acompanha a execução mais recente
+                continue
+            if self.run_id is not None and event.get('run_id') != self.run_id:
+                continue
+
+            ts = event.get('ts', time.time())
+            self.last_event_ts = ts
+            if self.started_at is None:
+                self.started_at = ts
+
+            if kind == 'item':
+                if event.get('status') == 'success':
+                    self.success += 1
+                else:
+                    self.failed += 1
+                    self.errors[event.get('error_class') or 'unknown'] += 1
+                self.throughput.add(ts)
+            elif kind == 'span':
+                histogram = self.stages.get(event['span'])
+                if histogram is None:
+                    histogram = self.stages[event['span']] = LatencyHistogram()
+                histogram.observe(float(event['seconds']))
+            elif kind == 'run_finished':
+                self.finished_at = ts
+
+    def rates(self, now: float) -> Dict[str, float]:
+        end = self.finished_at or now
+        elapsed = max(end - self.started_at, 1e-9) if self.started_at else 0.0
+        return {
+            'ewma': self.throughput.rate(end, since=self.started_at),
+            'average': self.processed / elapsed if elapsed else 0.0,
+            'elapsed': elapsed
+        }
+
+    def eta_seconds(self, now: float) -> Optional[float]:
+        """Restante / vazão EWMA (média desde o início do pipeline se a EWMA zerar)"""
+        if not self.total or self.finished_at:
+            return None
+        remaining = max(self.total - self.processed, 0)
+        rates = self.rates(now)
+        rate = rates['ewma'] if rates['ewma'] > 0 else rates['average']
+        return remaining / rate if rate > 0 else None
+
+    def summary(self, now: Optional[float] = None) -> Dict[str, Any]:
+        now = now or time.time()
+        rates = self.rates(now)
+        eta = self.eta_seconds(now)
+        return {
+            'pipeline': self.pipeline,
+            'run_id': self.run_id,
+            'total': self.total,
+            'processed': self.processed,
+            'success': self.success,
+            'failed': self.failed,
+            'throughput_ewma_per_min': rates['ewma'] * 60,
+            'throughput_avg_per_min': rates['average'] * 60,
+            'elapsed_seconds': rates['elapsed'],
+            'eta_seconds': eta,
+            'error_rate': {cls: n / self.processed for cls, n in self.errors.most_common()} if self.processed else {},
+            'stages': {name: h.to_dict() for name, h in sorted(self.stages.items())},
+            'finished': self.finished_at is not None
+        }
+
+    def render(self, now: Optional[float] = None) -> str:
+        now = now or time.time()
+        s = self.summary(now)
+        lines = [
+            "🚀 MONITOR DO PIPELINE ETL",
+            "=" * 80,
+            f"📦 {s['pipeline'] or '-'} (execução {s['run_id'] or '-'})",
+            f"🕐 Início: {datetime.fromtimestamp(self.started_at).strftime('%H:%M:%S') if self.started_at else '-'}"
+            f" | decorrido {timedelta(seconds=int(s['elapsed_seconds']))}",
+            ""
+        ]
+
+        total_text = f"/{s['total']:,}" if s['total'] else ""
+        lines.append(f"📊 Processados: {s['processed']:,}{total_text} | ✅ {s['success']:,} | ❌ {s['failed']:,}")
+        lines.append(f"⚡ Vazão: {s['throughput_ewma_per_min']:.1f}/min (EWMA {self.tau:.0f}s) | "
+                     f"{s['throughput_avg_per_min']:.1f}/min (média)")
+        if s['finished']:
+            lines.append("🎉 Execução concluída")
+        elif s['eta_seconds'] is not None:
+            finish = datetime.fromtimestamp(now + s['eta_seconds']).strftime('%H:%M:%S')
+            lines.append(f"⏰ ETA: {timedelta(seconds=int(s['eta_seconds']))} (≈ {finish})")
+
+        if s['total']:
+            progress = min(s['processed'] / s['total'], 1.0)
+            filled = int(50 * progress)
+            lines.append(f"[{'█' * filled}{'░' * (50 - filled)}] {progress * 100:.1f}%")
+
+        if s['stages']:
+            lines += ["", "⏱️ LATÊNCIA POR ESTÁGIO (s):",
+                      f"   {'estágio':<22}{'n':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'total':>12}"]
+            for name, h in s['stages'].items():
+                lines.append(f"   {name:<22}{h['count']:>8}{h['p50']:>10.3f}{h['p95']:>10.3f}"
+                             f"{h['p99']:>10.3f}{h['sum']:>12.1f}")
+
+        if s['error_rate']:
+            lines += ["", "⚠️ TAXA DE ERRO POR CLASSE:"]
+            for cls, rate in s['error_rate'].items():
+                lines.append(f"   {cls}: {self.errors[cls]} ({rate * 100:.1f}%)")
+
+        lines.append("=" * 80)
+        return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Monitor do ETL a partir do stream de eventos')
+    parser.add_argument('events_file', nargs='?', default=DEFAULT_EVENTS_PATH)
+    parser.add_argument('--interval', type=float, default=2.0, help='Intervalo de atualização (s)')
+    parser.add_argument('--tau', type=float, default=60.0, help='Constante de tempo da EWMA (s)')
+    parser.add_argument('--once', action='store_true', help='Ler o stream, imprimir e sair')
+    args = parser.parse_args()
+
+    tail = EventTail(args.events_file)
+    monitor = ETLMonitor(tau=args.tau)
+
+    if args.once:
+        monitor.consume(tail.poll())
+        print(monitor.render())
+        return
+
+    # O histórico é lido para acompanhar uma execução já em andamento, mas só uma
+    # execução que termina depois do início do monitor encerra o acompanhamento
+    monitor_started = time.time()
+    try:
+        while True:
+            monitor.consume(tail.poll())
+            finished_before = monitor.finished_at is not None and monitor.finished_at < monitor_started
+            waiting = "⏳ Aguardando uma nova execução...\n" if finished_before else ""
+            # ANSI: cursor no topo + limpar (sem subprocesso por atualização)
+            sys.stdout.write("\033[H\033[J" + monitor.render() + "\n" + waiting + "💡 Ctrl+C para sair\n")
+            sys.stdout.flush()
+            if monitor.finished_at and not finished_before:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print("\n👋 Monitoramento interrompido pelo usuário")
+
+
+if __name__ == "__main__":
+    main()
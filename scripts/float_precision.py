@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+MODO FLOAT32 COM PRECISÃO CONTROLADA
+Armazenamento/cálculo opcional em float32 para matriz de preços e retornos
+intermediários, com auditoria que compara as métricas do snapshot contra float64
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Any, Callable, Dict, Iterable, Optional, Union
+
+COMPUTE_DTYPES = {
+    'float64': np.float64,
+    'float32': np.float32
+}
+
+# Métricas são arredondadas a 4-6 casas; desvios abaixo disso não aparecem no banco
+DEFAULT_TOLERANCE = 5e-5
+
+
+def resolve_dtype(dtype: Union[str, type, None]) -> type:
+    """Converter nome ('float32'/'float64') para dtype numpy"""
+    if dtype is None:
+        return np.float64
+    if isinstance(dtype, str):
+        if dtype not in COMPUTE_DTYPES:
+            raise ValueError(f"dtype não suportado: {dtype} (use {list(COMPUTE_DTYPES)})")
+        return COMPUTE_DTYPES[dtype]
+    return dtype
+
+
+def as_compute_dtype(data: Union[pd.Series, pd.DataFrame, np.ndarray],
+                     dtype: Union[str, type, None]) -> Union[pd.Series, pd.DataFrame, np.ndarray]:
+    """Converter preços/retornos para o dtype de cálculo (sem cópia se já estiver nele)"""
+    target = resolve_dtype(dtype)
+    return data.astype(target, copy=False)
+
+
+def memory_bytes(data: Union[pd.Series, pd.DataFrame, np.ndarray]) -> int:
+    """Memória ocupada pelos valores numéricos"""
+    if isinstance(data, np.ndarray):
+        return int(data.nbytes)
+    usage = data.memory_usage(index=False, deep=False)
+    return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+
+
+def compare_metrics(reference: Dict[str, Any], candidate: Dict[str, Any]) -> Dict[str, float]:
+    """Desvio absoluto por métrica numérica presente nos dois snapshots"""
+    deviations = {}
+    for key, ref_value in reference.items():
+        cand_value = candidate.get(key)
+        if isinstance(ref_value, bool) or isinstance(cand_value, bool):
+            continue
+        if not isinstance(ref_value, (int, float, np.number)) or not isinstance(cand_value, (int, float, np.number)):
+            continue
+        if np.isnan(ref_value) and np.isnan(cand_value):
+            continue
+        deviations[key] = abs(float(ref_value) - float(cand_value))
+    return deviations
+
+
+def audit_precision(compute_metrics: Callable[[str, str], Optional[Dict[str, Any]]],
+                    tickers: Iterable[str],
+                    tolerance: float = DEFAULT_TOLERANCE,
+                    ignore: Iterable[str] = ('data_points', 'volume_avg_30d')) -> Dict[str, Any]:
+    """
+    Auditoria de precisão float32 x float64.
+
+    `compute_metrics(ticker, dtype)` deve devolver o snapshot de métricas do
+    ticker calculado no dtype pedido. Retorna o desvio máximo por métrica,
+    o pior ticker e se tudo ficou dentro da tolerância.
+    """
+    ignored = set(ignore)
+    per_metric: Dict[str, Dict[str, Any]] = {}
+    audited = 0
+
+    for ticker in tickers:
+        reference = compute_metrics(ticker, 'float64')
+        candidate = compute_metrics(ticker, 'float32')
+        if not reference or not candidate:
+            continue
+        audited += 1
+
+        for metric, deviation in compare_metrics(reference, candidate).items():
+            if metric in ignored:
+                continue
+            current = per_metric.get(metric)
+            if current is None or deviation > current['max_abs_deviation']:
+                per_metric[metric] = {'max_abs_deviation': deviation, 'ticker': ticker}
+
+    max_deviation = max((m['max_abs_deviation'] for m in per_metric.values()), default=0.0)
+
+    return {
+        'tickers_audited': audited,
+        'tolerance': tolerance,
+        'max_abs_deviation': max_deviation,
+        'within_tolerance': max_deviation <= tolerance,
+        'metrics': dict(sorted(per_metric.items(), key=lambda item: -item[1]['max_abs_deviation']))
+    }
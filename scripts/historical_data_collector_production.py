@@ -13,15 +13,14 @@ from datetime import datetime, timedelta
 from typing import List, Dict, Any
 import logging
 
+from asset_ids import AssetIdResolver
+from corporate_actions import AdjustmentFactors, unadjust_splits
+from log_setup import configure_logging
+from status_store import ProcessingStatusStore
+from telemetry import TELEMETRY, timed
+
 # Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('historical_collection.log'),
-        logging.StreamHandler()
-    ]
-)
+configure_logging('historical_collection.log')
 
 class HistoricalDataCollector:
     """Coletor de dados históricos para ações americanas"""
@@ -32,6 +31,10 @@ class HistoricalDataCollector:
         self.batch_size = 50  # Ações por lote
         self.delay_between_requests = 0.1  # 100ms entre requests
         self.retry_attempts = 3
+        self.asset_ids = AssetIdResolver.from_file()
+        # Status por ação (SQLite WAL, gravado em lote); ações já concluídas são puladas
+        # na retomada de uma execução interrompida, e o status é limpo ao fim de uma execução sem falhas
+        self.status = ProcessingStatusStore('historical_collection_status.db', max_retries=self.retry_attempts)
         
     def get_priority_stocks(self) -> List[Dict[str, Any]]:
         """Obter lista de ações priorizadas por market cap"""
@@ -76,6 +79,7 @@ class HistoricalDataCollector:
         
         return real_stocks
     
+    @timed('fetch.history')
     def collect_stock_history(self, ticker: str) -> Dict[str, Any]:
         """Coletar histórico de uma ação específica"""
         
@@ -87,7 +91,8 @@ class HistoricalDataCollector:
                 history = stock.history(
                     start=self.start_date,
                     end=self.end_date,
-                    auto_adjust=True,
+                    auto_adjust=False,
+                    actions=True,
                     prepost=True
                 )
                 
@@ -95,6 +100,14 @@ class HistoricalDataCollector:
                     logging.warning(f"Nenhum dado histórico encontrado para {ticker}")
                     return None
                 
+                # Preço bruto + eventos (dividendos e desdobramentos); o ajustado é calculado na leitura
+                history = unadjust_splits(history)
+                factors = AdjustmentFactors.from_history(
+                    ticker, history['Close'].dropna(),
+                    dividends=history['Dividends'] if 'Dividends' in history.columns else None,
+                    splits=history['Stock Splits'] if 'Stock Splits' in history.columns else None
+                )
+                
                 # Processar dados
                 history = history.reset_index()
                 history['ticker'] = ticker
@@ -109,7 +122,6 @@ class HistoricalDataCollector:
                         'high': float(row['High']) if pd.notna(row['High']) else None,
                         'low': float(row['Low']) if pd.notna(row['Low']) else None,
                         'close': float(row['Close']) if pd.notna(row['Close']) else None,
-                        'adj_close': float(row['Close']) if pd.notna(row['Close']) else None,
                         'volume': int(row['Volume']) if pd.notna(row['Volume']) else None
                     }
                     records.append(record)
@@ -119,7 +131,8 @@ class HistoricalDataCollector:
                     'ticker': ticker,
                     'records_count': len(records),
                     'date_range': f"{records[0]['date']} to {records[-1]['date']}",
-                    'records': records
+                    'records': records,
+                    'corporate_actions': factors.action_records()
                 }
                 
             except Exception as e:
@@ -130,6 +143,7 @@ class HistoricalDataCollector:
         
         return None
     
+    @timed('serialize', target='sql')
     def generate_sql_insert(self, stock_data: Dict[str, Any]) -> str:
         """Gerar SQL INSERT para os dados coletados"""
         
@@ -138,35 +152,39 @@ class HistoricalDataCollector:
         
         ticker = stock_data['ticker']
         records = stock_data['records']
+        asset_id = self.asset_ids.sql_ref(ticker)
         
         # Gerar VALUES para INSERT
         values = []
         for record in records:
             value = f"""(
-                (SELECT id FROM assets_master WHERE ticker = '{ticker}' AND asset_type = 'STOCK'),
+                {asset_id},
                 '{record['date']}',
                 {record['open'] or 'NULL'},
                 {record['high'] or 'NULL'},
                 {record['low'] or 'NULL'},
                 {record['close'] or 'NULL'},
-                {record['adj_close'] or 'NULL'},
                 {record['volume'] or 'NULL'}
             )"""
             values.append(value)
         
         sql = f"""
         INSERT INTO stock_prices_daily (
-            asset_id, date, open, high, low, close, adj_close, volume
+            asset_id, date, open, high, low, close, volume
         ) VALUES {','.join(values)}
         ON CONFLICT (asset_id, date) DO UPDATE SET
             open = EXCLUDED.open,
             high = EXCLUDED.high,
             low = EXCLUDED.low,
             close = EXCLUDED.close,
-            adj_close = EXCLUDED.adj_close,
             volume = EXCLUDED.volume;
         """
         
+        # Eventos corporativos: fatores cumulativos atualizados incrementalmente (idempotente por evento)
+        for action in stock_data.get('corporate_actions', []):
+            sql += (f"SELECT apply_corporate_action({asset_id}, '{action['ex_date']}', "
+                    f"'{action['action_type']}', {action['value']}, {action['ratio']});\n")
+        
         return sql
     
     def collect_batch(self, stocks: List[Dict[str, Any]]) -> Dict[str, Any]:
@@ -184,9 +202,14 @@ class HistoricalDataCollector:
         
         for stock in stocks:
             ticker = stock['ticker']
+            if ticker in self.status.processed:
+                batch_results['skipped'] = batch_results.get('skipped', 0) + 1
+                continue
             
             # Coletar dados históricos
             stock_data = self.collect_stock_history(ticker)
+            self.status.update(ticker, 'success' if stock_data else 'failed',
+                               None if stock_data else 'sem dados históricos')
             
             if stock_data:
                 batch_results['successful'] += 1
@@ -222,9 +245,17 @@ class HistoricalDataCollector:
         logging.info(f"🧪 EXECUTANDO LOTE DE TESTE: {[s['ticker'] for s in test_batch]}")
         
         batch_results = self.collect_batch(test_batch)
+        self.status.record_batch(1, len(test_batch), batch_results['successful'], batch_results['failed'])
+        if batch_results['failed'] == 0:
+            # Execução completa: a próxima coleta começa do zero
+            self.status.reset()
+        self.status.close()
         
         # Salvar resultados
-        report_filename = f"historical_collection_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        run_stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        batch_results['telemetry'] = TELEMETRY.snapshot()
+        TELEMETRY.export(f"historical_collection_telemetry_{run_stamp}")
+        report_filename = f"historical_collection_report_{run_stamp}.json"
         
         with open(report_filename, 'w', encoding='utf-8') as f:
             json.dump(batch_results, f, indent=2, default=str)
@@ -246,7 +277,8 @@ def main():
     print("\n🎯 COLETA DE TESTE CONCLUÍDA!")
     print(f"Sucessos: {results['successful']}/{results['total_stocks']}")
     print(f"Registros coletados: {results['total_records']:,}")
-    print(f"Taxa de sucesso: {(results['successful']/results['total_stocks']*100):.1f}%")
+    if results['total_stocks']:
+        print(f"Taxa de sucesso: {(results['successful']/results['total_stocks']*100):.1f}%")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+LOGGING ASSÍNCRONO, ESTRUTURADO E AMOSTRADO DOS PIPELINES
+Substitui o `logging.basicConfig` com FileHandler + StreamHandler síncronos:
+- o logger raiz só enfileira (QueueHandler); arquivo e console são escritos
+  por uma thread (QueueListener), sem I/O no loop por ticker
+- o arquivo recebe um JSON por linha (ts, nível, logger, mensagem, local e
+  campos de `extra=`); o console mantém o formato texto de sempre
+- INFO/DEBUG são amostrados por ponto de chamada (arquivo:linha): as
+  primeiras ocorrências passam, depois 1 a cada N; WARNING+ sempre passam
+- um resumo periódico (e no fim do processo) informa quantas mensagens de
+  cada ponto foram suprimidas, com a última mensagem como exemplo
+Variáveis: LOG_FORMAT=text (arquivo em texto), LOG_SAMPLING=0 (sem
+amostragem), LOG_SAMPLE_BURST, LOG_SAMPLE_EVERY, LOG_SUMMARY_INTERVAL
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+QUEUE_SIZE = 10_000
+
+# Atributos padrão de LogRecord; o restante veio de `extra=` e vai para o JSON
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'rollup'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Um objeto JSON por linha"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'site': f"{record.module}:{record.lineno}",
+            'thread': record.threadName
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Amostragem por tipo de evento: `extra={'event': ...}` quando informado,
+    senão o ponto de chamada. Contabiliza o que foi suprimido para o resumo
+    """
+
+    def __init__(self, burst: int = 20, every: int = 100, min_level: int = logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.every = max(every, 1)
+        self.min_level = min_level
+        self._lock = threading.Lock()
+        self.seen: Dict[str, int] = {}
+        self.suppressed: Dict[str, Tuple[int, str]] = {}
+
+    @staticmethod
+    def event_key(record: logging.LogRecord) -> str:
+        return getattr(record, 'event', None) or f"{record.module}:{record.lineno}"
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.min_level or getattr(record, 'rollup', False):
+            return True
+        key = self.event_key(record)
+        with self._lock:
+            seen = self.seen.get(key, 0) + 1
+            self.seen[key] = seen
+            if seen <= self.burst or (seen - self.burst) % self.every == 0:
+                return True
+            count, _ = self.suppressed.get(key, (0, ''))
+            self.suppressed[key] = (count + 1, record.msg if isinstance(record.msg, str) else str(record.msg))
+        return False
+
+    def drain(self) -> Dict[str, Tuple[int, str]]:
+        """Suprimidas desde o último resumo (zera a contagem)"""
+        with self._lock:
+            suppressed, self.suppressed = self.suppressed, {}
+        return suppressed
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Fila cheia descarta o registro (contado) em vez de bloquear o pipeline"""
+
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LoggingRuntime:
+    """Handler da fila + listener + amostragem + resumo periódico de um processo"""
+
+    def __init__(self, handler: NonBlockingQueueHandler, listener: logging.handlers.QueueListener,
+                 sampler: Optional[SamplingFilter], summary_interval: float):
+        self.handler = handler
+        self.listener = listener
+        self.sampler = sampler
+        self.summary_interval = summary_interval
+        self.has_file = False
+        self._stop = threading.Event()
+        self._thread = None
+        if sampler is not None and summary_interval > 0:
+            self._thread = threading.Thread(target=self._summary_loop, name='log-summary', daemon=True)
+            self._thread.start()
+
+    def _summary_loop(self):
+        while not self._stop.wait(self.summary_interval):
+            self.log_summary()
+
+    def log_summary(self):
+        """Registrar (sem amostragem) quantas mensagens de cada evento foram suprimidas"""
+        if self.sampler is None:
+            return
+        suppressed = self.sampler.drain()
+        if self.handler.dropped:
+            suppressed['queue_full'] = (self.handler.dropped, 'fila de logging cheia')
+            self.handler.dropped = 0
+        if not suppressed:
+            return
+        total = sum(count for count, _ in suppressed.values())
+        top = sorted(suppressed.items(), key=lambda item: item[1][0], reverse=True)[:10]
+        logging.getLogger('log_setup').info(
+            f"📉 {total:,} mensagens suprimidas pela amostragem: " +
+            "; ".join(f"{key} x{count:,} (ex.: {example[:80]})" for key, (count, example) in top),
+            extra={'rollup': True, 'suppressed': {key: count for key, (count, _) in suppressed.items()}}
+        )
+
+    def stop(self):
+        """Resumo final e esvaziamento da fila (registrado em atexit)"""
+        self._stop.set()
+        self.log_summary()
+        self.listener.stop()
+
+
+def _file_handler(log_file: str, json_file: bool) -> logging.Handler:
+    handler = logging.FileHandler(log_file, encoding='utf-8')
+    handler.setFormatter(JsonFormatter() if json_file else logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+_RUNTIME: Optional[LoggingRuntime] = None
+_CONFIGURE_LOCK = threading.Lock()
+
+
+def configure_logging(log_file: Optional[str] = None, level: int = logging.INFO,
+                      json_file: Optional[bool] = None, sampling: Optional[bool] = None,
+                      burst: Optional[int] = None, every: Optional[int] = None,
+                      summary_interval: Optional[float] = None) -> Optional[LoggingRuntime]:
+    """
+    Configurar o logging do processo (como `basicConfig`: não faz nada se o
+    logger raiz já tiver handlers, ex.: módulo importado por outro pipeline)
+    """
+    global _RUNTIME
+    with _CONFIGURE_LOCK:
+        json_file = os.getenv('LOG_FORMAT', 'json') != 'text' if json_file is None else json_file
+        root = logging.getLogger()
+        if root.handlers:
+            # Já configurado por um módulo importado antes: apenas acrescentar o arquivo deste pipeline
+            if _RUNTIME is not None and log_file and not _RUNTIME.has_file:
+                _RUNTIME.listener.handlers += (_file_handler(log_file, json_file),)
+                _RUNTIME.has_file = True
+            return _RUNTIME
+
+        sampling = os.getenv('LOG_SAMPLING', '1') != '0' if sampling is None else sampling
+        burst = int(os.getenv('LOG_SAMPLE_BURST', '20')) if burst is None else burst
+        every = int(os.getenv('LOG_SAMPLE_EVERY', '100')) if every is None else every
+        if summary_interval is None:
+            summary_interval = float(os.getenv('LOG_SUMMARY_INTERVAL', '60'))
+
+        console = logging.StreamHandler()
+        console.setFormatter(logging.Formatter(TEXT_FORMAT))
+        targets = [console]
+        if log_file:
+            targets.append(_file_handler(log_file, json_file))
+
+        log_queue: queue.Queue = queue.Queue(QUEUE_SIZE)
+        handler = NonBlockingQueueHandler(log_queue)
+        sampler = SamplingFilter(burst, every) if sampling else None
+        if sampler is not None:
+            handler.addFilter(sampler)  # registros descartados nem chegam à fila
+        listener = logging.handlers.QueueListener(log_queue, *targets, respect_handler_level=True)
+        listener.start()
+
+        root.addHandler(handler)
+        root.setLevel(level)
+        _RUNTIME = LoggingRuntime(handler, listener, sampler, summary_interval)
+        _RUNTIME.has_file = bool(log_file)
+        atexit.register(_RUNTIME.stop)
+        return _RUNTIME
+
+
+def log_summary():
+    """Forçar o resumo de mensagens suprimidas (ex.: fim de um lote grande)"""
+    if _RUNTIME is not None:
+        _RUNTIME.log_summary()
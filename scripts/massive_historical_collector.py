@@ -5,6 +5,7 @@ Processa Top 50 ações por market cap com inserção direta no Supabase
 Fase 1 - Dias 3-5 do Plano de Execução Stocks Completo
 """
 
+import argparse
 import yfinance as yf
 import pandas as pd
 import json
@@ -12,28 +13,60 @@ import time
 from datetime import datetime, timedelta
 from typing import List, Dict, Any
 import logging
+import os
 import requests
 
+from asset_ids import AssetIdResolver
+from bulk_loader import StockPricesBulkLoader, connect_from_env
+from change_detection import RowHashStore
+from etl_events import EventPublisher
+from log_setup import configure_logging
+from memory_governor import DEFAULT_BUDGET_MB, MemoryGovernor
+from pipeline_state import PipelineState
+from profiling import add_profile_argument, start_profiling, stop_profiling
+from provider_errors import EmptyResponse, ProviderErrorPolicy
+from run_report import RunReport, ticker_scope
+from corporate_actions import AdjustmentFactors, unadjust_splits
+from telemetry import TELEMETRY, timed
+from write_outbox import OutboxDrainer, WriteOutbox
+
 # Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('massive_historical_collection.log'),
-        logging.StreamHandler()
-    ]
-)
+configure_logging('massive_historical_collection.log')
 
 class MassiveHistoricalCollector:
     """Coletor massivo de dados históricos para Top 50 ações"""
     
-    def __init__(self):
+    def __init__(self, memory_budget_mb: float = DEFAULT_BUDGET_MB, fresh: bool = False):
         self.start_date = (datetime.now() - timedelta(days=3650)).strftime('%Y-%m-%d')  # 10 anos
         self.end_date = datetime.now().strftime('%Y-%m-%d')
-        self.batch_size = 10  # Ações por lote para inserção
+        self.batch_size = 10  # Lote inicial; o governador de memória ajusta a cada lote
         self.delay_between_requests = 0.2  # 200ms entre requests
-        self.retry_attempts = 3
+        self.delay_between_batches = 1.0
         self.supabase_project_id = "nniabnjuwzeqmflrruga"
+        # Com DATABASE_URL a carga vai direto por COPY; sem ela, SQL é emitido para o MCP
+        self.database_url = os.getenv('DATABASE_URL')
+        self._bulk_loader = None
+        # Sem conexão, ids conhecidos são emitidos direto e o restante cai na subquery
+        self.asset_ids = AssetIdResolver.from_file()
+        # Hashes por (ticker, mês): só barras novas/revisadas são enviadas (FULL_REFRESH=1 reenvia tudo)
+        self.row_hashes = RowHashStore()
+        self.full_refresh = os.getenv('FULL_REFRESH') == '1'
+        # WRITE_OUTBOX=1: lotes vão para a outbox local e um drenador envia ao banco em background
+        self.outbox = WriteOutbox() if self.database_url and os.getenv('WRITE_OUTBOX') == '1' else None
+        self.drainer = None
+        # Estado por ticker e estágio (fetched -> computed -> serialized -> loaded): vale só até a
+        # execução terminar sem falhas; `fresh` descarta o estado de uma execução interrompida
+        self.state = PipelineState('massive_historical')
+        if fresh:
+            self.state.reset()
+        # Eventos de progresso para o monitor (etl_monitor.py), incluindo a latência de cada span
+        self.events = EventPublisher('massive_historical')
+        TELEMETRY.add_listener(self.events.span_listener)
+        # Tamanho do lote adaptado ao orçamento de memória (MEMORY_BUDGET_MB; MEMORY_TRACE=1 liga o tracemalloc)
+        self.memory = MemoryGovernor(budget_mb=memory_budget_mb, initial_batch=self.batch_size, max_batch=50)
+        # Falhas do provedor classificadas: deslistados são pulados, transitórias voltam em lotes seguintes
+        self.provider_errors = ProviderErrorPolicy()
+        self.failures = {}
         
     def get_top_50_stocks(self) -> List[str]:
         """Obter Top 50 ações por market cap do banco de dados"""
@@ -58,79 +91,248 @@ class MassiveHistoricalCollector:
         logging.info(f"Top 50 ações selecionadas: {len(top_50_stocks)} tickers")
         return top_50_stocks
     
-    def collect_stock_history_optimized(self, ticker: str) -> Dict[str, Any]:
-        """Coletar histórico otimizado de uma ação"""
+    @timed('fetch.history')
+    def fetch_history(self, ticker: str) -> pd.DataFrame:
+        """Baixar preços brutos + eventos de uma ação (uma tentativa; falhas vão para a fila de retry)"""
         
-        for attempt in range(self.retry_attempts):
-            try:
-                logging.info(f"Coletando {ticker} (tentativa {attempt + 1})")
-                
-                stock = yf.Ticker(ticker)
-                history = stock.history(
-                    start=self.start_date,
-                    end=self.end_date,
-                    auto_adjust=True,
-                    prepost=False  # Sem pré/pós mercado para performance
-                )
-                
-                if history.empty:
-                    logging.warning(f"Sem dados para {ticker}")
-                    return None
-                
-                # Processar dados de forma otimizada
-                history = history.reset_index()
-                records = []
-                
-                for _, row in history.iterrows():
-                    if pd.notna(row['Close']) and pd.notna(row['Volume']):  # Filtrar dados válidos
-                        record = {
-                            'ticker': ticker,
-                            'date': row['Date'].strftime('%Y-%m-%d'),
-                            'open': round(float(row['Open']), 4) if pd.notna(row['Open']) else None,
-                            'high': round(float(row['High']), 4) if pd.notna(row['High']) else None,
-                            'low': round(float(row['Low']), 4) if pd.notna(row['Low']) else None,
-                            'close': round(float(row['Close']), 4),
-                            'adj_close': round(float(row['Close']), 4),
-                            'volume': int(row['Volume'])
-                        }
-                        records.append(record)
-                
-                logging.info(f"✅ {ticker}: {len(records)} registros válidos")
-                return {
+        try:
+            logging.info(f"Coletando {ticker}")
+            
+            stock = yf.Ticker(ticker)
+            # Preços brutos + eventos; o ajuste é aplicado via fatores cumulativos
+            history = stock.history(
+                start=self.start_date,
+                end=self.end_date,
+                auto_adjust=False,
+                actions=True,
+                prepost=False  # Sem pré/pós mercado para performance
+            )
+            
+            if history.empty:
+                raise EmptyResponse(f"Sem dados para {ticker}")
+            
+            self.provider_errors.succeeded(ticker, 'history')
+            return history
+            
+        except Exception as e:
+            self.failures[ticker] = self.provider_errors.handle(ticker, 'history', e)
+            return None
+    
+    @timed('calculate')
+    def build_stock_data(self, ticker: str, history: pd.DataFrame) -> Dict[str, Any]:
+        """Registros de preço e fatores de ajuste a partir do histórico bruto"""
+        
+        try:
+            # Filtrar dados válidos
+            history = history[history['Close'].notna() & history['Volume'].notna()]
+            
+            # Preços brutos (sem o ajuste de desdobramentos do yfinance) + fatores de dividendos e desdobramentos;
+            # o ajustado é calculado na leitura (stock_prices_adjusted), então um evento novo não reescreve barras
+            history = unadjust_splits(history)
+            factors = AdjustmentFactors.from_history(
+                ticker, history['Close'],
+                dividends=history['Dividends'] if 'Dividends' in history.columns else None,
+                splits=history['Stock Splits'] if 'Stock Splits' in history.columns else None
+            )
+            
+            # Processar dados de forma otimizada
+            history = history.reset_index()
+            records = []
+            
+            for row in history.itertuples(index=False):
+                record = {
                     'ticker': ticker,
-                    'records_count': len(records),
-                    'date_range': f"{records[0]['date']} to {records[-1]['date']}",
-                    'records': records
+                    'date': row.Date.strftime('%Y-%m-%d'),
+                    'open': round(float(row.Open), 4) if pd.notna(row.Open) else None,
+                    'high': round(float(row.High), 4) if pd.notna(row.High) else None,
+                    'low': round(float(row.Low), 4) if pd.notna(row.Low) else None,
+                    'close': round(float(row.Close), 4),
+                    'volume': int(row.Volume)
                 }
-                
-            except Exception as e:
-                logging.error(f"❌ Erro {ticker} (tentativa {attempt + 1}): {e}")
-                if attempt < self.retry_attempts - 1:
-                    time.sleep(2 ** attempt)
-                continue
+                records.append(record)
+            
+            if not records:
+                logging.warning(f"Sem registros válidos para {ticker}")
+                return None
+            
+            logging.info(f"✅ {ticker}: {len(records)} registros válidos")
+            return {
+                'ticker': ticker,
+                'records_count': len(records),
+                'date_range': f"{records[0]['date']} to {records[-1]['date']}",
+                'records': records,
+                'corporate_actions': factors.action_records()
+            }
+            
+        except Exception as e:
+            logging.error(f"❌ Erro ao processar {ticker}: {e}")
+            return None
+    
+    def collect_stock_history_optimized(self, ticker: str) -> Dict[str, Any]:
+        """Coletar histórico de uma ação retomando do último estágio concluído"""
+        return self.state.resume(ticker, {
+            'fetched': lambda _: self.fetch_history(ticker),
+            'computed': lambda history: self.build_stock_data(ticker, history)
+        })
+    
+    def get_bulk_loader(self) -> StockPricesBulkLoader:
+        """Carregador COPY reutilizando uma única conexão durante a execução"""
+        if self._bulk_loader is None:
+            conn = connect_from_env(self.database_url)
+            self.asset_ids = AssetIdResolver(conn)
+            self._bulk_loader = StockPricesBulkLoader(conn, asset_ids=self.asset_ids)
+        return self._bulk_loader
+    
+    @timed('db.write', path='copy')
+    def bulk_load_batch(self, stocks_data: List[Dict[str, Any]]) -> bool:
+        """Carregar lote via COPY FROM STDIN + merge único em stock_prices_daily"""
+        
+        try:
+            loader = self.get_bulk_loader()
+            loader.resolve_tickers(stock_data['ticker'] for stock_data in stocks_data)
+            
+            price_rows = (record for stock_data in stocks_data for record in stock_data['records'])
+            result = loader.load_prices(price_rows)
+            
+            # Só eventos novos (detecção de mudanças): fatores atualizados incrementalmente no banco
+            actions = [action for stock_data in stocks_data
+                       for action in stock_data.get('corporate_actions', [])]
+            if actions:
+                loader.apply_corporate_actions(actions)
+            
+            logging.info(f"✅ Lote carregado via COPY: {result['merged']:,} registros em {result['duration']:.1f}s")
+            return True
+            
+        except Exception as e:
+            logging.error(f"Erro na carga via COPY: {e}")
+            return False
+    
+    @timed('change_detection')
+    def filter_unchanged(self, stocks_data: List[Dict[str, Any]]):
+        """Remover barras e fatores idênticos aos da última carga confirmada"""
         
-        return None
+        filtered = []
+        changesets = []
+        total_rows = changed_rows = 0
+        
+        for stock_data in stocks_data:
+            ticker = stock_data['ticker']
+            if self.full_refresh:
+                self.row_hashes.forget('stock_prices_daily', ticker)
+                self.row_hashes.forget('stock_adjustment_factors', ticker)
+            
+            price_changes = self.row_hashes.diff('stock_prices_daily', ticker, stock_data['records'])
+            factor_changes = self.row_hashes.diff(
+                'stock_adjustment_factors', ticker, stock_data.get('corporate_actions', []),
+                key=lambda factor: f"{factor['ex_date']}|{factor['action_type']}",
+                partition=lambda factor: 'all'
+            )
+            changesets.extend([price_changes, factor_changes])
+            total_rows += price_changes.total_rows
+            changed_rows += len(price_changes.rows)
+            
+            if price_changes.rows or factor_changes.rows:
+                # Hashes pendentes acompanham o lote (na outbox, confirmados só após o COPY)
+                filtered.append({**stock_data, 'records': price_changes.rows,
+                                 'corporate_actions': factor_changes.rows,
+                                 'row_hashes': {changes.scope: changes.pending
+                                                for changes in (price_changes, factor_changes)}})
+        
+        logging.info(f"🔍 Mudanças: {changed_rows:,}/{total_rows:,} barras novas ou revisadas")
+        return filtered, changesets
     
     def insert_batch_to_supabase(self, stocks_data: List[Dict[str, Any]]) -> bool:
-        """Inserir lote de dados diretamente no Supabase via MCP"""
+        """Inserir apenas as linhas novas ou revisadas do lote"""
+        
+        changed_data, changesets = self.filter_unchanged(stocks_data)
+        if not changed_data:
+            logging.info("⏭️ Lote sem mudanças desde a última carga")
+            for changes in changesets:
+                self.row_hashes.commit(changes)  # contabiliza as linhas puladas
+            return True
+        
+        if self.outbox is not None:
+            success = self.enqueue_batch(changed_data)
+            confirmed = False
+            if success:
+                # Ações na outbox: hashes confirmados por load_from_outbox depois do COPY;
+                # as sem linhas a enviar já estão confirmadas
+                queued = {stock_data['ticker'] for stock_data in changed_data}
+                for changes in changesets:
+                    self.row_hashes.commit(changes, persist=not any(
+                        ticker in queued for ticker, *_ in changes.pending))
+        elif self.database_url:
+            success = confirmed = self.bulk_load_batch(changed_data)
+        else:
+            # SQL apenas impresso para execução externa: nada foi gravado, os hashes não são confirmados
+            success = self.emit_sql_batch(changed_data)
+            confirmed = False
+        if confirmed:
+            for changes in changesets:
+                self.row_hashes.commit(changes)
+        return success
+    
+    @timed('serialize', target='outbox')
+    def enqueue_batch(self, stocks_data: List[Dict[str, Any]]) -> bool:
+        """Gravar o lote na outbox local (os hashes vão junto e são confirmados após a carga)"""
+        
+        try:
+            for stock_data in stocks_data:
+                self.outbox.enqueue('stock_prices_daily', [{
+                    'ticker': stock_data['ticker'],
+                    'records': stock_data['records'],
+                    'corporate_actions': stock_data.get('corporate_actions', []),
+                    'row_hashes': stock_data.get('row_hashes', {})
+                }], ordering_key=stock_data['ticker'])
+            logging.info(f"📥 Lote na outbox: {len(stocks_data)} ações")
+            return True
+        except Exception as e:
+            logging.error(f"Erro ao gravar na outbox: {e}")
+            return False
+    
+    def start_drainer(self):
+        """Drenador em background: várias ações por COPY, independente do ritmo da coleta"""
+        if self.outbox is not None and self.drainer is None:
+            self.drainer = OutboxDrainer(self.outbox, {'stock_prices_daily': self.load_from_outbox}).start()
+    
+    def load_from_outbox(self, stocks_data: List[Dict[str, Any]]) -> bool:
+        """Handler do drenador: carga via COPY, depois hashes e estágio 'loaded' das ações confirmadas"""
+        success = self.bulk_load_batch(stocks_data)
+        if success:
+            for stock_data in stocks_data:
+                for scope, pending in stock_data.get('row_hashes', {}).items():
+                    self.row_hashes.commit_pending(scope, pending)
+            self.state.complete_many({stock_data['ticker'] for stock_data in stocks_data}, 'loaded')
+        return success
+    
+    @timed('serialize', target='sql')
+    def emit_sql_batch(self, stocks_data: List[Dict[str, Any]]) -> bool:
+        """Gerar e emitir o SQL do lote para execução externa (MCP)"""
         
         try:
             # Gerar SQL INSERT para o lote
             all_values = []
+            action_calls = []
             
             for stock_data in stocks_data:
                 ticker = stock_data['ticker']
                 records = stock_data['records']
+                asset_id = self.asset_ids.sql_ref(ticker)
+                
+                for action in sorted(stock_data.get('corporate_actions', []), key=lambda a: a['ex_date']):
+                    action_calls.append(
+                        f"SELECT apply_corporate_action({asset_id}, '{action['ex_date']}', "
+                        f"'{action['action_type']}', {action['value']}, {action['ratio']});"
+                    )
                 
                 for record in records:
                     value = f"""(
-                        (SELECT id FROM assets_master WHERE ticker = '{ticker}' AND asset_type = 'STOCK'),
+                        {asset_id},
                         '{record['date']}',
                         {record['open'] if record['open'] is not None else 'NULL'},
                         {record['high'] if record['high'] is not None else 'NULL'},
                         {record['low'] if record['low'] is not None else 'NULL'},
                         {record['close']},
-                        {record['adj_close']},
                         {record['volume']}
                     )"""
                     all_values.append(value)
@@ -151,14 +353,13 @@ class MassiveHistoricalCollector:
                 
                 sql = f"""
                 INSERT INTO stock_prices_daily (
-                    asset_id, date, open, high, low, close, adj_close, volume
+                    asset_id, date, open, high, low, close, volume
                 ) VALUES {','.join(chunk)}
                 ON CONFLICT (asset_id, date) DO UPDATE SET
                     open = EXCLUDED.open,
                     high = EXCLUDED.high,
                     low = EXCLUDED.low,
                     close = EXCLUDED.close,
-                    adj_close = EXCLUDED.adj_close,
                     volume = EXCLUDED.volume;
                 """
                 
@@ -171,6 +372,15 @@ class MassiveHistoricalCollector:
                 
                 time.sleep(0.5)  # Pequeno delay entre chunks
             
+            # Eventos novos: fatores cumulativos atualizados no banco (idempotente por evento)
+            if action_calls:
+                factors_sql = '\n'.join(action_calls)
+                
+                logging.info(f"Aplicando {len(action_calls)} eventos corporativos")
+                print("EXECUTE_SQL_FACTORS:")
+                print(factors_sql[:500] + "..." if len(factors_sql) > 500 else factors_sql)
+                print("END_FACTORS")
+            
             return True
             
         except Exception as e:
@@ -185,8 +395,23 @@ class MassiveHistoricalCollector:
         
         # Obter Top 50 ações
         top_50_stocks = self.get_top_50_stocks()
+        self.start_drainer()
+        
+        # Retomar pelo estado por estágio: ações já carregadas (ou, sem outbox, já serializadas) são puladas;
+        # as demais recomeçam do primeiro estágio incompleto, reaproveitando o que já foi baixado. Com a
+        # outbox, uma ação serializada mas não carregada é reenfileirada (entrada 'dead' volta à fila)
+        pending = self.state.pending(top_50_stocks, until='loaded' if self.outbox is not None else 'serialized')
+        if len(pending) < len(top_50_stocks):
+            logging.info(f"♻️ Retomando execução: {len(top_50_stocks) - len(pending)} ações já concluídas; "
+                         f"estágios: {self.state.summary()}")
+            top_50_stocks = pending
         
-        # Processar em lotes de 10 ações
+        delisted = [ticker for ticker in top_50_stocks if ticker in self.provider_errors.delisted]
+        if delisted:
+            logging.info(f"🚫 {len(delisted)} ações deslistadas/inexistentes ignoradas: {delisted[:10]}")
+            top_50_stocks = [ticker for ticker in top_50_stocks if ticker not in self.provider_errors.delisted]
+        
+        # Estimativa inicial; o número real depende do tamanho adaptativo dos lotes
         total_batches = len(top_50_stocks) // self.batch_size + (1 if len(top_50_stocks) % self.batch_size > 0 else 0)
         
         overall_results = {
@@ -196,29 +421,38 @@ class MassiveHistoricalCollector:
             'successful_stocks': 0,
             'failed_stocks': 0,
             'total_records': 0,
+            'delisted_skipped': len(delisted),
+            'retries_scheduled': 0,
             'batches_processed': []
         }
+        self.events.run_started(total=len(top_50_stocks), batches=total_batches)
+        performance = RunReport('massive_historical', events=self.events).start()
         
-        for batch_num in range(total_batches):
-            start_idx = batch_num * self.batch_size
-            end_idx = min(start_idx + self.batch_size, len(top_50_stocks))
-            batch_stocks = top_50_stocks[start_idx:end_idx]
-            
-            logging.info(f"📦 LOTE {batch_num + 1}/{total_batches}: {batch_stocks}")
+        # Lista de trabalho cresce com os retries vencidos (só a sub-requisição que falhou é refeita)
+        work = list(top_50_stocks)
+        consumed = 0
+        for batch_num, batch_stocks in enumerate(self.memory.iter_batches(work)):
+            logging.info(f"📦 LOTE {batch_num + 1} ({len(batch_stocks)} ações): {batch_stocks}")
             
             # Coletar dados do lote
             batch_data = []
             batch_records = 0
             
             for ticker in batch_stocks:
-                stock_data = self.collect_stock_history_optimized(ticker)
+                with ticker_scope(ticker):
+                    stock_data = self.collect_stock_history_optimized(ticker)
                 
                 if stock_data:
                     batch_data.append(stock_data)
                     batch_records += stock_data['records_count']
                     overall_results['successful_stocks'] += 1
                 else:
-                    overall_results['failed_stocks'] += 1
+                    failure = self.failures.pop(ticker, None)
+                    if failure is not None and failure.disposition == 'retry':
+                        overall_results['retries_scheduled'] += 1
+                    else:
+                        overall_results['failed_stocks'] += 1
+                        self.events.item(ticker, 'failed', error_class=failure.kind if failure else 'no_data')
                 
                 time.sleep(self.delay_between_requests)
             
@@ -228,6 +462,11 @@ class MassiveHistoricalCollector:
                 success = self.insert_batch_to_supabase(batch_data)
                 
                 if success:
+                    tickers = [stock_data['ticker'] for stock_data in batch_data]
+                    self.state.complete_many(tickers, 'serialized')
+                    if self.outbox is None and self.database_url:
+                        self.state.complete_many(tickers, 'loaded')  # SQL só impresso não conta como carregado
+                    
                     overall_results['total_records'] += batch_records
                     overall_results['batches_processed'].append({
                         'batch_num': batch_num + 1,
@@ -242,12 +481,46 @@ class MassiveHistoricalCollector:
                         'records': batch_records,
                         'status': 'FAILED'
                     })
+                
+                for stock_data in batch_data:
+                    self.events.item(stock_data['ticker'], 'success' if success else 'failed',
+                                     error_class=None if success else 'db_write',
+                                     records=stock_data['records_count'])
+            
+            # Liberar o lote antes da medição de memória do próximo
+            batch_data.clear()
+            
+            # Retries vencidos entram nos próximos lotes; no fim da lista, aguardar o próximo vencimento
+            consumed += len(batch_stocks)
+            work.extend(item.key for item in self.provider_errors.retries.take_due(block=consumed >= len(work)))
             
             # Delay entre lotes
-            time.sleep(1.0)
+            time.sleep(self.delay_between_batches)
+        
+        # Enviar o que restou na outbox antes do relatório
+        if self.drainer is not None:
+            self.drainer.stop(drain=True)
+            overall_results['outbox'] = {'drained': self.drainer.stats, 'pending': self.outbox.stats()}
+        
+        # Execução completa: o estado não é mais necessário e a próxima coleta começa do zero
+        overall_results['state_reset'] = (overall_results['failed_stocks'] == 0
+                                          and len(self.provider_errors.retries) == 0)
+        if overall_results['state_reset']:
+            self.state.reset()
+        
+        overall_results['total_batches'] = len(self.memory.batches)
+        overall_results['provider_errors'] = self.provider_errors.stats()
+        overall_results['memory'] = self.memory.report()
+        self.memory.close()
+        overall_results['performance_report'] = performance.finish()
+        
+        # Latência por estágio (JSON + formato Prometheus)
+        run_stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        overall_results['telemetry'] = TELEMETRY.snapshot()
+        telemetry_files = TELEMETRY.export(f"massive_collection_telemetry_{run_stamp}")
         
         # Salvar relatório final
-        report_filename = f"massive_collection_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        report_filename = f"massive_collection_report_{run_stamp}.json"
         
         with open(report_filename, 'w', encoding='utf-8') as f:
             json.dump(overall_results, f, indent=2, default=str)
@@ -258,18 +531,40 @@ class MassiveHistoricalCollector:
         logging.info(f"❌ Falhas: {overall_results['failed_stocks']}/{overall_results['total_stocks']}")
         logging.info(f"📈 Total de registros: {overall_results['total_records']:,}")
         logging.info(f"💾 Relatório salvo: {report_filename}")
+        logging.info(f"⏱️ Telemetria: {telemetry_files['json']}, {telemetry_files['prometheus']}")
+        logging.info(f"🧠 Memória: pico {overall_results['memory']['peak_rss_mb']}MB de "
+                     f"{overall_results['memory']['budget_mb']}MB, lote final {overall_results['memory']['final_batch_size']}")
         
+        self.events.run_finished(successful=overall_results['successful_stocks'],
+                                 failed=overall_results['failed_stocks'])
         return overall_results
 
 def main():
     """Função principal"""
-    collector = MassiveHistoricalCollector()
-    results = collector.run_massive_collection()
+    parser = argparse.ArgumentParser(description='Coleta massiva de dados históricos')
+    parser.add_argument('--memory-budget-mb', type=float, default=DEFAULT_BUDGET_MB,
+                        help='Orçamento de memória do processo; o tamanho dos lotes se adapta a ele')
+    resume = parser.add_mutually_exclusive_group()
+    resume.add_argument('--resume', dest='fresh', action='store_false',
+                        help='Retomar a execução interrompida pelo estado por estágio (padrão)')
+    resume.add_argument('--fresh', dest='fresh', action='store_true',
+                        help='Descartar o estado salvo e coletar todas as ações')
+    parser.set_defaults(fresh=False)
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    start_profiling(args.profile, args.profile_dir)
+    
+    collector = MassiveHistoricalCollector(memory_budget_mb=args.memory_budget_mb, fresh=args.fresh)
+    try:
+        results = collector.run_massive_collection()
+    finally:
+        stop_profiling()
     
     print("\n🎯 COLETA MASSIVA CONCLUÍDA!")
     print(f"Sucessos: {results['successful_stocks']}/{results['total_stocks']}")
     print(f"Registros coletados: {results['total_records']:,}")
-    print(f"Taxa de sucesso: {(results['successful_stocks']/results['total_stocks']*100):.1f}%")
+    if results['total_stocks']:
+        print(f"Taxa de sucesso: {(results['successful_stocks']/results['total_stocks']*100):.1f}%")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+GOVERNADOR DE MEMÓRIA COM TAMANHO DE LOTE ADAPTATIVO
+Mede RSS (e, opcionalmente, o pico do tracemalloc) a cada lote, estima o
+custo de memória por item e ajusta o tamanho do próximo lote para manter o
+processo abaixo do orçamento configurado. Em máquinas pequenas o lote
+encolhe em vez de o worker ser morto por OOM; com folga, volta a crescer
+até o máximo. O relatório inclui os maiores pontos de alocação
+"""
+
+import gc
+import logging
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+DEFAULT_BUDGET_MB = float(os.getenv('MEMORY_BUDGET_MB', '1024'))
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss() -> int:
+    """RSS atual do processo em bytes (pico do processo onde /proc não existe)"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss() -> int:
+    """Pico de RSS do processo em bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux informa em KB
+
+
+def _mb(value: float) -> float:
+    return round(value / (1024 * 1024), 1)
+
+
+class MemoryGovernor:
+    """
+    Lotes adaptativos sob um orçamento de memória. Uso:
+
+        for batch in governor.iter_batches(tickers):
+            ...  # processar o lote; a medição cobre o corpo do loop
+    """
+
+    def __init__(self, budget_mb: float = DEFAULT_BUDGET_MB, initial_batch: int = 10,
+                 min_batch: int = 1, max_batch: Optional[int] = None, headroom: float = 0.85,
+                 trace: bool = os.getenv('MEMORY_TRACE') == '1', top_n: int = 10):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.batch_size = max(initial_batch, min_batch)
+        self.min_batch = min_batch
+        self.max_batch = max_batch or initial_batch * 4
+        self.headroom = headroom
+        self.trace = trace
+        self.top_n = top_n
+        self.item_cost = 0.0  # bytes por item (máximo com decaimento)
+        self.batches: List[Dict[str, Any]] = []
+        self.top_allocations: List[Dict[str, Any]] = []
+        self.peak_traced = 0
+        self.shrinks = 0
+        self._started_tracing = False
+
+    # Medição --------------------------------------------------------------
+
+    def _begin(self) -> Dict[str, Any]:
+        if self.trace:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+        return {
+            'rss': current_rss(),
+            'traced': tracemalloc.get_traced_memory()[0] if self.trace else 0,
+            'started': time.perf_counter()
+        }
+
+    def _end(self, start: Dict[str, Any], size: int) -> Dict[str, Any]:
+        rss = current_rss()
+        growth = rss - start['rss']
+        traced_peak = 0
+        if self.trace:
+            current, traced_peak = tracemalloc.get_traced_memory()
+            # Pico transitório dentro do lote (alocações já liberadas não aparecem no RSS final)
+            growth = max(growth, traced_peak - start['traced'])
+            if traced_peak > self.peak_traced:
+                self.peak_traced = traced_peak
+                self._capture_top_allocations()
+
+        observed = max(growth, 0) / max(size, 1)
+        # Máximo com decaimento: o alocador reaproveita memória e subestimaria os lotes seguintes
+        self.item_cost = max(observed, self.item_cost * 0.9)
+
+        stats = {
+            'batch_size': size,
+            'seconds': round(time.perf_counter() - start['started'], 3),
+            'rss_before_mb': _mb(start['rss']),
+            'rss_after_mb': _mb(rss),
+            'traced_peak_mb': _mb(traced_peak) if self.trace else None,
+            'item_cost_mb': round(self.item_cost / (1024 * 1024), 3)
+        }
+        self.batches.append(stats)
+        self._adapt(rss)
+        stats['next_batch_size'] = self.batch_size
+        return stats
+
+    def _adapt(self, rss: int):
+        """Próximo lote = memória livre no orçamento / custo por item (crescimento até 2x por lote)"""
+        if rss > self.budget:
+            gc.collect()
+            rss = current_rss()
+        available = self.budget * self.headroom - rss
+        if available <= 0:
+            target = self.min_batch
+        elif self.item_cost > 0:
+            target = int(available // self.item_cost)
+        else:
+            target = self.max_batch
+
+        target = min(target, self.batch_size * 2, self.max_batch)
+        target = max(target, self.min_batch)
+        if target < self.batch_size:
+            self.shrinks += 1
+            logging.warning(f"🧠 Memória {_mb(rss)}MB / orçamento {_mb(self.budget)}MB: "
+                            f"lote {self.batch_size} -> {target}")
+        self.batch_size = target
+
+    def _capture_top_allocations(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        self.top_allocations = [
+            {'site': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+             'size_mb': _mb(stat.size), 'blocks': stat.count}
+            for stat in snapshot.statistics('lineno')[:self.top_n]
+        ]
+
+    # Lotes ------------------------------------------------------------------
+
+    def iter_batches(self, items: Sequence[Any]) -> Iterator[List[Any]]:
+        """Fatiar `items` com o tamanho atual; cada lote é medido até o pedido do próximo"""
+        index = 0
+        while index < len(items):
+            batch = list(items[index:index + self.batch_size])
+            index += len(batch)
+            start = self._begin()
+            yield batch
+            self._end(start, len(batch))
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'budget_mb': _mb(self.budget),
+            'peak_rss_mb': _mb(peak_rss()),
+            'traced_peak_mb': _mb(self.peak_traced) if self.trace else None,
+            'item_cost_mb': round(self.item_cost / (1024 * 1024), 3),
+            'final_batch_size': self.batch_size,
+            'shrinks': self.shrinks,
+            'batches': self.batches,
+            'top_allocations': self.top_allocations
+        }
+
+    def close(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+CACHE DE MÉTRICAS CALCULADAS
+Resultados memoizados por (calculadora, ticker, último pregão, hash do conteúdo
+da série, parâmetros). Persistido em SQLite para ser compartilhado entre
+pipelines e execuções, com limite de tamanho e remoção LRU
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from telemetry import TELEMETRY
+
+DEFAULT_CACHE_PATH = os.getenv('METRIC_CACHE_PATH', 'metric_cache.db')
+
+
+def series_fingerprint(prices: pd.Series) -> str:
+    """Hash do conteúdo da série (datas + valores), independente do dtype de entrada"""
+    digest = hashlib.blake2b(digest_size=16)
+    index = pd.DatetimeIndex(prices.index)
+    digest.update(np.ascontiguousarray(index.asi8).tobytes())
+    digest.update(np.ascontiguousarray(prices.to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+class MetricCache:
+    """Cache LRU persistente de snapshots de métricas"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 20000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS metric_cache (
+                cache_key TEXT PRIMARY KEY,
+                calculator TEXT,
+                ticker TEXT,
+                last_bar TEXT,
+                payload TEXT,
+                created_at REAL,
+                last_access REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_metric_cache_access ON metric_cache (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(calculator: str, ticker: str, prices: pd.Series, params: Dict[str, Any]) -> Dict[str, str]:
+        """Chave do cache: último pregão + hash do conteúdo + parâmetros da calculadora"""
+        last_bar = pd.Timestamp(prices.index[-1]).strftime('%Y-%m-%d') if len(prices) else ''
+        params_json = json.dumps(params, sort_keys=True, default=str)
+        raw_key = '|'.join([calculator, ticker, last_bar, series_fingerprint(prices), params_json])
+        return {
+            'cache_key': hashlib.sha256(raw_key.encode('utf-8')).hexdigest(),
+            'last_bar': last_bar
+        }
+
+    def get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM metric_cache WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                TELEMETRY.count('cache.lookups', cache='metric', result='miss')
+                return None
+            self._conn.execute(
+                "UPDATE metric_cache SET last_access = ? WHERE cache_key = ?", (time.time(), cache_key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        TELEMETRY.count('cache.lookups', cache='metric', result='hit')
+        return json.loads(row[0])
+
+    def put(self, cache_key: str, calculator: str, ticker: str, last_bar: str, value: Dict[str, Any]):
+        now = time.time()
+        payload = json.dumps(value, default=str)
+        with self._lock:
+            self._conn.execute("""
+                INSERT OR REPLACE INTO metric_cache
+                (cache_key, calculator, ticker, last_bar, payload, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (cache_key, calculator, ticker, last_bar, payload, now, now))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Remover entradas menos usadas recentemente acima do limite"""
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM metric_cache").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute("""
+                DELETE FROM metric_cache WHERE cache_key IN (
+                    SELECT cache_key FROM metric_cache ORDER BY last_access ASC LIMIT ?
+                )
+            """, (excess,))
+
+    def get_or_compute(self, calculator: str, ticker: str, prices: pd.Series,
+                       params: Dict[str, Any],
+                       compute: Callable[[], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """Devolver snapshot em cache ou calcular e armazenar"""
+        key = self.make_key(calculator, ticker, prices, params)
+        cached = self.get(key['cache_key'])
+        if cached is not None:
+            return cached
+
+        value = compute()
+        if value:
+            self.put(key['cache_key'], calculator, ticker, key['last_bar'], value)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_shared_cache: Optional[MetricCache] = None
+
+
+def get_shared_cache() -> MetricCache:
+    """Instância única por processo (pipelines no mesmo processo compartilham)"""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = MetricCache()
+    return _shared_cache
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+BENCHMARK PONTA A PONTA DOS PIPELINES (PROVEDOR E BANCO SINTÉTICOS)
+Liga os pipelines reais a um provedor de mercado sintético (latência e taxa
+de erro configuráveis, no lugar do yfinance) e a destinos em processo: um
+banco falso para o caminho COPY do coletor massivo e um servidor PostgREST
+local para o upsert REST do worker de enriquecimento. Cada tamanho roda em
+um subprocesso próprio (pico de RSS isolado) e o resultado - ações/s, p95
+por ação, p95 por estágio e pico de RSS - é acrescentado a um JSONL para
+acompanhar a evolução entre versões
+
+    python scripts/pipeline_benchmark.py --sizes 100 1000 5000
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PIPELINES = ('historical', 'enrichment')
+DEFAULT_SIZES = (100, 1000, 5000)
+DEFAULT_RESULTS_PATH = 'benchmark_results.jsonl'
+
+
+class ProviderError(ConnectionError):
+    """Falha transitória simulada do provedor"""
+
+
+class FakeTicker:
+    """Mesma interface usada dos objetos `yf.Ticker` (history, info, dividends)"""
+
+    def __init__(self, provider: 'FakeMarketData', symbol: str):
+        self.provider = provider
+        self.symbol = symbol
+
+    def history(self, period: str = None, interval: str = '1d', start: str = None, end: str = None,
+                auto_adjust: bool = True, actions: bool = True, **kwargs):
+        self.provider.call(self.symbol)
+        return self.provider.frame(self.symbol, adjusted=auto_adjust, actions=actions)
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        self.provider.call(self.symbol)
+        close = float(self.provider.frame(self.symbol)['Close'].iloc[-1])
+        return {'longName': f"{self.symbol} Synthetic Corp", 'currentPrice': close,
+                'marketCap': int(close * 1e9), 'dividendYield': 0.015}
+
+    @property
+    def dividends(self):
+        self.provider.call(self.symbol)
+        dividends = self.provider.frame(self.symbol)['Dividends']
+        return dividends[dividends > 0]
+
+
+class FakeMarketData:
+    """Provedor sintético determinístico (substitui o módulo `yf` dos pipelines)"""
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.01, years: int = 10, seed: int = 42):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.days = years * 252
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def Ticker(self, symbol: str) -> FakeTicker:  # noqa: N802 - mesma API do yfinance
+        return FakeTicker(self, symbol)
+
+    def call(self, symbol: str):
+        """Latência de rede (±50%) e erro transitório com a probabilidade configurada"""
+        with self._lock:
+            self.calls += 1
+            jitter = self._random.uniform(0.5, 1.5)
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency * jitter)
+        if failed:
+            raise ProviderError(f"Falha simulada do provedor para {symbol}")
+
+    def frame(self, symbol: str, adjusted: bool = True, actions: bool = True):
+        import numpy as np
+        import pandas as pd
+
+        rng = np.random.default_rng(zlib.crc32(symbol.encode()) ^ self.seed)
+        dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=self.days, name='Date')
+        close = rng.uniform(10, 500) * np.exp(np.cumsum(rng.normal(0.0003, 0.018, self.days)))
+        open_ = close * (1 + rng.normal(0, 0.003, self.days))
+        spread = np.abs(rng.normal(0, 0.004, self.days))
+        dividends = np.zeros(self.days)
+        dividends[62::63] = np.round(close[62::63] * 0.004, 4)  # trimestrais
+
+        frame = pd.DataFrame({
+            'Open': open_,
+            'High': np.maximum(open_, close) * (1 + spread),
+            'Low': np.minimum(open_, close) * (1 - spread),
+            'Close': close,
+            'Volume': rng.integers(100_000, 50_000_000, self.days),
+        }, index=dates)
+        if not adjusted:
+            frame.insert(4, 'Adj Close', close)
+        if actions:
+            frame['Dividends'] = dividends
+            frame['Stock Splits'] = 0.0
+        return frame
+
+
+class FakeCursor:
+    def __init__(self, conn: 'FakeConnection'):
+        self.conn = conn
+        self.rowcount = 0
+        self._copied = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql: str, params=None):
+        self.conn.statements += 1
+        # O merge após o COPY aplica as linhas da staging
+        self.rowcount = self._copied if sql.lstrip().upper().startswith('INSERT') else 0
+
+    def copy_expert(self, sql: str, buffer: io.StringIO):
+        rows = buffer.getvalue().count('\n')
+        self._copied += rows
+        self.conn.rows += rows
+        self.conn.bytes += len(buffer.getvalue())
+
+    def fetchall(self) -> List:
+        return []
+
+
+class FakeConnection:
+    """Conexão estilo psycopg2 em memória; cada commit custa `commit_latency`"""
+
+    def __init__(self, commit_latency: float = 0.01):
+        self.commit_latency = commit_latency
+        self.statements = 0
+        self.commits = 0
+        self.rows = 0
+        self.bytes = 0
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+        if self.commit_latency:
+            time.sleep(self.commit_latency)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeRestSink:
+    """Servidor PostgREST local (POST/PATCH em /rest/v1/<tabela>) contando linhas recebidas"""
+
+    def __init__(self, latency: float = 0.01):
+        sink = self
+        self.latency = latency
+        self.requests = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, como o PostgREST
+
+            def _handle(self, status: int):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                payload = json.loads(body or b'null')
+                with sink._lock:
+                    sink.requests += 1
+                    sink.rows += len(payload) if isinstance(payload, list) else 1
+                if sink.latency:
+                    time.sleep(sink.latency)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_POST(self):  # noqa: N802
+                self._handle(201)
+
+            def do_PATCH(self):  # noqa: N802
+                self._handle(204)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, name='fake-rest', daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def _timed_method(obj, name: str, latencies: List[float]):
+    """Substituir `obj.name` por uma versão que registra a duração de cada chamada"""
+    original = getattr(obj, name)
+
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    setattr(obj, name, wrapper)
+
+
+def run_historical(symbols: List[str], provider: FakeMarketData, args) -> Dict[str, Any]:
+    """Coletor massivo: fetch -> cálculo de fatores/registros -> detecção de mudanças -> COPY"""
+    import massive_historical_collector as module
+    from asset_ids import AssetIdResolver
+    from bulk_loader import StockPricesBulkLoader
+
+    module.yf = provider
+    collector = module.MassiveHistoricalCollector()
+    collector.get_top_50_stocks = lambda: symbols
+    collector.delay_between_requests = 0
+    collector.delay_between_batches = 0
+    conn = FakeConnection(args.db_latency)
+    collector.database_url = 'fake://benchmark'
+    collector.asset_ids = AssetIdResolver(ids={symbol: i for i, symbol in enumerate(symbols, 1)})
+    collector._bulk_loader = StockPricesBulkLoader(conn, asset_ids=collector.asset_ids)
+
+    latencies: List[float] = []
+    _timed_method(collector, 'collect_stock_history_optimized', latencies)
+    results = collector.run_massive_collection()
+    return {
+        'latencies': latencies,
+        'successful': results['successful_stocks'],
+        'failed': results['failed_stocks'],
+        'sink': {'rows': conn.rows, 'bytes': conn.bytes, 'commits': conn.commits}
+    }
+
+
+def run_enrichment(symbols: List[str], provider: FakeMarketData, args) -> Dict[str, Any]:
+    """Worker de enriquecimento: fetch (histórico, info, dividendos) -> métricas -> upsert REST"""
+    import stock_enrichment_worker as module
+
+    module.yf = provider
+    sink = FakeRestSink(args.db_latency)
+    worker = module.StockEnrichmentWorker(sink.url, 'benchmark-key')
+    latencies: List[float] = []
+    _timed_method(worker, 'process_stock', latencies)
+
+    processed = {}
+    retries = worker.provider_errors.retries
+    try:
+        for symbol in symbols:
+            processed[symbol] = worker.process_stock(symbol)
+            # Como no main() do worker: retries vencidos entre as ações, o restante no fim
+            for item in retries.take_due():
+                processed[item.key] = worker.retry_subrequest(item, processed.get(item.key))
+        while len(retries):
+            for item in retries.take_due(block=True):
+                processed[item.key] = worker.retry_subrequest(item, processed.get(item.key))
+
+        rows = list(processed.values())
+        for start in range(0, len(rows), worker.rest_writer.batch_size):
+            worker.save_batch_to_supabase(rows[start:start + worker.rest_writer.batch_size])
+    finally:
+        sink.close()
+    failed = sum(1 for metrics in processed.values() if metrics.calculation_errors)
+    successful = len(processed) - failed
+    return {
+        'latencies': latencies,
+        'successful': successful,
+        'failed': failed,
+        'sink': {'rows': sink.rows, 'requests': sink.requests}
+    }
+
+
+RUNNERS = {'historical': run_historical, 'enrichment': run_enrichment}
+
+
+def run_one(pipeline: str, size: int, args) -> Dict[str, Any]:
+    """Uma execução (chamada no subprocesso, dentro de um diretório temporário)"""
+    from memory_governor import peak_rss
+    from telemetry import TELEMETRY
+
+    if not args.verbose:
+        logging.disable(logging.INFO)  # os módulos dos pipelines configuram INFO ao serem importados
+    symbols = [f"SYN{i:05d}" for i in range(size)]
+    provider = FakeMarketData(args.provider_latency, args.error_rate, args.years, args.seed)
+
+    started = time.perf_counter()
+    outcome = RUNNERS[pipeline](symbols, provider, args)
+    elapsed = time.perf_counter() - started
+    latencies = outcome.pop('latencies')
+
+    stages = {name: {'count': data['count'], 'p50': data['p50'], 'p95': data['p95'], 'sum': data['sum']}
+              for name, data in TELEMETRY.snapshot()['spans'].items()}
+    return {
+        'pipeline': pipeline,
+        'symbols': size,
+        'seconds': round(elapsed, 3),
+        'symbols_per_sec': round(size / elapsed, 3) if elapsed else None,
+        'latency_p50': round(_percentile(latencies, 0.50), 4),
+        'latency_p95': round(_percentile(latencies, 0.95), 4),
+        'peak_rss_mb': round(peak_rss() / (1024 * 1024), 1),
+        'provider': {'calls': provider.calls, 'errors': provider.errors},
+        'stages': stages,
+        **outcome
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ponta a ponta com provedor e banco sintéticos')
+    parser.add_argument('--pipelines', nargs='+', choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(DEFAULT_SIZES))
+    parser.add_argument('--provider-latency', type=float, default=0.05, help='Latência média por chamada (s)')
+    parser.add_argument('--error-rate', type=float, default=0.01, help='Probabilidade de erro por chamada')
+    parser.add_argument('--db-latency', type=float, default=0.01, help='Latência por commit/requisição (s)')
+    parser.add_argument('--years', type=int, default=10, help='Anos de barras diárias por ação')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--results', default=DEFAULT_RESULTS_PATH, help='JSONL acumulado dos resultados')
+    parser.add_argument('--verbose', action='store_true', help='Manter os logs INFO dos pipelines')
+    parser.add_argument('--run-one', nargs=2, metavar=('PIPELINE', 'SIZE'), help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        result = run_one(args.run_one[0], int(args.run_one[1]), args)
+        with open(args.result_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f, default=str)
+        return
+
+    from run_report import git_revision
+
+    params = {key: getattr(args, key) for key in ('provider_latency', 'error_rate', 'db_latency', 'years', 'seed')}
+    environment = {'git': git_revision(), 'python': platform.python_version(),
+                   'platform': platform.platform(), 'cpus': os.cpu_count()}
+    results_path = os.path.abspath(args.results)
+    passthrough = [f"--{key.replace('_', '-')}={value}" for key, value in params.items()]
+    if args.verbose:
+        passthrough.append('--verbose')
+
+    for pipeline in args.pipelines:
+        for size in args.sizes:
+            print(f"⏱️ {pipeline}: {size} ações...", flush=True)
+            # Diretório próprio: checkpoints, estado e relatórios da execução não vazam entre rodadas
+            with tempfile.TemporaryDirectory(prefix=f"bench_{pipeline}_{size}_") as workdir:
+                result_file = os.path.join(workdir, 'result.json')
+                completed = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--run-one', pipeline, str(size),
+                     '--result-file', result_file, *passthrough],
+                    cwd=workdir, env={**os.environ, 'PYTHONPATH': SCRIPTS_DIR, 'WRITE_OUTBOX': '0'}
+                )
+                if completed.returncode != 0 or not os.path.exists(result_file):
+                    print(f"❌ {pipeline} com {size} ações falhou (código {completed.returncode})")
+                    continue
+                with open(result_file, 'r', encoding='utf-8') as f:
+                    result = json.load(f)
+
+            record = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), **environment, 'params': params, **result}
+            with open(results_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+            print(f"✅ {pipeline} {size}: {result['symbols_per_sec']} ações/s | p95 {result['latency_p95']}s "
+                  f"| pico RSS {result['peak_rss_mb']}MB | falhas {result['failed']}")
+
+    print(f"💾 Resultados acrescentados em {results_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+ESTADO DO PIPELINE POR TICKER E POR ESTÁGIO
+Máquina de estados fetched -> computed -> serialized -> loaded persistida em
+SQLite (WAL), com referência ao conteúdo intermediário de cada estágio
+(pickle em disco, nome derivado do hash). Uma execução retomada pula direto
+para o primeiro estágio incompleto de cada ticker, reaproveitando o dado já
+baixado/calculado em vez de refazer o ticker inteiro
+"""
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from telemetry import TELEMETRY
+
+STAGES = ('fetched', 'computed', 'serialized', 'loaded')
+DEFAULT_STATE_PATH = os.getenv('PIPELINE_STATE_PATH', 'pipeline_state.db')
+DEFAULT_CACHE_DIR = os.getenv('PIPELINE_CACHE_DIR', 'pipeline_cache')
+
+
+class PipelineState:
+    """Último estágio concluído por ticker + conteúdo intermediário referenciado"""
+
+    def __init__(self, pipeline: str, path: str = DEFAULT_STATE_PATH, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.pipeline = pipeline
+        self.path = path
+        self.cache_dir = os.path.join(cache_dir, pipeline)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pipeline_stages (
+                pipeline TEXT NOT NULL,
+                ticker TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                content_ref TEXT,
+                content_hash TEXT,
+                updated_at REAL,
+                PRIMARY KEY (pipeline, ticker, stage)
+            )
+        """)
+        self._conn.commit()
+
+        # {ticker: {estágio: content_ref}} carregado uma vez
+        self._stages: Dict[str, Dict[str, Optional[str]]] = {}
+        for ticker, stage, ref in self._conn.execute(
+                "SELECT ticker, stage, content_ref FROM pipeline_stages WHERE pipeline = ?", (pipeline,)):
+            self._stages.setdefault(ticker, {})[stage] = ref
+
+    def stage(self, ticker: str) -> Optional[str]:
+        """Último estágio concluído (None se o ticker nunca começou)"""
+        done = self._stages.get(ticker, {})
+        completed = [stage for stage in STAGES if stage in done]
+        return completed[-1] if completed else None
+
+    def next_stage(self, ticker: str) -> Optional[str]:
+        """Primeiro estágio pendente (None se já carregado)"""
+        current = self.stage(ticker)
+        index = STAGES.index(current) + 1 if current else 0
+        return STAGES[index] if index < len(STAGES) else None
+
+    def reached(self, ticker: str, stage: str) -> bool:
+        current = self.stage(ticker)
+        return current is not None and STAGES.index(current) >= STAGES.index(stage)
+
+    def _write_content(self, ticker: str, stage: str, data: Any):
+        payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        content_hash = hashlib.blake2b(payload, digest_size=16).hexdigest()
+        ref = os.path.join(self.cache_dir, ticker, f"{stage}-{content_hash}.pkl")
+        os.makedirs(os.path.dirname(ref), exist_ok=True)
+        tmp = f"{ref}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp, ref)  # o registro só aponta para arquivos completos
+        return ref, content_hash
+
+    def complete(self, ticker: str, stage: str, data: Any = None):
+        """Marcar um estágio como concluído, guardando o conteúdo para a retomada"""
+        ref = content_hash = None
+        if data is not None:
+            ref, content_hash = self._write_content(ticker, stage, data)
+        self.complete_many([ticker], stage, refs={ticker: (ref, content_hash)})
+
+    def complete_many(self, tickers: Iterable[str], stage: str, refs: Optional[Dict[str, tuple]] = None):
+        """Marcar vários tickers em uma transação (estágios de lote, como o load)"""
+        refs = refs or {}
+        now = time.time()
+        rows = [(self.pipeline, ticker, stage, *refs.get(ticker, (None, None)), now) for ticker in tickers]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("""
+                    INSERT OR REPLACE INTO pipeline_stages
+                    (pipeline, ticker, stage, content_ref, content_hash, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, rows)
+            for _, ticker, _, ref, _, _ in rows:
+                self._stages.setdefault(ticker, {})[stage] = ref
+        if stage == STAGES[-1]:
+            for ticker in {row[1] for row in rows}:
+                self.release(ticker)
+
+    def load(self, ticker: str, stage: str) -> Any:
+        """Conteúdo gravado em um estágio (None se não houver ou se o arquivo sumiu)"""
+        ref = self._stages.get(ticker, {}).get(stage)
+        if not ref or not os.path.exists(ref):
+            return None
+        with open(ref, 'rb') as f:
+            return pickle.load(f)
+
+    def release(self, ticker: str):
+        """Apagar os intermediários de um ticker já carregado (o estado é mantido)"""
+        for stage, ref in self._stages.get(ticker, {}).items():
+            if ref and os.path.exists(ref):
+                os.remove(ref)
+
+    def resume(self, ticker: str, steps: Dict[str, Callable[[Any], Any]]) -> Any:
+        """
+        Executar os estágios pendentes de um ticker. `steps[estágio](entrada)`
+        recebe a saída do estágio anterior (ou o conteúdo em cache, na
+        retomada) e devolve a sua; retorno None interrompe o ticker
+        """
+        data = None
+        current = self.stage(ticker)
+        if current is not None:
+            data = self.load(ticker, current)
+            if data is None and current != STAGES[-1]:
+                current = None  # intermediário perdido: recomeçar do início
+
+        start = STAGES.index(current) + 1 if current else 0
+        # Estágio reaproveitado = chamada ao provedor evitada
+        TELEMETRY.count('cache.lookups', cache='pipeline_state', result='hit' if start else 'miss')
+        for stage in STAGES[start:]:
+            if stage not in steps:
+                break
+            data = steps[stage](data)
+            if data is None:
+                return None
+            self.complete(ticker, stage, data)
+        return data
+
+    def pending(self, tickers: Iterable[str], until: str = STAGES[-1]) -> List[str]:
+        """Tickers que ainda não chegaram ao estágio `until`"""
+        return [ticker for ticker in tickers if not self.reached(ticker, until)]
+
+    def reset(self, ticker: Optional[str] = None):
+        """Esquecer o estado (de um ticker ou do pipeline inteiro)"""
+        tickers = [ticker] if ticker else list(self._stages)
+        for t in tickers:
+            self.release(t)
+        with self._lock:
+            with self._conn:
+                if ticker:
+                    self._conn.execute("DELETE FROM pipeline_stages WHERE pipeline = ? AND ticker = ?",
+                                       (self.pipeline, ticker))
+                else:
+                    self._conn.execute("DELETE FROM pipeline_stages WHERE pipeline = ?", (self.pipeline,))
+            for t in tickers:
+                self._stages.pop(t, None)
+
+    def summary(self) -> Dict[str, int]:
+        """Quantidade de tickers por último estágio concluído"""
+        counts = {stage: 0 for stage in STAGES}
+        for ticker in self._stages:
+            stage = self.stage(ticker)
+            if stage:
+                counts[stage] += 1
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+EXECUTOR DE LOTES COM POOL DE CONEXÕES
+Executa lotes independentes em paralelo, cada um em uma conexão própria do
+pool (psycopg2), com paralelismo limitado, retry/rollback por lote e
+latência reportada por lote
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+class PooledBatchExecutor:
+    """Pool de conexões + execução concorrente de lotes"""
+
+    def __init__(self, dsn: Optional[str] = None, max_connections: int = 4,
+                 retry_attempts: int = 3, retry_backoff: float = 0.5):
+        from psycopg2.pool import ThreadedConnectionPool
+
+        dsn = dsn or os.getenv('DATABASE_URL') or os.getenv('SUPABASE_DB_URL')
+        if not dsn:
+            raise RuntimeError("DATABASE_URL não configurada")
+
+        self.max_connections = max_connections
+        self.retry_attempts = retry_attempts
+        self.retry_backoff = retry_backoff
+        self.pool = ThreadedConnectionPool(1, max_connections, dsn)
+
+    @contextmanager
+    def connection(self):
+        """Emprestar uma conexão do pool (devolvida mesmo em caso de erro)"""
+        conn = self.pool.getconn()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            broken = bool(conn.closed)
+            raise
+        finally:
+            self.pool.putconn(conn, close=broken)
+
+    def run_batch(self, batch_num: int, batch: Any, work: Callable[[Any, Any], Any]) -> Dict[str, Any]:
+        """Executar um lote com retry; cada tentativa faz rollback se falhar"""
+        started = time.time()
+        last_error = None
+
+        for attempt in range(1, self.retry_attempts + 1):
+            try:
+                with self.connection() as conn:
+                    try:
+                        result = work(conn, batch)
+                        conn.commit()
+                    except Exception:
+                        if not conn.closed:
+                            conn.rollback()
+                        raise
+                return {
+                    'batch': batch_num,
+                    'status': 'success',
+                    'attempts': attempt,
+                    'latency': time.time() - started,
+                    'result': result
+                }
+            except Exception as e:
+                last_error = e
+                logging.warning(f"⚠️ Lote {batch_num} falhou (tentativa {attempt}/{self.retry_attempts}): {e}")
+                if attempt < self.retry_attempts:
+                    time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+
+        return {
+            'batch': batch_num,
+            'status': 'failed',
+            'attempts': self.retry_attempts,
+            'latency': time.time() - started,
+            'error': str(last_error)
+        }
+
+    def run(self, batches: Sequence[Any], work: Callable[[Any, Any], Any],
+            max_workers: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Executar `work(conn, batch)` para cada lote, no máximo `max_workers`
+        em paralelo (padrão: tamanho do pool). O commit é feito pelo executor.
+        """
+        workers = min(max_workers or self.max_connections, self.max_connections, max(len(batches), 1))
+        started = time.time()
+        results: List[Dict[str, Any]] = []
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self.run_batch, num, batch, work) for num, batch in enumerate(batches, 1)]
+            for future in as_completed(futures):
+                outcome = future.result()
+                results.append(outcome)
+                status = "✅" if outcome['status'] == 'success' else "❌"
+                logging.info(f"{status} Lote {outcome['batch']}/{len(batches)} em {outcome['latency']:.2f}s")
+
+        results.sort(key=lambda r: r['batch'])
+        latencies = sorted(r['latency'] for r in results)
+        wall_time = time.time() - started
+
+        return {
+            'batches': len(batches),
+            'successful': sum(1 for r in results if r['status'] == 'success'),
+            'failed': sum(1 for r in results if r['status'] == 'failed'),
+            'workers': workers,
+            'wall_time': wall_time,
+            'batch_latency_sum': sum(latencies),
+            'latency_max': latencies[-1] if latencies else 0.0,
+            'latency_p50': latencies[len(latencies) // 2] if latencies else 0.0,
+            'results': results
+        }
+
+    def close(self):
+        self.pool.closeall()
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+MODO DE PROFILING DOS PIPELINES (--profile)
+Dois modos, ambos atribuindo o custo ao estágio (spans de telemetry.py) e
+ao ticker em processamento:
+- sample: thread amostradora lê a pilha das threads a cada poucos ms
+  (sobrecarga baixa, cobre threads de I/O e pools; threads fora de escopo
+  ou paradas em espera são descartadas); gera stacks
+  colapsadas (formato flamegraph.pl / speedscope) e ranking top-N
+- cprofile: determinístico, um cProfile por escopo mais externo de cada
+  thread, somado em um .prof por processo e ranking top-N
+Cada processo grava em `<diretório>/<pid>-*`; `python scripts/profiling.py
+merge <diretório>` soma as saídas de vários processos
+"""
+
+import argparse
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from telemetry import TELEMETRY
+
+PROFILE_MODES = ('sample', 'cprofile')
+DEFAULT_PROFILE_DIR = 'profiles'
+NO_STAGE = '-'
+# Folhas de pilha de threads paradas (pool ocioso, espera por futures/locks): não são custo do pipeline
+IDLE_FRAMES = {
+    ('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'),
+    ('thread.py', '_worker'), ('queue.py', 'get'), ('selectors.py', 'select'),
+    ('_base.py', 'result'), ('_base.py', 'wait'), ('_base.py', 'as_completed'),
+}
+
+
+def add_profile_argument(parser: argparse.ArgumentParser):
+    """Opção `--profile [sample|cprofile]` + `--profile-dir`, igual em todos os entry points"""
+    parser.add_argument('--profile', nargs='?', const='sample', choices=PROFILE_MODES,
+                        help='Gerar profile por estágio/ticker (padrão: sample)')
+    parser.add_argument('--profile-dir', default=DEFAULT_PROFILE_DIR,
+                        help='Diretório das saídas de profiling')
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(code) -> bool:
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+class PipelineProfiler:
+    """Profiler por escopo (estágio/ticker) registrado como hook dos spans"""
+
+    def __init__(self, mode: str = 'sample', output_dir: str = DEFAULT_PROFILE_DIR,
+                 interval: float = 0.005, top_n: int = 30):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Modo de profiling inválido: {mode}")
+        self.mode = mode
+        self.output_dir = output_dir
+        self.interval = interval
+        self.top_n = top_n
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Escopo atual de cada thread (lido pela thread amostradora)
+        self._scopes: Dict[int, Tuple[str, str]] = {}
+        self.samples: Counter = Counter()  # (estágio, ticker, pilha) -> amostras
+        self.idle_samples = 0  # threads fora de escopo ou paradas em espera, descartadas
+        self.stats: Optional[pstats.Stats] = None
+        self.scope_seconds: Counter = Counter()
+        self.skipped_scopes = 0
+        self._sampler: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.started = None
+
+    # Estado por thread -------------------------------------------------
+
+    def _state(self):
+        state = self._local.__dict__
+        if 'stages' not in state:
+            state.update(stages=[], ticker=NO_STAGE, profile=None, depth=0)
+        return state
+
+    def _publish(self, state):
+        stage = state['stages'][-1] if state['stages'] else NO_STAGE
+        self._scopes[threading.get_ident()] = (stage, state['ticker'])
+
+    def _start_scope(self, state):
+        """cprofile: o escopo mais externo da thread liga um profiler próprio"""
+        state['depth'] += 1
+        if self.mode != 'cprofile' or state['depth'] > 1:
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+: apenas um profiler determinístico ativo por processo
+            self.skipped_scopes += 1
+            return
+        state['profile'] = profile
+        state['scope_started'] = time.perf_counter()
+
+    def _end_scope(self, state, key: str):
+        state['depth'] -= 1
+        if state['depth'] > 0 or state['profile'] is None:
+            return
+        profile, state['profile'] = state['profile'], None
+        profile.disable()
+        elapsed = time.perf_counter() - state['scope_started']
+        with self._lock:
+            self.scope_seconds[key] += elapsed
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+    # Hooks de telemetry.Telemetry --------------------------------------
+
+    def enter(self, name: str, labels: Dict):
+        state = self._state()
+        state['stages'].append(name)
+        self._publish(state)
+        self._start_scope(state)
+
+    def exit(self, name: str):
+        state = self._state()
+        self._end_scope(state, f"stage:{name}" if state['ticker'] == NO_STAGE else f"ticker:{state['ticker']}")
+        if state['stages']:
+            state['stages'].pop()
+        self._publish(state)
+
+    @contextmanager
+    def ticker_scope(self, ticker: str):
+        state = self._state()
+        previous, state['ticker'] = state['ticker'], ticker
+        self._publish(state)
+        self._start_scope(state)
+        try:
+            yield
+        finally:
+            self._end_scope(state, f"ticker:{ticker}")
+            state['ticker'] = previous
+            self._publish(state)
+
+    # Amostragem ----------------------------------------------------------
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    # Só threads dentro de um estágio/ticker e que não estejam paradas em espera
+                    stage, ticker = self._scopes.get(ident, (NO_STAGE, NO_STAGE))
+                    if (stage, ticker) == (NO_STAGE, NO_STAGE) or _is_idle(frame.f_code):
+                        self.idle_samples += 1
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_label(frame.f_code))
+                        frame = frame.f_back
+                    self.samples[(stage, ticker, ';'.join(reversed(stack)))] += 1
+
+    # Ciclo de vida -------------------------------------------------------
+
+    def start(self) -> 'PipelineProfiler':
+        self.started = time.time()
+        TELEMETRY.add_scope_hook(self)
+        if self.mode == 'sample':
+            self._sampler = threading.Thread(target=self._sample_loop, name='profiler-sampler', daemon=True)
+            self._sampler.start()
+        logging.info(f"🔬 Profiling ativo ({self.mode}) -> {self.output_dir}")
+        return self
+
+    def stop(self) -> Dict[str, str]:
+        TELEMETRY.remove_scope_hook(self)
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+        return self.write()
+
+    # Saídas ---------------------------------------------------------------
+
+    def collapsed_lines(self) -> List[str]:
+        """Formato `estágio;ticker;frame;...;frame N` (flamegraph.pl, speedscope)"""
+        return [f"{stage};{ticker};{stack} {n}" for (stage, ticker, stack), n in sorted(self.samples.items())]
+
+    def write(self) -> Dict[str, str]:
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"{os.getpid()}")
+        paths = {}
+
+        if self.mode == 'sample':
+            paths['collapsed'] = f"{prefix}.collapsed"
+            with open(paths['collapsed'], 'w', encoding='utf-8') as f:
+                f.write('\n'.join(self.collapsed_lines()) + '\n')
+            report = top_from_collapsed(self.collapsed_lines(), self.top_n, self.interval)
+            report += f"\nAmostras ociosas descartadas (fora de escopo ou em espera): {self.idle_samples}\n"
+        else:
+            if self.stats is not None:
+                paths['pstats'] = f"{prefix}.prof"
+                self.stats.dump_stats(paths['pstats'])
+            report = top_from_pstats(self.stats, self.top_n, self.scope_seconds)
+            if self.skipped_scopes:
+                report += f"\nEscopos sem profile (outro profiler ativo): {self.skipped_scopes}\n"
+
+        paths['top'] = f"{prefix}.top.txt"
+        with open(paths['top'], 'w', encoding='utf-8') as f:
+            f.write(report)
+        logging.info(f"🔬 Profiling gravado: {paths}")
+        return paths
+
+
+def top_from_collapsed(lines: List[str], top_n: int = 30, interval: Optional[float] = None) -> str:
+    """Ranking por tempo próprio (folha) e inclusivo, por estágio e por ticker"""
+    self_samples: Counter = Counter()
+    inclusive: Counter = Counter()
+    by_stage: Counter = Counter()
+    by_ticker: Counter = Counter()
+    total = 0
+
+    for line in lines:
+        if not line.strip():
+            continue
+        path, _, count = line.rpartition(' ')
+        n = int(count)
+        stage, ticker, *frames = path.split(';')
+        total += n
+        by_stage[stage] += n
+        by_ticker[ticker] += n
+        if frames:
+            self_samples[frames[-1]] += n
+            for frame in set(frames):
+                inclusive[frame] += n
+
+    def section(title: str, counter: Counter) -> List[str]:
+        rows = [title]
+        for name, n in counter.most_common(top_n):
+            seconds = f" ~{n * interval:.1f}s" if interval else ""
+            rows.append(f"  {n / total * 100:6.2f}%  {n:>8}{seconds}  {name}")
+        return rows + ['']
+
+    if not total:
+        return "Nenhuma amostra coletada\n"
+    out = [f"Amostras: {total}", '']
+    out += section("TEMPO PRÓPRIO (função no topo da pilha)", self_samples)
+    out += section("TEMPO INCLUSIVO", inclusive)
+    out += section("POR ESTÁGIO", by_stage)
+    out += section("POR TICKER", by_ticker)
+    return '\n'.join(out)
+
+
+def top_from_pstats(stats: Optional[pstats.Stats], top_n: int = 30,
+                    scope_seconds: Optional[Counter] = None) -> str:
+    if stats is None:
+        return "Nenhum escopo perfilado\n"
+    buffer = io.StringIO()
+    stats.stream = buffer
+    stats.sort_stats('tottime').print_stats(top_n)
+    stats.sort_stats('cumulative').print_stats(top_n)
+    if scope_seconds:
+        buffer.write("\nTEMPO POR ESCOPO (s)\n")
+        for key, seconds in scope_seconds.most_common(top_n):
+            buffer.write(f"  {seconds:10.3f}  {key}\n")
+    return buffer.getvalue()
+
+
+# Instância do processo (None = profiling desligado) ---------------------
+
+PROFILER: Optional[PipelineProfiler] = None
+
+
+def start_profiling(mode: Optional[str], output_dir: str = DEFAULT_PROFILE_DIR) -> Optional[PipelineProfiler]:
+    """Ligar o profiling se `mode` foi informado (valor de --profile)"""
+    global PROFILER
+    if not mode:
+        return None
+    PROFILER = PipelineProfiler(mode, output_dir).start()
+    return PROFILER
+
+
+def stop_profiling() -> Optional[Dict[str, str]]:
+    global PROFILER
+    if PROFILER is None:
+        return None
+    profiler, PROFILER = PROFILER, None
+    return profiler.stop()
+
+
+@contextmanager
+def ticker_scope(ticker: str):
+    """Atribuir o trabalho do bloco a um ticker (no-op sem profiling)"""
+    if PROFILER is None:
+        yield
+        return
+    with PROFILER.ticker_scope(ticker):
+        yield
+
+
+def merge(directory: str, top_n: int = 30) -> Dict[str, str]:
+    """Somar as saídas de vários processos/execuções de um diretório"""
+    collapsed: Counter = Counter()
+    stats = None
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith('.collapsed') and not name.startswith('merged'):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    if stack:
+                        collapsed[stack] += int(count)
+        elif name.endswith('.prof') and not name.startswith('merged'):
+            if stats is None:
+                stats = pstats.Stats(path)
+            else:
+                stats.add(path)
+
+    paths = {}
+    if collapsed:
+        lines = [f"{stack} {n}" for stack, n in sorted(collapsed.items())]
+        paths['collapsed'] = os.path.join(directory, 'merged.collapsed')
+        with open(paths['collapsed'], 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        paths['top_sample'] = os.path.join(directory, 'merged.sample.top.txt')
+        with open(paths['top_sample'], 'w', encoding='utf-8') as f:
+            f.write(top_from_collapsed(lines, top_n))
+    if stats is not None:
+        paths['pstats'] = os.path.join(directory, 'merged.prof')
+        stats.dump_stats(paths['pstats'])
+        paths['top_cprofile'] = os.path.join(directory, 'merged.cprofile.top.txt')
+        with open(paths['top_cprofile'], 'w', encoding='utf-8') as f:
+            f.write(top_from_pstats(stats, top_n))
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ferramentas de profiling dos pipelines')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    merge_parser = subparsers.add_parser('merge', help='Somar profiles de vários processos')
+    merge_parser.add_argument('directory', nargs='?', default=DEFAULT_PROFILE_DIR)
+    merge_parser.add_argument('--top', type=int, default=30)
+    args = parser.parse_args()
+
+    if args.command == 'merge':
+        print(json.dumps(merge(args.directory, args.top), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+TAXONOMIA DE ERROS DO PROVEDOR + FILA DE RETRY ADIADO
+Falhas do provedor de mercado (yfinance) são classificadas em limite de
+requisições, ativo inexistente/deslistado, rede transitória e erro de
+parse. Um símbolo só é tratado como deslistado depois de falhar como
+inexistente em várias execuções (o yfinance responde vazio/"no timezone
+found" também sob limite de requisições), e o registro expira para uma
+nova verificação; falhas transitórias vão para uma fila com vencimento
+(backoff exponencial por classe) e apenas a sub-requisição que falhou
+(history, info, dividends) é refeita, sem bloquear o processamento dos
+demais tickers
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from telemetry import count
+
+RATE_LIMIT = 'rate_limit'
+NOT_FOUND = 'not_found'
+TRANSIENT = 'transient'
+PARSE = 'parse'
+ERROR_KINDS = (RATE_LIMIT, NOT_FOUND, TRANSIENT, PARSE)
+
+# (atraso base em s, tentativas extras), contadas por classe. NOT_FOUND tem uma reconsulta na execução;
+# o registro de deslistados só confirma após DELISTED_CONFIRMATIONS execuções
+RETRY_POLICIES: Dict[str, Tuple[float, int]] = {
+    RATE_LIMIT: (30.0, 5),
+    TRANSIENT: (2.0, 4),
+    PARSE: (10.0, 1),
+    NOT_FOUND: (60.0, 1),
+}
+MAX_DELAY = 600.0
+DEFAULT_DELISTED_PATH = os.getenv('DELISTED_SYMBOLS_PATH', 'delisted_symbols.json')
+DELISTED_CONFIRMATIONS = int(os.getenv('DELISTED_CONFIRMATIONS', '3'))
+DELISTED_TTL_DAYS = float(os.getenv('DELISTED_TTL_DAYS', '30'))
+
+_RATE_LIMIT_HINTS = ('too many requests', 'rate limit', 'rate-limit', '429')
+# Também produzidos pelo yfinance sob limite de requisições: não são prova de símbolo inexistente
+_AMBIGUOUS_HINTS = ('no timezone found', '404')
+_NOT_FOUND_HINTS = ('delisted', 'no data found', 'not found', 'no price data',
+                    'quote not found', 'symbol may be')
+
+
+class EmptyResponse(Exception):
+    """Provedor respondeu sem dados (deslistado ou limite de requisições: o yfinance não distingue)"""
+
+
+def classify(error: BaseException) -> str:
+    """Classe da falha a partir do tipo e da mensagem da exceção"""
+    if isinstance(error, EmptyResponse):
+        return TRANSIENT
+    message = str(error).lower()
+    if any(hint in message for hint in _RATE_LIMIT_HINTS):
+        return RATE_LIMIT
+    if any(hint in message for hint in _AMBIGUOUS_HINTS):
+        return TRANSIENT
+    if any(hint in message for hint in _NOT_FOUND_HINTS):
+        return NOT_FOUND
+    if isinstance(error, (ConnectionError, TimeoutError, socket.timeout, OSError)):
+        return TRANSIENT
+    # requests/urllib3 sem importar as bibliotecas
+    if any(base.__name__ in ('RequestException', 'HTTPError', 'ProtocolError')
+           for base in type(error).__mro__):
+        return TRANSIENT
+    if isinstance(error, (ValueError, KeyError, IndexError, TypeError)):
+        return PARSE
+    return TRANSIENT  # desconhecido: tratado como transitório (com limite de tentativas)
+
+
+class DelistedRegistry:
+    """
+    Símbolos que falharam como inexistentes (JSON, gravação atômica). Cada
+    execução soma no máximo uma falha por símbolo; o símbolo só é pulado com
+    `confirmations` execuções e volta a ser consultado após `ttl_days`
+    """
+
+    def __init__(self, path: str = DEFAULT_DELISTED_PATH, confirmations: int = DELISTED_CONFIRMATIONS,
+                 ttl_days: float = DELISTED_TTL_DAYS):
+        self.path = path
+        self.confirmations = confirmations
+        self.ttl = ttl_days * 86400
+        self._lock = threading.Lock()
+        self._marked: Set[str] = set()  # símbolos que já somaram falha nesta execução
+        self.symbols: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.symbols = json.load(f)
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        marked_at = datetime.fromisoformat(entry['marked_at'])
+        return (datetime.now() - marked_at).total_seconds() > self.ttl
+
+    def _confirmed(self, entry: Dict[str, Any]) -> bool:
+        return entry.get('runs', 1) >= self.confirmations and not self._expired(entry)
+
+    def __contains__(self, symbol: str) -> bool:
+        entry = self.symbols.get(symbol)
+        return entry is not None and self._confirmed(entry)
+
+    def confirmed(self) -> List[str]:
+        return [symbol for symbol, entry in self.symbols.items() if self._confirmed(entry)]
+
+    def _save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.symbols, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def mark(self, symbol: str, reason: str) -> bool:
+        """Somar a falha desta execução; True quando o símbolo passa a ser pulado"""
+        with self._lock:
+            entry = self.symbols.get(symbol)
+            if symbol not in self._marked:
+                self._marked.add(symbol)
+                # Evidência antiga (além do TTL) não se acumula com a nova
+                runs = entry.get('runs', 1) + 1 if entry is not None and not self._expired(entry) else 1
+                entry = self.symbols[symbol] = {'reason': reason[:200], 'runs': runs,
+                                                'marked_at': datetime.now().isoformat()}
+                self._save()
+            return self._confirmed(entry)
+
+    def remove(self, symbol: str):
+        """Reativar um símbolo (respondeu com dados, ou ticker reaproveitado por outra empresa)"""
+        with self._lock:
+            if self.symbols.pop(symbol, None) is not None:
+                self._save()
+
+
+@dataclass(order=True)
+class RetryItem:
+    due: float
+    seq: int
+    key: str = field(compare=False)
+    request: str = field(compare=False)
+    kind: str = field(compare=False)
+    attempt: int = field(compare=False)
+    payload: Any = field(default=None, compare=False)
+
+
+@dataclass
+class ProviderFailure:
+    """Resultado do tratamento: `retry` (na fila), `delisted` (permanente) ou `failed` (esgotado)"""
+    kind: str
+    disposition: str
+    attempt: int
+    error: str
+
+
+class RetryQueue:
+    """Fila de retries por vencimento (heap), com tentativas contadas por (ticker, sub-requisição, classe)"""
+
+    def __init__(self, policies: Optional[Dict[str, Tuple[float, int]]] = None, jitter: float = 0.2):
+        self.policies = policies or RETRY_POLICIES
+        self.jitter = jitter
+        self._heap: List[RetryItem] = []
+        # Por classe: uma falha transitória não consome a reconsulta de um not_found
+        self._attempts: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, key: str, request: str, kind: str, payload: Any = None) -> Optional[RetryItem]:
+        """Agendar nova tentativa; None quando a política da classe já se esgotou"""
+        base, max_retries = self.policies.get(kind, (0.0, 0))
+        with self._lock:
+            attempts = self._attempts.setdefault((key, request), {})
+            attempt = attempts.get(kind, 0) + 1
+            if attempt > max_retries:
+                return None
+            attempts[kind] = attempt
+            delay = min(base * 2 ** (attempt - 1), MAX_DELAY) * random.uniform(1 - self.jitter, 1 + self.jitter)
+            item = RetryItem(time.time() + delay, next(self._seq), key, request, kind, attempt, payload)
+            heapq.heappush(self._heap, item)
+        return item
+
+    def attempts(self, key: str, request: str, kind: Optional[str] = None) -> int:
+        """Tentativas de uma classe (ou de todas as classes, sem `kind`)"""
+        attempts = self._attempts.get((key, request), {})
+        return attempts.get(kind, 0) if kind else sum(attempts.values())
+
+    def forget(self, key: str, request: str):
+        """Sub-requisição concluída: zerar a contagem de tentativas"""
+        with self._lock:
+            self._attempts.pop((key, request), None)
+
+    def take_due(self, block: bool = False) -> List[RetryItem]:
+        """Itens vencidos; com `block`, aguarda o próximo vencimento se nenhum venceu ainda"""
+        with self._lock:
+            if block and self._heap:
+                wait = self._heap[0].due - time.time()
+            else:
+                wait = 0
+        if wait > 0:
+            logging.info(f"⏳ Aguardando {wait:.1f}s pelo próximo retry ({len(self._heap)} na fila)")
+            time.sleep(wait)
+
+        now = time.time()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0].due <= now:
+                due.append(heapq.heappop(self._heap))
+        return due
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending: Dict[str, int] = {}
+            for item in self._heap:
+                pending[item.kind] = pending.get(item.kind, 0) + 1
+            return {'pending': pending, 'next_due_in': max(self._heap[0].due - time.time(), 0) if self._heap else None}
+
+
+class ProviderErrorPolicy:
+    """Classificação + registro de deslistados + fila de retry, compartilhados por um pipeline"""
+
+    def __init__(self, delisted: Optional[DelistedRegistry] = None, retries: Optional[RetryQueue] = None):
+        self.delisted = delisted if delisted is not None else DelistedRegistry()
+        self.retries = retries if retries is not None else RetryQueue()  # fila vazia é falsa (__len__)
+        self.counts: Dict[str, int] = {kind: 0 for kind in ERROR_KINDS}
+
+    def handle(self, key: str, request: str, error: BaseException, payload: Any = None) -> ProviderFailure:
+        """Classificar a falha de uma sub-requisição e decidir entre retry adiado, deslistado ou desistência"""
+        kind = classify(error)
+        self.counts[kind] += 1
+        count('provider.errors', kind=kind, request=request)
+
+        item = self.retries.schedule(key, request, kind, payload)
+        if item is not None:
+            logging.warning(f"🔁 {key}/{request}: {kind} ({error}); nova tentativa {item.attempt} "
+                            f"em {item.due - time.time():.0f}s")
+            return ProviderFailure(kind, 'retry', item.attempt, str(error))
+
+        attempt = self.retries.attempts(key, request, kind)
+        self.retries.forget(key, request)
+        if kind == NOT_FOUND and self.delisted.mark(key, str(error)):
+            logging.warning(f"🚫 {key}: deslistado/inexistente confirmado em "
+                            f"{self.delisted.confirmations} execuções, não será consultado até o registro expirar")
+            return ProviderFailure(kind, 'delisted', attempt, str(error))
+
+        logging.error(f"❌ {key}/{request}: {kind} após {attempt} retries ({error})")
+        return ProviderFailure(kind, 'failed', attempt, str(error))
+
+    def succeeded(self, key: str, request: str):
+        self.retries.forget(key, request)
+        if request == 'history' and key in self.delisted.symbols:
+            self.delisted.remove(key)  # respondeu com dados: falhas anteriores não contam mais
+
+    def stats(self) -> Dict[str, Any]:
+        return {'errors': dict(self.counts), 'delisted': len(self.delisted.confirmed()),
+                'delisted_suspects': len(self.delisted.symbols), **self.retries.stats()}
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+RELATÓRIO DE PERFORMANCE POR EXECUÇÃO + DIFF ENTRE EXECUÇÕES
+Cada execução de pipeline grava um JSON legível por máquina com: tempo de
+parede por estágio (spans da telemetria), ações/s ao longo do tempo (eventos
+de item), chamadas ao provedor vs acertos de cache, linhas gravadas vs
+puladas no banco, pico de memória e os 20 tickers mais lentos com o tempo de
+cada estágio. O comando `diff` compara duas execuções e sai com código 1
+quando alguma métrica piorou além do limite (uso em cron/CI de produção)
+
+    python scripts/run_report.py diff perf_reports/a.json perf_reports/b.json
+    python scripts/run_report.py diff --pipeline massive_historical
+"""
+
+import argparse
+import glob
+import json
+import logging
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import profiling
+from memory_governor import current_rss, peak_rss
+from telemetry import TELEMETRY, LatencyHistogram, Telemetry
+
+DEFAULT_REPORT_DIR = os.getenv('PERF_REPORT_DIR', 'perf_reports')
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROVIDER_SPAN_PREFIX = 'fetch.'
+# Contadores da telemetria lidos pelo relatório (diferença entre o início e o fim da execução)
+REPORT_COUNTERS = ('cache.lookups', 'db.rows', 'provider.errors')
+
+
+def _mb(value: float) -> float:
+    return round(value / (1024 * 1024), 1)
+
+
+def git_revision() -> Optional[str]:
+    """Commit curto do repositório dos scripts (None fora de um checkout git)"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPTS_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class RunReport:
+    """
+    Coleta de uma execução: listener dos spans da telemetria e dos eventos de
+    item do EventPublisher. O tempo de cada ticker vem de `ticker_scope`; os
+    spans abertos dentro dele entram na quebra por estágio do ticker
+    """
+
+    def __init__(self, pipeline: str, events=None, output_dir: str = DEFAULT_REPORT_DIR,
+                 slowest_n: int = 20, timeline_points: int = 60, telemetry: Telemetry = TELEMETRY):
+        self.pipeline = pipeline
+        self.events = events
+        self.run_id = events.run_id if events is not None else uuid.uuid4().hex[:12]
+        self.output_dir = output_dir
+        self.slowest_n = slowest_n
+        self.timeline_points = timeline_points
+        self.telemetry = telemetry
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stages: Dict[str, LatencyHistogram] = {}
+        self.ticker_seconds: Counter = Counter()
+        self.ticker_stages: Dict[str, Counter] = defaultdict(Counter)
+        self.items: List[Tuple[float, str]] = []  # (ts, status)
+        self.started = None
+        self.started_perf = None
+        self._counter_baseline: Dict[str, List[Tuple[Dict[str, str], float]]] = {}
+
+    def start(self) -> 'RunReport':
+        global ACTIVE
+        self.started = time.time()
+        self.started_perf = time.perf_counter()
+        self._counter_baseline = {name: self.telemetry.counter_values(name) for name in REPORT_COUNTERS}
+        self.telemetry.add_listener(self.span_listener)
+        if self.events is not None:
+            self.events.add_listener(self.on_event)
+        ACTIVE = self
+        return self
+
+    # Coleta ---------------------------------------------------------------
+
+    def span_listener(self, name: str, seconds: float, labels: Dict[str, Any]):
+        ticker = getattr(self._local, 'ticker', None)
+        with self._lock:
+            histogram = self.stages.get(name)
+            if histogram is None:
+                histogram = self.stages[name] = LatencyHistogram()
+            histogram.observe(seconds)
+            if ticker is not None:
+                self.ticker_stages[ticker][name] += seconds
+
+    def on_event(self, record: Dict[str, Any]):
+        """Listener do EventPublisher: itens concluídos alimentam a série de vazão"""
+        if record.get('event') == 'item':
+            self.item(record.get('status', 'success'), record.get('ts'))
+
+    def item(self, status: str, ts: Optional[float] = None):
+        """Item concluído (para pipelines sem EventPublisher)"""
+        with self._lock:
+            self.items.append((ts or time.time(), status))
+
+    @contextmanager
+    def ticker(self, ticker: str):
+        previous = getattr(self._local, 'ticker', None)
+        self._local.ticker = ticker
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._local.ticker = previous
+            with self._lock:
+                self.ticker_seconds[ticker] += elapsed  # retries somam ao mesmo ticker
+
+    # Montagem ---------------------------------------------------------------
+
+    def _counter_delta(self, name: str) -> List[Tuple[Dict[str, str], float]]:
+        baseline = {tuple(sorted(labels.items())): value for labels, value in self._counter_baseline.get(name, [])}
+        delta = []
+        for labels, value in self.telemetry.counter_values(name):
+            value -= baseline.get(tuple(sorted(labels.items())), 0)
+            if value:
+                delta.append((labels, value))
+        return delta
+
+    def _stages(self, wall: float) -> Dict[str, Any]:
+        stages = {}
+        for name, histogram in sorted(self.stages.items()):
+            data = histogram.to_dict()
+            stages[name] = {
+                'count': data['count'],
+                'total_seconds': round(data['sum'], 4),
+                'mean': round(data['mean'], 4),
+                'p50': round(data['p50'], 4),
+                'p95': round(data['p95'], 4),
+                'p99': round(data['p99'], 4),
+                'max': round(data['max'], 4),
+                # Fração do tempo de parede (soma pode passar de 1 com spans aninhados/threads)
+                'wall_share': round(data['sum'] / wall, 4) if wall else 0.0
+            }
+        return stages
+
+    def _timeline(self, finished: float) -> Dict[str, Any]:
+        """Ações/s por janela; a largura da janela limita a série a ~`timeline_points` pontos"""
+        duration = max(finished - self.started, 1e-9)
+        window = max(1, math.ceil(duration / self.timeline_points))
+        buckets: Dict[int, Counter] = defaultdict(Counter)
+        for ts, status in self.items:
+            buckets[int(max(ts - self.started, 0) // window)][status] += 1
+
+        series = []
+        completed = 0
+        for index in range(int(duration // window) + 1):
+            counts = buckets.get(index, Counter())
+            done = sum(counts.values())
+            completed += done
+            series.append({
+                't': index * window,
+                'completed': done,
+                'failed': counts.get('failed', 0),
+                'symbols_per_sec': round(done / window, 3),
+                'cumulative': completed
+            })
+        return {'window_seconds': window, 'series': series}
+
+    def _provider(self, processed: int) -> Dict[str, Any]:
+        calls = {name[len(PROVIDER_SPAN_PREFIX):]: histogram.count
+                 for name, histogram in self.stages.items() if name.startswith(PROVIDER_SPAN_PREFIX)}
+        total = sum(calls.values())
+        errors: Counter = Counter()
+        for labels, value in self._counter_delta('provider.errors'):
+            errors[labels.get('kind', 'unknown')] += value
+        return {
+            'calls': total,
+            'by_request': calls,
+            'calls_per_symbol': round(total / processed, 3) if processed else None,
+            'errors': dict(errors)
+        }
+
+    def _cache(self) -> Dict[str, Any]:
+        by_cache: Dict[str, Counter] = defaultdict(Counter)
+        for labels, value in self._counter_delta('cache.lookups'):
+            by_cache[labels.get('cache', 'unknown')][labels.get('result', 'hit')] += value
+        hits = sum(counts['hit'] for counts in by_cache.values())
+        misses = sum(counts['miss'] for counts in by_cache.values())
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+            'by_cache': {name: dict(counts) for name, counts in sorted(by_cache.items())}
+        }
+
+    def _db_rows(self) -> Dict[str, Any]:
+        by_table: Dict[str, Counter] = defaultdict(Counter)
+        for labels, value in self._counter_delta('db.rows'):
+            by_table[labels.get('table', 'unknown')][labels.get('outcome', 'written')] += value
+        return {
+            'written': sum(counts['written'] for counts in by_table.values()),
+            'skipped': sum(counts['skipped'] for counts in by_table.values()),
+            'by_table': {table: dict(counts) for table, counts in sorted(by_table.items())}
+        }
+
+    def build(self) -> Dict[str, Any]:
+        finished = time.time()
+        wall = time.perf_counter() - self.started_perf
+        with self._lock:
+            statuses = Counter(status for _, status in self.items)
+            processed = sum(statuses.values())
+            slowest = [
+                {'ticker': ticker, 'seconds': round(seconds, 4),
+                 'stages': {name: round(value, 4) for name, value in self.ticker_stages[ticker].most_common()}}
+                for ticker, seconds in self.ticker_seconds.most_common(self.slowest_n)
+            ]
+            report = {
+                'pipeline': self.pipeline,
+                'run_id': self.run_id,
+                'started_at': datetime.fromtimestamp(self.started).isoformat(),
+                'finished_at': datetime.fromtimestamp(finished).isoformat(),
+                'wall_seconds': round(wall, 3),
+                'environment': {'git': git_revision(), 'python': platform.python_version(),
+                                'host': socket.gethostname(), 'cpus': os.cpu_count()},
+                'items': {
+                    'processed': processed,
+                    'success': statuses.get('success', 0),
+                    'failed': statuses.get('failed', 0),
+                    'symbols_per_sec': round(processed / wall, 3) if wall else None
+                },
+                'stages': self._stages(wall),
+                'throughput': self._timeline(finished),
+                'provider': self._provider(processed),
+                'cache': self._cache(),
+                'db_rows': self._db_rows(),
+                'memory': {'peak_rss_mb': _mb(peak_rss()), 'rss_end_mb': _mb(current_rss())},
+                'slowest_tickers': slowest
+            }
+        return report
+
+    def finish(self, **extra) -> str:
+        """Montar e gravar `<dir>/<pipeline>_<data>_<run_id>.json`; devolve o caminho"""
+        global ACTIVE
+        if ACTIVE is self:
+            ACTIVE = None
+        self.telemetry.remove_listener(self.span_listener)
+        if self.events is not None:
+            self.events.remove_listener(self.on_event)
+
+        report = {**self.build(), **extra}
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = datetime.fromtimestamp(self.started).strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(self.output_dir, f"{self.pipeline}_{stamp}_{self.run_id}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, default=str)
+
+        logging.info(f"📐 Performance: {report['items']['symbols_per_sec']} ações/s, "
+                     f"{report['provider']['calls']} chamadas ao provedor, cache {report['cache']['hit_rate']}, "
+                     f"linhas {report['db_rows']['written']} gravadas/{report['db_rows']['skipped']} puladas, "
+                     f"pico {report['memory']['peak_rss_mb']}MB -> {path}")
+        return path
+
+
+# Execução ativa do processo (None = sem relatório) ----------------------
+
+ACTIVE: Optional[RunReport] = None
+
+
+@contextmanager
+def ticker_scope(ticker: str):
+    """Atribuir o trabalho do bloco a um ticker (relatório de performance e profiling)"""
+    report = ACTIVE
+    with profiling.ticker_scope(ticker):
+        if report is None:
+            yield
+        else:
+            with report.ticker(ticker):
+                yield
+
+
+# Diff entre execuções ---------------------------------------------------
+
+# (chaves no relatório, maior é pior?)
+DIFF_METRICS = (
+    (('wall_seconds',), True),
+    (('items', 'symbols_per_sec'), False),
+    (('memory', 'peak_rss_mb'), True),
+    (('provider', 'calls_per_symbol'), True),
+    (('cache', 'hit_rate'), False),
+)
+STAGE_FIELDS = ('mean', 'p95')
+
+
+def _lookup(report: Dict[str, Any], *path: str) -> Optional[float]:
+    value: Any = report
+    for part in path:
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value if isinstance(value, (int, float)) else None
+
+
+def diff_reports(base: Dict[str, Any], new: Dict[str, Any], threshold: float = 0.2,
+                 min_seconds: float = 0.005) -> Dict[str, Any]:
+    """
+    Variação relativa de cada métrica; `regression` quando piorou mais que
+    `threshold`. Estágios com média abaixo de `min_seconds` nas duas
+    execuções são ignorados (ruído de medição)
+    """
+    metrics = list(DIFF_METRICS)
+    for name in sorted(set(base.get('stages', {})) | set(new.get('stages', {}))):
+        # Nomes de span têm pontos (fetch.history): chaves em tupla, não caminho com '.'
+        if max(_lookup(base, 'stages', name, 'mean') or 0, _lookup(new, 'stages', name, 'mean') or 0) < min_seconds:
+            continue
+        metrics.extend((('stages', name, field), True) for field in STAGE_FIELDS)
+
+    rows = []
+    for path, higher_is_worse in metrics:
+        before, after = _lookup(base, *path), _lookup(new, *path)
+        change = None
+        if before is not None and after is not None:
+            change = (after - before) / before if before else (0.0 if after == before else math.inf)
+        worse = change is not None and (change > threshold if higher_is_worse else change < -threshold)
+        rows.append({'metric': '.'.join(path), 'base': before, 'new': after,
+                     'change': round(change, 4) if change not in (None, math.inf) else change,
+                     'regression': worse})
+
+    return {
+        'base': {'pipeline': base.get('pipeline'), 'run_id': base.get('run_id'), 'git': base.get('environment', {}).get('git')},
+        'new': {'pipeline': new.get('pipeline'), 'run_id': new.get('run_id'), 'git': new.get('environment', {}).get('git')},
+        'threshold': threshold,
+        'metrics': rows,
+        'regressions': [row['metric'] for row in rows if row['regression']]
+    }
+
+
+def format_diff(result: Dict[str, Any]) -> str:
+    lines = [f"BASE {result['base']['run_id']} ({result['base']['git']}) -> "
+             f"NOVA {result['new']['run_id']} ({result['new']['git']}), limite {result['threshold']:.0%}"]
+    for row in result['metrics']:
+        change = row['change']
+        text = '   n/d' if change is None else ('   novo' if change == math.inf else f"{change:+7.1%}")
+        flag = '❌' if row['regression'] else '  '
+        lines.append(f"{flag} {row['metric']:<40} {str(row['base']):>12} -> {str(row['new']):<12} {text}")
+    lines.append(f"{len(result['regressions'])} regressões" if result['regressions'] else "✅ Sem regressões")
+    return '\n'.join(lines)
+
+
+def latest_reports(pipeline: str, directory: str = DEFAULT_REPORT_DIR, count: int = 2) -> List[str]:
+    """Relatórios mais recentes de um pipeline (o nome começa pela data da execução)"""
+    return sorted(glob.glob(os.path.join(directory, f"{pipeline}_*.json")))[-count:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Relatórios de performance dos pipelines')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    diff_parser = subparsers.add_parser('diff', help='Comparar duas execuções (código 1 se houver regressão)')
+    diff_parser.add_argument('reports', nargs='*', help='BASE NOVA (padrão: as duas últimas de --pipeline)')
+    diff_parser.add_argument('--pipeline', help='Comparar as duas execuções mais recentes do pipeline')
+    diff_parser.add_argument('--dir', default=DEFAULT_REPORT_DIR)
+    diff_parser.add_argument('--threshold', type=float, default=0.2, help='Piora relativa tolerada (0.2 = 20%%)')
+    diff_parser.add_argument('--min-seconds', type=float, default=0.005,
+                             help='Ignorar estágios com média abaixo disso')
+    diff_parser.add_argument('--json', action='store_true', help='Saída em JSON')
+    args = parser.parse_args()
+
+    if args.command == 'diff':
+        paths = args.reports
+        if not paths and args.pipeline:
+            paths = latest_reports(args.pipeline, args.dir)
+        if len(paths) != 2:
+            parser.error('informe dois relatórios ou um --pipeline com ao menos duas execuções')
+        reports = []
+        for path in paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                reports.append(json.load(f))
+
+        result = diff_reports(*reports, threshold=args.threshold, min_seconds=args.min_seconds)
+        print(json.dumps(result, indent=2) if args.json else format_diff(result))
+        sys.exit(1 if result['regressions'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+DIVISÃO E EXECUÇÃO DE ARQUIVOS SQL EM CHUNKS
+Lê o arquivo em streaming (linha a linha, sem carregar tudo na memória),
+separa statements respeitando strings, identificadores, comentários e
+dollar-quoting, agrupa statements consecutivos da mesma tabela em chunks
+com orçamento de bytes/linhas e executa os chunks em paralelo limitado
+(pool de conexões), com progresso por chunk e retomada via checkpoint
+"""
+
+import argparse
+import logging
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from checkpoint_log import CheckpointLog
+from log_setup import configure_logging
+
+# Próximo token relevante fora de strings/comentários
+SPECIAL = re.compile(r"[';\"$]|--|/\*")
+DOLLAR_TAG = re.compile(r"\$[A-Za-z_]\w*\$|\$\$")
+TABLE_PATTERN = re.compile(
+    r'^\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|MERGE\s+INTO|COPY)\s+(?:ONLY\s+)?([\w."]+)',
+    re.IGNORECASE
+)
+VALUES_TOKENS = re.compile(r"'(?:[^']|'')*'|\(|\)|\bVALUES\b", re.IGNORECASE)
+
+
+def iter_statements(path: str) -> Iterator[Tuple[str, int]]:
+    """Statements do arquivo em streaming, com o offset (bytes) do fim de cada um"""
+    state = 'normal'
+    dollar_tag = None
+    pieces: List[str] = []
+    offset = 0
+
+    def emit():
+        statement = ''.join(pieces).strip()
+        pieces.clear()
+        return statement if statement.rstrip(';').strip() else None
+
+    with open(path, 'rb') as f:
+        for raw in f:
+            offset += len(raw)
+            line = raw.decode('utf-8')
+            pos = 0
+
+            while pos < len(line):
+                if state == 'normal':
+                    match = SPECIAL.search(line, pos)
+                    if match is None:
+                        pieces.append(line[pos:])
+                        break
+                    token = match.group()
+                    if token == ';':
+                        pieces.append(line[pos:match.end()])
+                        pos = match.end()
+                        statement = emit()
+                        if statement:
+                            yield statement, offset
+                    elif token == '--':
+                        pieces.append(line[pos:match.start()] + '\n')  # comentário descartado
+                        break
+                    elif token == '/*':
+                        pieces.append(line[pos:match.start()])
+                        state, pos = 'block_comment', match.end()
+                    elif token == '$':
+                        tag = DOLLAR_TAG.match(line, match.start())
+                        pieces.append(line[pos:tag.end() if tag else match.end()])
+                        pos = tag.end() if tag else match.end()
+                        if tag:
+                            state, dollar_tag = 'dollar', tag.group()
+                    else:
+                        pieces.append(line[pos:match.end()])
+                        state = 'single_quote' if token == "'" else 'double_quote'
+                        pos = match.end()
+
+                elif state in ('single_quote', 'double_quote'):
+                    quote = "'" if state == 'single_quote' else '"'
+                    idx = line.find(quote, pos)
+                    if idx < 0:
+                        pieces.append(line[pos:])
+                        break
+                    if line.startswith(quote * 2, idx):  # aspas escapadas ('' ou "")
+                        pieces.append(line[pos:idx + 2])
+                        pos = idx + 2
+                        continue
+                    pieces.append(line[pos:idx + 1])
+                    state, pos = 'normal', idx + 1
+
+                elif state == 'block_comment':
+                    idx = line.find('*/', pos)
+                    if idx < 0:
+                        break
+                    state, pos = 'normal', idx + 2
+
+                else:  # dollar
+                    idx = line.find(dollar_tag, pos)
+                    if idx < 0:
+                        pieces.append(line[pos:])
+                        break
+                    pieces.append(line[pos:idx + len(dollar_tag)])
+                    state, pos = 'normal', idx + len(dollar_tag)
+
+    statement = emit()
+    if statement:
+        yield statement, offset
+
+
+def statement_table(statement: str) -> Optional[str]:
+    """Tabela alvo de um statement DML (None para DDL/REFRESH/etc.)"""
+    match = TABLE_PATTERN.match(statement)
+    return match.group(1).strip('"').lower() if match else None
+
+
+def count_rows(statement: str) -> int:
+    """Linhas de um INSERT ... VALUES (grupos de parênteses de nível 0 após VALUES)"""
+    depth = 0
+    after_values = False
+    rows = 0
+    for match in VALUES_TOKENS.finditer(statement):
+        token = match.group()
+        if token == '(':
+            if depth == 0 and after_values:
+                rows += 1
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif token[0] != "'" and depth == 0:
+            after_values = True
+    return max(rows, 1)
+
+
+@dataclass
+class SqlChunk:
+    """Statements consecutivos da mesma tabela dentro do orçamento de bytes/linhas"""
+    id: int
+    phase: int
+    table: Optional[str]
+    statements: List[str] = field(default_factory=list)
+    size_bytes: int = 0
+    rows: int = 0
+    end_offset: int = 0
+
+    @property
+    def sql(self) -> str:
+        return '\n'.join(s if s.endswith(';') else s + ';' for s in self.statements)
+
+
+def iter_chunks(path: str, max_bytes: int = 512 * 1024, max_rows: int = 5000) -> Iterator[SqlChunk]:
+    """
+    Agrupar statements em chunks. Uma troca de tabela abre uma nova fase
+    (chunks de fases diferentes nunca executam juntos, preservando a ordem de
+    dependência do arquivo); statements sem tabela (DDL, REFRESH) viram um
+    chunk isolado, que funciona como barreira
+    """
+    chunk: Optional[SqlChunk] = None
+    next_id = 1
+    phase = 0
+    current_table: Any = object()
+
+    for statement, offset in iter_statements(path):
+        table = statement_table(statement)
+        size = len(statement.encode('utf-8'))
+        rows = count_rows(statement) if table else 1
+
+        starts_phase = table is None or table != current_table
+        over_budget = chunk is not None and (chunk.size_bytes + size > max_bytes or chunk.rows + rows > max_rows)
+
+        if chunk is not None and (starts_phase or over_budget):
+            yield chunk
+            chunk = None
+        if starts_phase:
+            phase += 1
+            current_table = table
+
+        if chunk is None:
+            chunk = SqlChunk(id=next_id, phase=phase, table=table)
+            next_id += 1
+
+        chunk.statements.append(statement)
+        chunk.size_bytes += size
+        chunk.rows += rows
+        chunk.end_offset = offset
+
+        if table is None:
+            yield chunk
+            chunk = None
+            current_table = object()
+
+    if chunk is not None:
+        yield chunk
+
+
+class ChunkRunner:
+    """Execução paralela limitada de chunks, com progresso e retomada"""
+
+    def __init__(self, executor, checkpoint_path: str, max_in_flight: Optional[int] = None):
+        self.executor = executor
+        self.checkpoint = CheckpointLog(checkpoint_path)
+        self.max_in_flight = max_in_flight or executor.max_connections
+        self.stats = {'executed': 0, 'failed': 0, 'skipped': 0, 'bytes': 0, 'rows': 0}
+
+    @staticmethod
+    def _execute(conn, chunk: SqlChunk) -> int:
+        with conn.cursor() as cur:
+            cur.execute(chunk.sql)
+            return max(cur.rowcount, 0)
+
+    def _record(self, futures, total_bytes: int):
+        """Registrar chunks concluídos no checkpoint e no progresso"""
+        records = []
+        for future in futures:
+            chunk, outcome = future.chunk, future.result()
+            success = outcome['status'] == 'success'
+            self.stats['executed' if success else 'failed'] += 1
+            self.stats['bytes'] += chunk.size_bytes
+            self.stats['rows'] += chunk.rows
+            records.append({
+                'chunk': chunk.id, 'status': outcome['status'], 'table': chunk.table,
+                'statements': len(chunk.statements), 'rows': chunk.rows,
+                'latency': round(outcome['latency'], 3), 'error': outcome.get('error')
+            })
+            progress = chunk.end_offset / total_bytes * 100 if total_bytes else 100.0
+            status = "✅" if success else "❌"
+            logging.info(f"{status} Chunk {chunk.id} ({chunk.table or 'ddl'}, {len(chunk.statements)} statements, "
+                         f"{chunk.rows} linhas) em {outcome['latency']:.2f}s - {progress:.1f}% do arquivo")
+        self.checkpoint.append(records)
+
+    def run(self, path: str, max_bytes: int, max_rows: int) -> Dict[str, Any]:
+        started = time.time()
+        total_bytes = os.path.getsize(path)
+        done = self.checkpoint.completed_keys('chunk')
+        if done:
+            logging.info(f"♻️ Retomando: {len(done)} chunks já executados")
+
+        in_flight = set()
+        current_phase = None
+        aborted = False
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            for chunk in iter_chunks(path, max_bytes, max_rows):
+                if chunk.id in done:
+                    self.stats['skipped'] += 1
+                    continue
+
+                # Barreira entre fases: a fase seguinte só começa quando a atual termina
+                if chunk.phase != current_phase and in_flight:
+                    self._record(wait(in_flight).done, total_bytes)
+                    in_flight = set()
+                    if self.stats['failed']:
+                        aborted = True
+                        logging.error(f"🛑 Fase anterior com falhas; interrompendo antes do chunk {chunk.id}")
+                        break
+                current_phase = chunk.phase
+
+                while len(in_flight) >= self.max_in_flight:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    self._record(finished, total_bytes)
+
+                future = pool.submit(self.executor.run_batch, chunk.id, chunk, self._execute)
+                future.chunk = chunk
+                in_flight.add(future)
+
+            if in_flight:
+                self._record(wait(in_flight).done, total_bytes)
+
+        report = dict(self.stats, aborted=aborted, duration=time.time() - started)
+        logging.info(f"🏁 {report['executed']} chunks executados, {report['failed']} falhas, "
+                     f"{report['skipped']} já concluídos em {report['duration']:.1f}s")
+        return report
+
+
+def write_chunk_files(path: str, output_dir: str, max_bytes: int, max_rows: int) -> int:
+    """Gravar os chunks como arquivos (para aplicação externa, ex.: via MCP)"""
+    os.makedirs(output_dir, exist_ok=True)
+    count = 0
+    for chunk in iter_chunks(path, max_bytes, max_rows):
+        filename = os.path.join(output_dir, f"chunk_{chunk.id:05d}_{chunk.table or 'ddl'}.sql")
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(chunk.sql + '\n')
+        count += 1
+    logging.info(f"💾 {count} chunks gravados em {output_dir}")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Divisão e execução paralela de arquivos SQL')
+    parser.add_argument('sql_file')
+    parser.add_argument('--max-kb', type=int, default=512, help='Orçamento de tamanho por chunk (KB)')
+    parser.add_argument('--max-rows', type=int, default=5000, help='Orçamento de linhas por chunk')
+    parser.add_argument('--workers', type=int, default=4, help='Conexões/chunks em paralelo')
+    parser.add_argument('--output-dir', help='Apenas gravar os chunks como arquivos, sem executar')
+    args = parser.parse_args()
+    configure_logging()
+
+    max_bytes = args.max_kb * 1024
+    if args.output_dir:
+        write_chunk_files(args.sql_file, args.output_dir, max_bytes, args.max_rows)
+        return
+
+    from pooled_executor import PooledBatchExecutor
+
+    # Checkpoint atrelado aos orçamentos: a numeração dos chunks depende deles
+    checkpoint_path = f"{args.sql_file}.{args.max_kb}k-{args.max_rows}r.ckpt"
+    executor = PooledBatchExecutor(max_connections=args.workers)
+    try:
+        ChunkRunner(executor, checkpoint_path).run(args.sql_file, max_bytes, args.max_rows)
+    finally:
+        executor.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+PIPELINE DE CARGA VIA STAGING + MERGE ÚNICO
+Todos os registros de uma execução vão por COPY para tabelas UNLOGGED de
+staging (marcados com run_id). No final, um merge set-based por tabela
+destino (assets_master -> stock_metrics_snapshot -> stock_prices_daily) em
+uma única transação, que também marca stocks_ativos_reais como suja; o
+refresh fica com o agendador (view_refresh.py), no máximo um por janela
+"""
+
+import argparse
+import json
+import logging
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+from bulk_loader import connect_from_env, copy_rows
+from log_setup import configure_logging
+from view_refresh import ViewRefreshScheduler, mark_views_dirty
+
+ASSET_COLUMNS = {
+    'ticker': 'TEXT', 'asset_type': 'TEXT', 'name': 'TEXT', 'exchange': 'TEXT',
+    'sector': 'TEXT', 'industry': 'TEXT', 'currency': 'TEXT'
+}
+
+SNAPSHOT_COLUMNS = {
+    'ticker': 'TEXT', 'snapshot_date': 'DATE',
+    'current_price': 'NUMERIC', 'market_cap': 'BIGINT', 'shares_outstanding': 'BIGINT',
+    'volume_avg_30d': 'BIGINT',
+    'returns_12m': 'NUMERIC', 'returns_24m': 'NUMERIC', 'returns_36m': 'NUMERIC',
+    'returns_5y': 'NUMERIC', 'ten_year_return': 'NUMERIC',
+    'volatility_12m': 'NUMERIC', 'volatility_24m': 'NUMERIC', 'volatility_36m': 'NUMERIC',
+    'ten_year_volatility': 'NUMERIC',
+    'sharpe_12m': 'NUMERIC', 'sharpe_24m': 'NUMERIC', 'sharpe_36m': 'NUMERIC', 'ten_year_sharpe': 'NUMERIC',
+    'max_drawdown': 'NUMERIC', 'dividend_yield_12m': 'NUMERIC', 'dividends_12m': 'NUMERIC',
+    'size_category': 'TEXT', 'liquidity_category': 'TEXT', 'source_meta': 'JSONB'
+}
+
+PRICE_COLUMNS = {
+    'ticker': 'TEXT', 'date': 'DATE', 'open': 'NUMERIC', 'high': 'NUMERIC', 'low': 'NUMERIC',
+    'close': 'NUMERIC', 'volume': 'BIGINT'
+}
+
+# Colunas NOT NULL com default no destino (o COPY grava NULL quando o campo falta)
+STAGING_DEFAULTS = {'asset_type': "'STOCK'", 'snapshot_date': 'CURRENT_DATE'}
+
+# Tabela destino -> (staging, colunas, chave de conflito). Ordem = ordem do merge
+TARGETS = {
+    'assets_master': ('staging_assets_master', ASSET_COLUMNS, ['ticker']),
+    'stock_metrics_snapshot': ('staging_stock_metrics_snapshot', SNAPSHOT_COLUMNS, ['asset_id', 'snapshot_date']),
+    'stock_prices_daily': ('staging_stock_prices_daily', PRICE_COLUMNS, ['asset_id', 'date'])
+}
+
+
+class StagingMergePipeline:
+    """Staging UNLOGGED por execução + merge set-based + refresh único das views"""
+
+    def __init__(self, conn, run_id: Optional[str] = None, copy_chunk_rows: int = 500_000):
+        self.conn = conn
+        self.run_id = run_id or uuid.uuid4().hex
+        self.copy_chunk_rows = copy_chunk_rows
+        self.staged: Dict[str, int] = {target: 0 for target in TARGETS}
+
+    def ensure_staging(self):
+        """Criar as tabelas de staging (UNLOGGED: sem WAL, descartáveis após o merge)"""
+        with self.conn.cursor() as cur:
+            for staging, columns, _ in TARGETS.values():
+                column_defs = ', '.join(f"{name} {sql_type}" for name, sql_type in columns.items())
+                cur.execute(f"CREATE UNLOGGED TABLE IF NOT EXISTS {staging} (run_id TEXT NOT NULL, {column_defs})")
+                cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{staging}_run ON {staging} (run_id)")
+        self.conn.commit()
+
+    def stage(self, target: str, rows: Iterable[Dict[str, Any]]) -> int:
+        """Enviar linhas de uma tabela destino para a staging (COPY, sem tocar na tabela real)"""
+        staging, columns, _ = TARGETS[target]
+        tagged = ({**row, 'run_id': self.run_id} for row in rows)
+        try:
+            with self.conn.cursor() as cur:
+                count = copy_rows(cur, staging, ['run_id'] + list(columns), tagged, self.copy_chunk_rows)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.staged[target] += count
+        return count
+
+    @staticmethod
+    def _expr(column: str) -> str:
+        """Expressão de origem na staging (com default quando o destino exige valor)"""
+        default = STAGING_DEFAULTS.get(column)
+        return f"COALESCE(s.{column}, {default})" if default else f"s.{column}"
+
+    def _merge_assets(self, cur) -> int:
+        columns = list(ASSET_COLUMNS)
+        updates = ', '.join(f"{c} = COALESCE(EXCLUDED.{c}, assets_master.{c})" for c in columns if c != 'ticker')
+        cur.execute(f"""
+            INSERT INTO assets_master ({', '.join(columns)})
+            SELECT DISTINCT ON (s.ticker) {', '.join(self._expr(c) for c in columns)}
+            FROM staging_assets_master s
+            WHERE s.run_id = %s
+            ORDER BY s.ticker
+            ON CONFLICT (ticker) DO UPDATE SET {updates}, updated_at = now()
+        """, (self.run_id,))
+        return cur.rowcount
+
+    def _merge_by_ticker(self, cur, target: str, conflict_columns: List[str]) -> int:
+        """Merge de uma staging com ticker -> tabela com asset_id (um join para o conjunto inteiro)"""
+        staging, columns, _ = TARGETS[target]
+        value_columns = [c for c in columns if c != 'ticker']
+        other_keys = [c for c in conflict_columns if c != 'asset_id']
+        updates = ', '.join(f"{c} = EXCLUDED.{c}" for c in value_columns if c not in other_keys)
+        distinct = ', '.join(['am.id'] + [self._expr(c) for c in other_keys])
+
+        cur.execute(f"""
+            INSERT INTO {target} (asset_id, {', '.join(value_columns)})
+            SELECT DISTINCT ON ({distinct}) am.id, {', '.join(self._expr(c) for c in value_columns)}
+            FROM {staging} s
+            JOIN assets_master am ON am.ticker = s.ticker AND am.asset_type = 'STOCK'
+            WHERE s.run_id = %s
+            ORDER BY {distinct}
+            ON CONFLICT ({', '.join(conflict_columns)}) DO UPDATE SET {updates}
+        """, (self.run_id,))
+        return cur.rowcount
+
+    def merge(self) -> Dict[str, int]:
+        """Aplicar todas as stagings da execução em uma única transação"""
+        started = time.time()
+        merged = {}
+        try:
+            with self.conn.cursor() as cur:
+                # Sempre pela staging (não pelo contador local): a execução pode ter sido
+                # preenchida por outros processos com o mesmo run_id
+                merged['assets_master'] = self._merge_assets(cur)
+                for target in ('stock_metrics_snapshot', 'stock_prices_daily'):
+                    merged[target] = self._merge_by_ticker(cur, target, TARGETS[target][2])
+                for staging, _, _ in TARGETS.values():
+                    cur.execute(f"DELETE FROM {staging} WHERE run_id = %s", (self.run_id,))
+            if any(merged.values()):
+                mark_views_dirty(self.conn, commit=False)  # mesmo commit do merge
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        logging.info(f"🔀 Merge da execução {self.run_id[:8]} em {time.time() - started:.1f}s: {merged}")
+        return merged
+
+    def refresh_views(self) -> Dict[str, float]:
+        """Refresh das views sujas ao fim da carga (forçado: a janela vale só para o agendador)"""
+        return ViewRefreshScheduler(self.conn).run_once(force=True)
+
+    def load_results(self, results: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Carregar um resultado de ETL ({tabela: [linhas]}) com um merge e um refresh no final"""
+        self.ensure_staging()
+        for target in TARGETS:
+            rows = results.get(target) or []
+            if rows:
+                self.stage(target, rows)
+                logging.info(f"📥 {target}: {self.staged[target]:,} linhas na staging")
+
+        merged = self.merge()
+        refresh = self.refresh_views()
+        return {'run_id': self.run_id, 'staged': self.staged, 'merged': merged, 'refresh_seconds': refresh}
+
+
+def main():
+    """Carregar um arquivo JSON de resultados ({assets_master, stock_metrics_snapshot, stock_prices_daily})"""
+    parser = argparse.ArgumentParser(description='Carga via staging com merge e refresh únicos')
+    parser.add_argument('results_file', help='JSON com listas de linhas por tabela destino')
+    parser.add_argument('--run-id', help='Identificador da execução (padrão: uuid aleatório)')
+    args = parser.parse_args()
+    configure_logging()
+
+    with open(args.results_file, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+
+    conn = connect_from_env()
+    try:
+        report = StagingMergePipeline(conn, run_id=args.run_id).load_results(results)
+    finally:
+        conn.close()
+
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
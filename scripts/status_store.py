@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+STORE DE STATUS DE PROCESSAMENTO (CHECKPOINT SQLITE)
+Uma conexão SQLite de longa duração em modo WAL (leitores concorrentes, como
+monitores, não bloqueiam a escrita), status por símbolo acumulados em
+memória e gravados em lote a cada N símbolos ou T segundos, e conjuntos de
+processados/falhos mantidos em memória, sem reconsultar a tabela
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Set, Tuple
+
+DEFAULT_STATUS_PATH = 'stocks_etl_checkpoint.db'
+
+
+class ProcessingStatusStore:
+    """Status por símbolo + progresso por lote, com escrita em lote"""
+
+    def __init__(self, path: str = DEFAULT_STATUS_PATH, flush_every: int = 50,
+                 flush_interval: float = 5.0, max_retries: int = 3):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Mesmo schema lido pelos monitores existentes
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS processing_status (
+                symbol TEXT PRIMARY KEY,
+                status TEXT,
+                processed_at TIMESTAMP,
+                error_message TEXT,
+                retry_count INTEGER DEFAULT 0
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS batch_progress (
+                batch_id INTEGER PRIMARY KEY,
+                batch_size INTEGER,
+                completed_at TIMESTAMP,
+                success_count INTEGER,
+                error_count INTEGER
+            )
+        """)
+        self._conn.commit()
+
+        self._pending: Dict[str, Tuple[str, str, Optional[str], int]] = {}
+        self._pending_batches = []
+        self._last_flush = time.time()
+        self.retry_counts: Dict[str, int] = {}
+        self.processed: Set[str] = set()
+        self.failed: Set[str] = set()
+        self.flushes = 0
+        self.flush_seconds = 0.0
+
+        # Carga única do estado (depois, só a memória é consultada)
+        for symbol, status, retry_count in self._conn.execute(
+                "SELECT symbol, status, retry_count FROM processing_status"):
+            self._track(symbol, status, retry_count or 0)
+
+    def _track(self, symbol: str, status: str, retry_count: int):
+        self.retry_counts[symbol] = retry_count
+        self.processed.discard(symbol)
+        self.failed.discard(symbol)
+        if status == 'success':
+            self.processed.add(symbol)
+        elif status == 'failed':
+            self.failed.add(symbol)
+
+    def retryable_failed(self) -> Set[str]:
+        """Símbolos que falharam e ainda têm tentativas"""
+        return {s for s in self.failed if self.retry_counts.get(s, 0) < self.max_retries}
+
+    def update(self, symbol: str, status: str, error_msg: Optional[str] = None):
+        """Registrar o status de um símbolo (gravado no próximo flush)"""
+        retry_count = self.retry_counts.get(symbol, 0) + 1 if status == 'failed' else 0
+        with self._lock:
+            self._track(symbol, status, retry_count)
+            self._pending[symbol] = (status, datetime.now().isoformat(), error_msg, retry_count)
+            due = (len(self._pending) >= self.flush_every
+                   or time.time() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def record_batch(self, batch_id: int, batch_size: int, success_count: int, error_count: int):
+        """Registrar a conclusão de um lote (vai junto com o flush dos símbolos)"""
+        with self._lock:
+            self._pending_batches.append(
+                (batch_id, batch_size, datetime.now().isoformat(), success_count, error_count)
+            )
+        self.flush()
+
+    def flush(self):
+        """Gravar tudo o que está pendente em uma única transação"""
+        with self._lock:
+            if not self._pending and not self._pending_batches:
+                self._last_flush = time.time()
+                return
+            started = time.time()
+            rows = [(symbol, *values) for symbol, values in self._pending.items()]
+            batches = self._pending_batches
+            try:
+                with self._conn:
+                    self._conn.executemany("""
+                        INSERT OR REPLACE INTO processing_status
+                        (symbol, status, processed_at, error_message, retry_count)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, rows)
+                    self._conn.executemany("""
+                        INSERT OR REPLACE INTO batch_progress
+                        (batch_id, batch_size, completed_at, success_count, error_count)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, batches)
+            except sqlite3.Error as e:
+                # Pendências preservadas para o próximo flush
+                logging.error(f"❌ Erro ao gravar checkpoint ({len(rows)} status): {e}")
+                return
+            self._pending = {}
+            self._pending_batches = []
+            self._last_flush = time.time()
+            self.flushes += 1
+            self.flush_seconds += self._last_flush - started
+
+    def reset(self):
+        """Esquecer os status por símbolo (após uma execução concluída sem falhas)"""
+        with self._lock:
+            self._pending = {}
+            try:
+                with self._conn:
+                    self._conn.execute("DELETE FROM processing_status")
+            except sqlite3.Error as e:
+                logging.error(f"❌ Erro ao limpar checkpoint: {e}")
+                return
+            self.retry_counts.clear()
+            self.processed.clear()
+            self.failed.clear()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'processed': len(self.processed),
+            'failed': len(self.failed),
+            'pending_writes': len(self._pending),
+            'flushes': self.flushes,
+            'flush_seconds': self.flush_seconds
+        }
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self) -> 'ProcessingStatusStore':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -4,33 +4,38 @@ Stock Enrichment Worker - Pipeline de Enriquecimento de Ações
 Integração com yfinance e Perplexity AI para calcular métricas financeiras completas
 """
 
+import argparse
 import yfinance as yf
 import numpy as np
 import pandas as pd
-import requests
 import json
 import time
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 import os
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
+
+from etl_events import EventPublisher
+from log_setup import configure_logging
+from metric_cache import MetricCache, get_shared_cache
+from profiling import add_profile_argument, start_profiling, stop_profiling
+from provider_errors import EmptyResponse, ProviderErrorPolicy, RetryItem
+from run_report import RunReport, ticker_scope
+from supabase_rest import SupabaseRestWriter
+from telemetry import TELEMETRY, span, timed
+from trading_calendar import TradingCalendar
+from write_outbox import OutboxDrainer, WriteOutbox
 
 # Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('stock_enrichment.log'),
-        logging.StreamHandler()
-    ]
-)
+configure_logging('stock_enrichment.log')
 logger = logging.getLogger(__name__)
 
 @dataclass
 class StockMetrics:
     """Estrutura para métricas calculadas"""
     ticker: str
+    name: Optional[str] = None
     returns_12m: Optional[float] = None
     returns_24m: Optional[float] = None
     returns_36m: Optional[float] = None
@@ -60,14 +65,24 @@ class StockMetrics:
 class StockEnrichmentWorker:
     """Worker principal para enriquecimento de ações"""
     
-    def __init__(self, supabase_url: str, supabase_key: str, perplexity_key: str = None):
+    def __init__(self, supabase_url: str, supabase_key: str, perplexity_key: str = None,
+                 metric_cache: Optional[MetricCache] = None, outbox: Optional[WriteOutbox] = None,
+                 provider_errors: Optional[ProviderErrorPolicy] = None):
         self.supabase_url = supabase_url
         self.supabase_key = supabase_key
         self.perplexity_key = perplexity_key
         self.risk_free_rate = 0.02  # Taxa livre de risco (2%)
-        
+        self.metric_cache = metric_cache
+        # Sessão HTTP keep-alive compartilhada por todas as escritas
+        self.rest_writer = SupabaseRestWriter(supabase_url, supabase_key)
+        # Outbox local opcional: falhas de escrita são reenfileiradas em vez de descartadas
+        self.outbox = outbox
+        # Falhas do provedor por sub-requisição (history/info/dividends): retry adiado só do que falhou
+        self.provider_errors = provider_errors or ProviderErrorPolicy()
+
         # Cache para dados de mercado (S&P 500)
         self.market_data_cache = None
+        self.market_calendar = None
         self.cache_date = None
         
     def fetch_market_benchmark(self) -> pd.DataFrame:
@@ -86,6 +101,7 @@ class StockEnrichmentWorker:
                 raise ValueError("Dados do S&P 500 não encontrados")
                 
             self.market_data_cache = market_data
+            self.market_calendar = TradingCalendar.from_benchmark(market_data)
             self.cache_date = datetime.now()
             
             logger.info(f"✅ Dados do S&P 500 carregados: {len(market_data)} dias")
@@ -96,29 +112,42 @@ class StockEnrichmentWorker:
             return pd.DataFrame()
     
     def fetch_stock_data(self, ticker: str) -> Tuple[pd.DataFrame, Dict]:
-        """Buscar dados históricos da ação"""
+        """Buscar dados históricos da ação (falha em `info` não descarta o histórico)"""
+        logger.info(f"📈 Buscando dados históricos para {ticker}...")
+        stock = yf.Ticker(ticker)
+        
         try:
-            logger.info(f"📈 Buscando dados históricos para {ticker}...")
-            
-            stock = yf.Ticker(ticker)
-            
             # Buscar dados históricos (10 anos)
-            hist_data = stock.history(period="10y", interval="1d")
+            with span('fetch.history'):
+                hist_data = stock.history(period="10y", interval="1d")
             
             if hist_data.empty:
-                logger.warning(f"⚠️ Sem dados históricos para {ticker}")
-                return pd.DataFrame(), {}
-            
-            # Buscar informações adicionais
-            info = stock.info if hasattr(stock, 'info') else {}
-            
-            logger.info(f"✅ Dados carregados para {ticker}: {len(hist_data)} dias")
-            return hist_data, info
-            
+                raise EmptyResponse(f"Sem dados históricos para {ticker}")
+            self.provider_errors.succeeded(ticker, 'history')
+        
         except Exception as e:
-            logger.error(f"❌ Erro ao buscar dados para {ticker}: {e}")
+            logger.warning(f"⚠️ Falha ao buscar histórico de {ticker}: {e}")
+            self.provider_errors.handle(ticker, 'history', e)
             return pd.DataFrame(), {}
+        
+        # Buscar informações adicionais
+        info = self.fetch_info(ticker, stock)
+        
+        logger.info(f"✅ Dados carregados para {ticker}: {len(hist_data)} dias")
+        return hist_data, info
     
+    def fetch_info(self, ticker: str, stock=None) -> Dict:
+        """Buscar `info`; em falha segue sem ele e agenda apenas esta sub-requisição"""
+        try:
+            with span('fetch.info'):
+                info = (stock or yf.Ticker(ticker)).info or {}
+            self.provider_errors.succeeded(ticker, 'info')
+            return info
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao buscar info de {ticker}: {e}")
+            self.provider_errors.handle(ticker, 'info', e)
+            return {}
+
     def calculate_returns(self, prices: pd.Series, periods: Dict[str, int]) -> Dict[str, float]:
         """Calcular retornos para diferentes períodos"""
         returns = {}
@@ -219,18 +248,15 @@ class StockEnrichmentWorker:
                 logger.warning("⚠️ Dados de mercado não disponíveis para beta")
                 return None
                 
-            # Alinhar datas
-            market_prices = market_data['Close'].reindex(stock_prices.index, method='ffill')
-            
-            # Calcular retornos diários
-            stock_returns = stock_prices.pct_change().dropna()
-            market_returns = market_prices.pct_change().dropna()
+            # Alinhar ambas as séries ao calendário de pregões do benchmark
+            calendar = self.market_calendar or TradingCalendar.from_benchmark(market_data)
+            aligned_prices = calendar.align_matrix({
+                'stock': stock_prices,
+                'market': market_data['Close']
+            })
             
-            # Alinhar séries
-            aligned_data = pd.DataFrame({
-                'stock': stock_returns,
-                'market': market_returns
-            }).dropna()
+            # Retornos diários sobre o calendário comum
+            aligned_data = aligned_prices.pct_change(fill_method=None).dropna()
             
             if len(aligned_data) < 252:  # Mínimo 1 ano de dados
                 logger.warning("⚠️ Dados insuficientes para cálculo de beta")
@@ -258,8 +284,18 @@ class StockEnrichmentWorker:
         try:
             # Buscar histórico de dividendos
             stock = yf.Ticker(ticker)
-            dividends = stock.dividends
-            
+            with span('fetch.dividends'):
+                dividends = stock.dividends
+            self.provider_errors.succeeded(ticker, 'dividends')
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao buscar dividendos de {ticker}: {e}")
+            # O retry recalcula só os dividendos e precisa dos campos de `info` usados no yield
+            self.provider_errors.handle(ticker, 'dividends', e, payload={
+                key: stock_info.get(key) for key in ('dividendYield', 'currentPrice')
+            })
+            return dividend_metrics
+        
+        try:
             if not dividends.empty:
                 # Dividendos dos últimos períodos
                 now = datetime.now()
@@ -292,11 +328,86 @@ class StockEnrichmentWorker:
             
         return dividend_metrics
     
+    def metric_params(self) -> Dict:
+        """Parâmetros que influenciam as métricas (parte da chave do cache)"""
+        market_data = self.fetch_market_benchmark()
+        benchmark_last_bar = str(market_data.index[-1].date()) if not market_data.empty else None
+        return {
+            'risk_free_rate': self.risk_free_rate,
+            'windows': [252, 504, 756, 1260, 2520],
+            'benchmark': 'SPY',
+            'benchmark_last_bar': benchmark_last_bar,
+            'version': '1.0'
+        }
+    
+    @timed('calculate')
+    def calculate_metrics(self, ticker: str, prices: pd.Series, stock_info: Dict) -> StockMetrics:
+        """Calcular todas as métricas a partir da série de preços"""
+        metrics = StockMetrics(ticker=ticker)
+        
+        # Definir períodos para cálculos
+        periods = {
+            'returns_12m': 252,    # ~1 ano
+            'returns_24m': 504,    # ~2 anos  
+            'returns_36m': 756,    # ~3 anos
+            'returns_5y': 1260,    # ~5 anos
+            'ten_year_return': 2520  # ~10 anos
+        }
+        
+        volatility_periods = {
+            'volatility_12m': 252,
+            'volatility_24m': 504,
+            'volatility_36m': 756,
+            'ten_year_volatility': 2520
+        }
+        
+        sharpe_periods = {
+            'sharpe_12m': 252,
+            'sharpe_24m': 504,
+            'sharpe_36m': 756,
+            'ten_year_sharpe': 2520
+        }
+        
+        # Calcular métricas
+        logger.info(f"📊 Calculando métricas para {ticker}...")
+        
+        # Returns
+        returns = self.calculate_returns(prices, periods)
+        for key, value in returns.items():
+            setattr(metrics, key, value)
+        
+        # Volatilidade
+        volatilities = self.calculate_volatility(prices, volatility_periods)
+        for key, value in volatilities.items():
+            setattr(metrics, key, value)
+        
+        # Sharpe ratios
+        sharpe_ratios = self.calculate_sharpe_ratio(prices, sharpe_periods)
+        for key, value in sharpe_ratios.items():
+            setattr(metrics, key, value)
+        
+        # Max drawdown
+        metrics.max_drawdown = self.calculate_max_drawdown(prices)
+        
+        # Beta
+        market_data = self.fetch_market_benchmark()
+        metrics.beta_coefficient = self.calculate_beta(prices, market_data)
+        
+        # Dividendos
+        dividend_metrics = self.calculate_dividend_metrics(ticker, stock_info)
+        for key, value in dividend_metrics.items():
+            setattr(metrics, key, value)
+        
+        return metrics
+    
     def process_stock(self, ticker: str) -> StockMetrics:
         """Processar uma ação completa"""
         logger.info(f"🚀 Iniciando processamento de {ticker}")
         
         metrics = StockMetrics(ticker=ticker)
+        if ticker in self.provider_errors.delisted:
+            metrics.calculation_errors.append("Ativo deslistado/inexistente (registro permanente)")
+            return metrics
         
         try:
             # 1. Buscar dados históricos
@@ -308,58 +419,22 @@ class StockEnrichmentWorker:
             
             prices = hist_data['Close']
             
-            # 2. Definir períodos para cálculos
-            periods = {
-                'returns_12m': 252,    # ~1 ano
-                'returns_24m': 504,    # ~2 anos  
-                'returns_36m': 756,    # ~3 anos
-                'returns_5y': 1260,    # ~5 anos
-                'ten_year_return': 2520  # ~10 anos
-            }
-            
-            volatility_periods = {
-                'volatility_12m': 252,
-                'volatility_24m': 504,
-                'volatility_36m': 756,
-                'ten_year_volatility': 2520
-            }
-            
-            sharpe_periods = {
-                'sharpe_12m': 252,
-                'sharpe_24m': 504,
-                'sharpe_36m': 756,
-                'ten_year_sharpe': 2520
-            }
-            
-            # 3. Calcular métricas
-            logger.info(f"📊 Calculando métricas para {ticker}...")
-            
-            # Returns
-            returns = self.calculate_returns(prices, periods)
-            for key, value in returns.items():
-                setattr(metrics, key, value)
-            
-            # Volatilidade
-            volatilities = self.calculate_volatility(prices, volatility_periods)
-            for key, value in volatilities.items():
-                setattr(metrics, key, value)
-            
-            # Sharpe ratios
-            sharpe_ratios = self.calculate_sharpe_ratio(prices, sharpe_periods)
-            for key, value in sharpe_ratios.items():
-                setattr(metrics, key, value)
-            
-            # Max drawdown
-            metrics.max_drawdown = self.calculate_max_drawdown(prices)
-            
-            # Beta
-            market_data = self.fetch_market_benchmark()
-            metrics.beta_coefficient = self.calculate_beta(prices, market_data)
-            
-            # Dividendos
-            dividend_metrics = self.calculate_dividend_metrics(ticker, stock_info)
-            for key, value in dividend_metrics.items():
-                setattr(metrics, key, value)
+            # 2. Calcular métricas (reaproveitando o cache quando a série não mudou)
+            if self.metric_cache is not None:
+                computed = {}
+                
+                def compute():
+                    computed['metrics'] = self.calculate_metrics(ticker, prices, stock_info)
+                    # Sub-requisição aguardando retry: não guardar o snapshot incompleto no cache
+                    return None if self.has_pending_retry(ticker) else asdict(computed['metrics'])
+                
+                cached = self.metric_cache.get_or_compute(
+                    'stock_enrichment', ticker, prices, self.metric_params(), compute
+                )
+                metrics = StockMetrics(**cached) if cached is not None else computed['metrics']
+            else:
+                metrics = self.calculate_metrics(ticker, prices, stock_info)
+            metrics.name = stock_info.get('longName') or stock_info.get('shortName')
             
             logger.info(f"✅ Métricas calculadas com sucesso para {ticker}")
             
@@ -369,6 +444,26 @@ class StockEnrichmentWorker:
         
         return metrics
     
+    def has_pending_retry(self, ticker: str) -> bool:
+        """Alguma sub-requisição do ticker aguarda nova tentativa"""
+        return any(self.provider_errors.retries.attempts(ticker, request)
+                   for request in ('history', 'info', 'dividends'))
+    
+    def retry_subrequest(self, item: RetryItem, metrics: Optional[StockMetrics]) -> StockMetrics:
+        """Refazer apenas a sub-requisição que falhou, completando as métricas já calculadas"""
+        if item.request == 'history' or metrics is None:
+            return self.process_stock(item.key)
+        
+        if item.request == 'info':
+            info = self.fetch_info(item.key)
+            metrics.name = info.get('longName') or info.get('shortName') or metrics.name
+            if info.get('dividendYield'):
+                metrics.dividend_yield_12m = round(info['dividendYield'] * 100, 4)
+        elif item.request == 'dividends':
+            for key, value in self.calculate_dividend_metrics(item.key, item.payload or {}).items():
+                setattr(metrics, key, value)
+        return metrics
+    
     def validate_with_perplexity(self, ticker: str, metrics: StockMetrics) -> Dict:
         """Validar métricas com Perplexity AI"""
         if not self.perplexity_key:
@@ -407,66 +502,121 @@ class StockEnrichmentWorker:
             logger.error(f"❌ Erro na validação Perplexity para {ticker}: {e}")
             return {"validated": False, "error": str(e)}
     
+    def _update_payload(self, metrics: StockMetrics) -> Dict:
+        """
+        Campos de stocks_unified atualizados pelo worker (None removido: métrica
+        não calculada, ex. histórico curto, não apaga o valor já gravado)
+        """
+        update_data = {
+            'returns_24m': metrics.returns_24m,
+            'returns_36m': metrics.returns_36m,
+            'returns_5y': metrics.returns_5y,
+            'ten_year_return': metrics.ten_year_return,
+            'volatility_24m': metrics.volatility_24m,
+            'volatility_36m': metrics.volatility_36m,
+            'ten_year_volatility': metrics.ten_year_volatility,
+            'sharpe_24m': metrics.sharpe_24m,
+            'sharpe_36m': metrics.sharpe_36m,
+            'ten_year_sharpe': metrics.ten_year_sharpe,
+            'beta_coefficient': metrics.beta_coefficient,
+            'dividend_yield_12m': metrics.dividend_yield_12m,
+            'dividends_24m': metrics.dividends_24m,
+            'dividends_36m': metrics.dividends_36m,
+            'dividends_all_time': metrics.dividends_all_time,
+            'last_updated': datetime.now().isoformat(),
+            'source_meta': {
+                'enrichment_date': datetime.now().isoformat(),
+                'enrichment_version': '1.0',
+                'source': 'yfinance_python',
+                'calculation_errors': metrics.calculation_errors
+            }
+        }
+        
+        # Remover valores None
+        return {k: v for k, v in update_data.items() if v is not None}
+    
+    def _outbox_row(self, metrics: StockMetrics) -> Dict:
+        return {'ticker': metrics.ticker, 'name': metrics.name, **self._update_payload(metrics)}
+    
+    @timed('serialize', target='outbox')
+    def enqueue_metrics(self, metrics: StockMetrics) -> bool:
+        """Gravar métricas na outbox local (enviadas depois pelo drenador)"""
+        self.outbox.enqueue('stocks_unified', [self._outbox_row(metrics)], ordering_key=metrics.ticker)
+        logger.info(f"📥 Métricas de {metrics.ticker} na outbox")
+        return True
+    
+    @timed('db.write', path='rest_patch')
+    def _patch_row(self, row: Dict) -> bool:
+        """PATCH de uma linha de stocks_unified pela sessão compartilhada"""
+        payload = {k: v for k, v in row.items() if k not in ('ticker', 'name')}
+        response = self.rest_writer.session.patch(
+            f"{self.supabase_url}/rest/v1/stocks_unified",
+            params={'ticker': f"eq.{row['ticker']}"},
+            json=payload,
+            timeout=self.rest_writer.timeout
+        )
+        if response.status_code == 204:
+            return True
+        logger.error(f"❌ Erro ao salvar {row['ticker']}: {response.status_code} - {response.text}")
+        return False
+    
     def save_to_supabase(self, metrics: StockMetrics) -> bool:
-        """Salvar métricas no Supabase"""
+        """Salvar métricas de uma ação no Supabase (PATCH pela sessão compartilhada)"""
         try:
             logger.info(f"💾 Salvando métricas para {metrics.ticker}...")
             
-            # Preparar dados para update
-            update_data = {
-                'returns_24m': metrics.returns_24m,
-                'returns_36m': metrics.returns_36m,
-                'returns_5y': metrics.returns_5y,
-                'ten_year_return': metrics.ten_year_return,
-                'volatility_24m': metrics.volatility_24m,
-                'volatility_36m': metrics.volatility_36m,
-                'ten_year_volatility': metrics.ten_year_volatility,
-                'sharpe_24m': metrics.sharpe_24m,
-                'sharpe_36m': metrics.sharpe_36m,
-                'ten_year_sharpe': metrics.ten_year_sharpe,
-                'beta_coefficient': metrics.beta_coefficient,
-                'dividend_yield_12m': metrics.dividend_yield_12m,
-                'dividends_24m': metrics.dividends_24m,
-                'dividends_36m': metrics.dividends_36m,
-                'dividends_all_time': metrics.dividends_all_time,
-                'last_updated': datetime.now().isoformat(),
-                'source_meta': {
-                    'enrichment_date': datetime.now().isoformat(),
-                    'enrichment_version': '1.0',
-                    'source': 'yfinance_python',
-                    'calculation_errors': metrics.calculation_errors
-                }
-            }
-            
-            # Remover valores None
-            update_data = {k: v for k, v in update_data.items() if v is not None}
-            
-            # Chamada para Supabase (via requests)
-            headers = {
-                'apikey': self.supabase_key,
-                'Authorization': f'Bearer {self.supabase_key}',
-                'Content-Type': 'application/json'
-            }
-            
-            response = requests.patch(
-                f"{self.supabase_url}/rest/v1/stocks_unified?ticker=eq.{metrics.ticker}",
-                headers=headers,
-                json=update_data
-            )
-            
-            if response.status_code == 204:
+            if self._patch_row(self._outbox_row(metrics)):
                 logger.info(f"✅ Métricas salvas com sucesso para {metrics.ticker}")
                 return True
-            else:
-                logger.error(f"❌ Erro ao salvar {metrics.ticker}: {response.status_code} - {response.text}")
-                return False
                 
         except Exception as e:
             logger.error(f"❌ Erro ao salvar no Supabase para {metrics.ticker}: {e}")
-            return False
+        
+        if self.outbox is not None:
+            return self.enqueue_metrics(metrics)
+        return False
+    
+    @timed('db.write', path='rest_upsert')
+    def upsert_rows(self, rows: List[Dict]) -> Dict:
+        """Upsert em lote das linhas com nome; as demais seguem por PATCH individual"""
+        
+        # O upsert precisa de `name` (NOT NULL)
+        report = self.rest_writer.upsert('stocks_unified', [row for row in rows if row.get('name')],
+                                         on_conflict='ticker')
+        
+        for row in rows:
+            if row.get('name'):
+                continue
+            try:
+                saved = self._patch_row(row)
+            except Exception as e:
+                logger.error(f"❌ Erro ao salvar no Supabase para {row['ticker']}: {e}")
+                saved = False
+            if not saved:
+                report['failed_keys'].append(row['ticker'])
+        
+        TELEMETRY.count('db.rows', len(rows) - len(report['failed_keys']), table='stocks_unified', outcome='written')
+        TELEMETRY.count('db.rows', len(report['failed_keys']), table='stocks_unified', outcome='failed')
+        
+        logger.info(f"💾 Lote salvo: {len(rows) - len(report['failed_keys'])}/{len(rows)} ações")
+        return report
+    
+    def save_batch_to_supabase(self, metrics_list: List[StockMetrics]) -> Dict:
+        """Salvar métricas de várias ações com upsert em lote (um POST por até 500 ações)"""
+        return self.upsert_rows([self._outbox_row(m) for m in metrics_list])
+    
+    def drain_outbox_rows(self, rows: List[Dict]) -> bool:
+        """Handler do drenador da outbox (upsert idempotente; False reagenda o lote)"""
+        # Várias versões do mesmo ticker no lote (em ordem de entrada): a última vence
+        latest = {row['ticker']: row for row in rows}
+        return not self.upsert_rows(list(latest.values()))['failed_keys']
 
 def main():
     """Função principal para teste"""
+    parser = argparse.ArgumentParser(description='Worker de enriquecimento de ações')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    
     # Configurações (usar variáveis de ambiente em produção)
     SUPABASE_URL = os.getenv('NEXT_PUBLIC_SUPABASE_URL', 'https://nniabnjuwzeqmflrruga.supabase.co')
     SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
@@ -476,34 +626,83 @@ def main():
         logger.error("❌ SUPABASE_SERVICE_ROLE_KEY não configurada")
         return
     
+    # WRITE_OUTBOX=1: métricas vão para a outbox local e são enviadas em background
+    outbox = WriteOutbox() if os.getenv('WRITE_OUTBOX') == '1' else None
+    
     # Criar worker
-    worker = StockEnrichmentWorker(SUPABASE_URL, SUPABASE_KEY, PERPLEXITY_KEY)
+    worker = StockEnrichmentWorker(SUPABASE_URL, SUPABASE_KEY, PERPLEXITY_KEY,
+                                   metric_cache=get_shared_cache(), outbox=outbox)
+    drainer = OutboxDrainer(outbox, {'stocks_unified': worker.drain_outbox_rows},
+                            batch_items=500).start() if outbox else None
+    
+    start_profiling(args.profile, args.profile_dir)
     
     # Teste com algumas ações
     test_tickers = ['AAPL', 'MSFT', 'GOOGL', 'TSLA', 'NVDA']
     
     logger.info(f"🚀 Iniciando teste com {len(test_tickers)} ações")
+    processed = {}
+    events = EventPublisher('stock_enrichment')
+    TELEMETRY.add_listener(events.span_listener)
+    events.run_started(total=len(test_tickers))
+    performance = RunReport('stock_enrichment', events=events).start()
+    
+    def record(ticker: str, metrics: StockMetrics):
+        processed[ticker] = metrics
+        if worker.has_pending_retry(ticker):
+            return  # evento e gravação ficam para o resultado do retry
+        if metrics.calculation_errors:
+            # Falha só vai para o stream de eventos: métricas vazias não sobrescrevem as gravadas
+            events.item(ticker, 'failed', error_class='calculation', error=None,
+                        errors=metrics.calculation_errors[:3])
+            return
+        events.item(ticker, 'success')
+        if outbox is not None:
+            worker.enqueue_metrics(metrics)
     
     for ticker in test_tickers:
         try:
-            # Processar ação
-            metrics = worker.process_stock(ticker)
-            
-            # Validar se necessário
-            if ticker in ['AAPL', 'MSFT']:  # Validar apenas as maiores
-                validation = worker.validate_with_perplexity(ticker, metrics)
-                logger.info(f"🤖 Validação {ticker}: {validation}")
+            with ticker_scope(ticker):
+                # Processar ação
+                metrics = worker.process_stock(ticker)
+                
+                # Validar se necessário
+                if ticker in ['AAPL', 'MSFT']:  # Validar apenas as maiores
+                    validation = worker.validate_with_perplexity(ticker, metrics)
+                    logger.info(f"🤖 Validação {ticker}: {validation}")
             
-            # Salvar (comentar para dry run)
-            # success = worker.save_to_supabase(metrics)
-            # logger.info(f"💾 Salvamento {ticker}: {'✅ Sucesso' if success else '❌ Falha'}")
+            record(ticker, metrics)
             
             # Pausa entre ações
             time.sleep(2)
-            
+        
         except Exception as e:
             logger.error(f"❌ Erro no teste com {ticker}: {e}")
+            events.item(ticker, 'failed', error=e)
+        
+        # Retries vencidos são refeitos entre as demais ações, sem bloquear o loop
+        for item in worker.provider_errors.retries.take_due():
+            record(item.key, worker.retry_subrequest(item, processed.get(item.key)))
+    
+    # Restante da fila: aguardar cada vencimento
+    while len(worker.provider_errors.retries):
+        for item in worker.provider_errors.retries.take_due(block=True):
+            record(item.key, worker.retry_subrequest(item, processed.get(item.key)))
+    
+    # Salvar em lote (comentar para dry run)
+    # report = worker.save_batch_to_supabase(list(processed.values()))
+    # logger.info(f"💾 Falhas no salvamento: {report['failed_keys']}")
+    
+    if drainer is not None:
+        drainer.stop(drain=True)
     
+    performance.finish()
+    stop_profiling()
+    telemetry_files = TELEMETRY.export(f"stock_enrichment_telemetry_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    logger.info(f"⏱️ Telemetria: {telemetry_files['json']}, {telemetry_files['prometheus']}")
+    logger.info(f"🗃️ Cache de métricas: {worker.metric_cache.stats()}")
+    events.run_finished()
+    events.close()
     logger.info("🏁 Teste concluído")
 
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+ESCRITA EM LOTE VIA REST (POSTGREST) - SUPABASE
+Sessão HTTP keep-alive com pool de conexões e upsert de muitos registros
+por POST (Prefer: resolution=merge-duplicates), com retry por lote e
+relatório de falhas parciais. A URL base é configurável, então o writer
+roda contra um servidor HTTP local de teste
+"""
+
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def create_session(api_key: str, pool_size: int = 10) -> requests.Session:
+    """Sessão reutilizável (TLS e conexões TCP mantidos entre chamadas)"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'apikey': api_key,
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    })
+    return session
+
+
+class SupabaseRestWriter:
+    """Upsert em lote via PostgREST com sessão compartilhada"""
+
+    def __init__(self, base_url: str, api_key: str, batch_size: int = 500,
+                 retry_attempts: int = 3, retry_backoff: float = 1.0, timeout: float = 30,
+                 session: Optional[requests.Session] = None):
+        self.base_url = base_url.rstrip('/')
+        self.batch_size = batch_size
+        self.retry_attempts = retry_attempts
+        self.retry_backoff = retry_backoff
+        self.timeout = timeout
+        self.session = session or create_session(api_key)
+
+    def _post_batch(self, table: str, rows: List[Dict[str, Any]], on_conflict: str) -> Dict[str, Any]:
+        """Enviar um lote com retry em erros transitórios (rede, 429, 5xx)"""
+        url = f"{self.base_url}/rest/v1/{table}"
+        headers = {'Prefer': 'resolution=merge-duplicates,return=minimal'}
+        last_error = None
+        status_code = None
+
+        for attempt in range(1, self.retry_attempts + 1):
+            try:
+                response = self.session.post(url, params={'on_conflict': on_conflict}, json=rows,
+                                             headers=headers, timeout=self.timeout)
+                status_code = response.status_code
+                if status_code in (200, 201, 204):
+                    return {'status': 'success', 'http_status': status_code, 'attempts': attempt}
+
+                last_error = response.text[:500]
+                if status_code not in RETRY_STATUS:
+                    break  # erro do payload: repetir não resolve
+
+                retry_after = response.headers.get('Retry-After')
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else None
+            except requests.RequestException as e:
+                last_error = str(e)
+                delay = None
+
+            if attempt < self.retry_attempts:
+                time.sleep(delay if delay is not None else self.retry_backoff * 2 ** (attempt - 1))
+
+        return {'status': 'failed', 'http_status': status_code, 'attempts': attempt, 'error': last_error}
+
+    @staticmethod
+    def _group_by_columns(rows: Sequence[Dict[str, Any]]) -> Dict[tuple, List[Dict[str, Any]]]:
+        """PostgREST exige as mesmas chaves em todos os objetos de um POST"""
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        return groups
+
+    def upsert(self, table: str, rows: Sequence[Dict[str, Any]], on_conflict: str) -> Dict[str, Any]:
+        """Upsert de todos os registros em lotes; falhas reportadas por lote com as chaves afetadas"""
+        started = time.time()
+        batches = []
+
+        for group in self._group_by_columns(rows).values():
+            for i in range(0, len(group), self.batch_size):
+                chunk = group[i:i + self.batch_size]
+                outcome = self._post_batch(table, chunk, on_conflict)
+                outcome['batch'] = len(batches) + 1
+                outcome['rows'] = len(chunk)
+                if outcome['status'] != 'success':
+                    outcome['keys'] = [row.get(on_conflict) for row in chunk]
+                    logging.error(f"❌ Lote {outcome['batch']} de {table} falhou "
+                                  f"({outcome['http_status']}): {outcome['error']}")
+                batches.append(outcome)
+
+        failed = [b for b in batches if b['status'] != 'success']
+        report = {
+            'table': table,
+            'rows': len(rows),
+            'batches': len(batches),
+            'failed_batches': len(failed),
+            'failed_keys': [key for b in failed for key in b['keys']],
+            'duration': time.time() - started,
+            'details': batches
+        }
+        logging.info(f"🌐 {table}: {len(rows)} registros em {len(batches)} POSTs "
+                     f"({len(failed)} lotes com falha) em {report['duration']:.2f}s")
+        return report
+
+    def close(self):
+        self.session.close()
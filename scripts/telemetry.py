@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+INSTRUMENTAÇÃO DE ESTÁGIOS (SPANS) COM HISTOGRAMAS DE LATÊNCIA
+Spans leves (perf_counter + um lock por observação) para os estágios do
+pipeline: fetch (info/history/dividends), calculate, serialize e db.write.
+Cada span alimenta um histograma de buckets fixos e contadores, exportados
+em JSON e no formato texto do Prometheus para identificar o gargalo de uma
+execução de produção
+"""
+
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Tuple
+
+# Limites superiores dos buckets (segundos): 1ms .. 2min, escala ~logarítmica
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class LatencyHistogram:
+    """Histograma cumulativo no estilo Prometheus + min/máx"""
+
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # último = +Inf
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """Estimativa por interpolação linear dentro do bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = BUCKETS[index - 1] if index > 0 else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else self.max
+                fraction = (rank - seen) / bucket_count
+                return min(max(lower + (upper - lower) * fraction, self.min), self.max)
+            seen += bucket_count
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'min': self.min if self.count else 0.0,
+            'max': self.max,
+            'p50': self.quantile(0.50),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99)
+        }
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs) -> str:
+    return '{' + ','.join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + '}'
+
+
+class Telemetry:
+    """Registro de spans e contadores de um processo"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, LabelKey], LatencyHistogram] = {}
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._listeners: List[Callable[[str, float, Dict[str, Any]], None]] = []
+        self._scope_hooks: List[Any] = []
+
+    def add_listener(self, listener: Callable[[str, float, Dict[str, Any]], None]):
+        """Receber cada observação (ex.: publicar no stream de eventos do monitor)"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[str, float, Dict[str, Any]], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def add_scope_hook(self, hook):
+        """Objeto com `enter(name, labels)`/`exit(name)` chamado em volta de cada span (ex.: profiler)"""
+        self._scope_hooks.append(hook)
+
+    def remove_scope_hook(self, hook):
+        if hook in self._scope_hooks:
+            self._scope_hooks.remove(hook)
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+            histogram.observe(seconds)
+        for listener in self._listeners:
+            listener(name, seconds, labels)
+
+    def count(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """Medir um bloco; exceções contam em `<span>.errors` e são propagadas"""
+        if not self.enabled:
+            yield
+            return
+        hooks = self._scope_hooks
+        for hook in hooks:
+            hook.enter(name, labels)
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.count(f"{name}.errors", error=type(e).__name__)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+            for hook in reversed(hooks):
+                hook.exit(name)
+
+    def timed(self, name: str, **labels):
+        """Decorator equivalente a `with span(name)`"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def counter_values(self, name: str) -> List[Tuple[Dict[str, str], float]]:
+        """Valores de um contador por combinação de labels"""
+        with self._lock:
+            return [(dict(labels), value) for (counter, labels), value in self._counters.items() if counter == name]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado atual em estrutura serializável (JSON)"""
+        with self._lock:
+            spans = {}
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                label_text = _format_labels(labels) if labels else ''
+                spans[name + label_text] = histogram.to_dict()
+            counters = {name + (_format_labels(labels) if labels else ''): value
+                        for (name, labels), value in sorted(self._counters.items())}
+
+        elapsed = time.time() - self.started
+        return {
+            'elapsed_seconds': elapsed,
+            'spans': spans,
+            'counters': counters,
+            # Fração do tempo de parede gasto em cada span (soma pode passar de 1 com spans aninhados/threads)
+            'time_share': {name: data['sum'] / elapsed for name, data in spans.items()} if elapsed else {}
+        }
+
+    def to_prometheus(self, prefix: str = 'etl') -> str:
+        """Exposição no formato texto do Prometheus"""
+        lines = [f"# HELP {prefix}_span_seconds Latência dos estágios do pipeline",
+                 f"# TYPE {prefix}_span_seconds histogram"]
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                base = (('span', name),) + labels
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS + (float('inf'),), histogram.counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{prefix}_span_seconds_bucket{_format_labels(base + (('le', le),))} {cumulative}")
+                lines.append(f"{prefix}_span_seconds_sum{_format_labels(base)} {histogram.total}")
+                lines.append(f"{prefix}_span_seconds_count{_format_labels(base)} {histogram.count}")
+
+            lines.append(f"# HELP {prefix}_events_total Contadores do pipeline")
+            lines.append(f"# TYPE {prefix}_events_total counter")
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{prefix}_events_total{_format_labels((('name', name),) + labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def export(self, basename: str, prefix: str = 'etl') -> Dict[str, str]:
+        """Gravar `<basename>.json` e `<basename>.prom`"""
+        directory = os.path.dirname(basename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        paths = {'json': f"{basename}.json", 'prometheus': f"{basename}.prom"}
+        with open(paths['json'], 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        with open(paths['prometheus'], 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus(prefix))
+        return paths
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+        self.started = time.time()
+
+
+# Registro compartilhado pelo processo (TELEMETRY_DISABLED=1 desliga)
+TELEMETRY = Telemetry(enabled=os.getenv('TELEMETRY_DISABLED') != '1')
+span = TELEMETRY.span
+count = TELEMETRY.count
+timed = TELEMETRY.timed
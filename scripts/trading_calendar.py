@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+CALENDÁRIO DE PREGÕES COMPARTILHADO
+Mapeia datas para índices inteiros de dias úteis e alinha séries de preços
+de qualquer ticker sobre o mesmo calendário (usado por métricas e portfólios)
+"""
+
+import numpy as np
+import pandas as pd
+from datetime import date as dt_date
+from typing import Dict, Iterable, Optional, Union
+
+DateLike = Union[str, pd.Timestamp, dt_date]
+
+
+class TradingCalendar:
+    """Calendário de pregões com lookup O(1) de índices de dias úteis"""
+
+    def __init__(self, dates: Iterable):
+        index = self._normalize_index(pd.DatetimeIndex(dates))
+        self.dates = index.unique().sort_values()
+        # Mapa data -> posição inteira (lookup O(1))
+        self._positions = {ts: i for i, ts in enumerate(self.dates)}
+
+    @staticmethod
+    def _normalize_index(index: pd.DatetimeIndex) -> pd.DatetimeIndex:
+        """Remover timezone e horário para que datas de fontes distintas coincidam"""
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        return index.normalize()
+
+    @classmethod
+    def from_series(cls, *series: pd.Series) -> 'TradingCalendar':
+        """Construir calendário a partir da união das datas de várias séries"""
+        dates = pd.DatetimeIndex([])
+        for s in series:
+            if s is not None and len(s) > 0:
+                dates = dates.union(cls._normalize_index(pd.DatetimeIndex(s.index)))
+        return cls(dates)
+
+    @classmethod
+    def from_benchmark(cls, benchmark: Union[pd.Series, pd.DataFrame]) -> 'TradingCalendar':
+        """Usar o benchmark (ex: SPY) como calendário de referência"""
+        return cls(benchmark.index)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __contains__(self, date: DateLike) -> bool:
+        return self._to_timestamp(date) in self._positions
+
+    def _to_timestamp(self, date: DateLike) -> pd.Timestamp:
+        ts = pd.Timestamp(date)
+        if ts.tzinfo is not None:
+            ts = ts.tz_localize(None)
+        return ts.normalize()
+
+    def index_of(self, date: DateLike) -> int:
+        """Índice do pregão na data (ou do último pregão anterior, se não houver)"""
+        ts = self._to_timestamp(date)
+        position = self._positions.get(ts)
+        if position is not None:
+            return position
+
+        position = int(self.dates.searchsorted(ts, side='right')) - 1
+        if position < 0:
+            raise KeyError(f"Data {ts.date()} anterior ao início do calendário")
+        return position
+
+    def index_n_days_ago(self, n: int, as_of: Optional[DateLike] = None) -> Optional[int]:
+        """Índice de N pregões atrás (O(1) quando as_of é um pregão)"""
+        end = len(self.dates) - 1 if as_of is None else self.index_of(as_of)
+        start = end - n
+        return start if start >= 0 else None
+
+    def date_n_days_ago(self, n: int, as_of: Optional[DateLike] = None) -> Optional[pd.Timestamp]:
+        """Data de N pregões atrás"""
+        position = self.index_n_days_ago(n, as_of)
+        return self.dates[position] if position is not None else None
+
+    def align(self, series: pd.Series, fill_limit: Optional[int] = 5) -> pd.Series:
+        """
+        Alinhar série ao calendário.
+
+        Lacunas (feriados locais, dias sem negociação) são preenchidas com o
+        último valor conhecido até `fill_limit` pregões; valores anteriores à
+        primeira observação permanecem NaN. Totalmente vetorizado.
+        """
+        if series is None or len(series) == 0:
+            return pd.Series(np.nan, index=self.dates, dtype=float)
+
+        source = series.copy()
+        source.index = self._normalize_index(pd.DatetimeIndex(source.index))
+        source = source[~source.index.duplicated(keep='last')].sort_index()
+
+        # União com o calendário para não perder observações fora dele no ffill
+        combined = source.reindex(source.index.union(self.dates))
+        combined = combined.ffill(limit=fill_limit)
+        return combined.reindex(self.dates)
+
+    def align_matrix(self, series_by_ticker: Dict[str, pd.Series],
+                     fill_limit: Optional[int] = 5,
+                     dtype: Optional[str] = None) -> pd.DataFrame:
+        """Matriz datas x tickers alinhada ao calendário (dtype opcional, ex: 'float32')"""
+        columns = {
+            ticker: self.align(series, fill_limit=fill_limit)
+            for ticker, series in series_by_ticker.items()
+        }
+        matrix = pd.DataFrame(columns, index=self.dates)
+        return matrix.astype(dtype) if dtype else matrix
+
+    def window(self, aligned: Union[pd.Series, pd.DataFrame], n: int,
+               as_of: Optional[DateLike] = None) -> Union[pd.Series, pd.DataFrame]:
+        """Janela dos últimos N pregões (inclusive) de uma série já alinhada"""
+        end = len(self.dates) - 1 if as_of is None else self.index_of(as_of)
+        start = max(end - n, 0)
+        return aligned.iloc[start:end + 1]
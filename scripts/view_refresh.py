@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+AGENDADOR DE REFRESH DAS VIEWS DERIVADAS
+Writers apenas marcam a view como suja (mark_views_dirty, uma linha em
+derived_view_refresh_state). O agendador junta os sinais de uma janela e
+executa no máximo um REFRESH MATERIALIZED VIEW CONCURRENTLY por view e por
+janela, com advisory lock para que processos concorrentes não empilhem
+rebuilds. Duração e sinais agrupados ficam registrados na própria tabela
+"""
+
+import argparse
+import json
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from bulk_loader import connect_from_env
+from log_setup import configure_logging
+
+DERIVED_VIEWS = ['stocks_ativos_reais']
+DEFAULT_WINDOW = 60.0
+
+
+def mark_views_dirty(conn, views: Iterable[str] = DERIVED_VIEWS, commit: bool = True):
+    """Sinalizar que dados de origem mudaram (barato: um upsert por view)"""
+    with conn.cursor() as cur:
+        for view in views:
+            cur.execute("""
+                INSERT INTO derived_view_refresh_state (view_name, dirty_since, pending_signals)
+                VALUES (%s, now(), 1)
+                ON CONFLICT (view_name) DO UPDATE SET
+                    dirty_since = COALESCE(derived_view_refresh_state.dirty_since, now()),
+                    pending_signals = derived_view_refresh_state.pending_signals + 1
+            """, (view,))
+    if commit:
+        conn.commit()
+
+
+class ViewRefreshScheduler:
+    """Refresh com debounce: no máximo um por view a cada `window` segundos"""
+
+    def __init__(self, conn, window: float = DEFAULT_WINDOW, views: Optional[List[str]] = None):
+        self.conn = conn
+        self.window = window
+        self.views = views or DERIVED_VIEWS
+        self.timings: Dict[str, List[float]] = {view: [] for view in self.views}
+
+    def due_views(self, force: bool = False) -> List[str]:
+        """Views sujas cujo último refresh terminou há mais de uma janela (`force`: todas as sujas)"""
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT view_name FROM derived_view_refresh_state
+                WHERE view_name = ANY(%s)
+                  AND dirty_since IS NOT NULL
+                  AND (last_refresh_finished IS NULL
+                       OR last_refresh_finished <= now() - make_interval(secs => %s))
+                ORDER BY dirty_since
+            """, (self.views, 0 if force else self.window))
+            due = [row[0] for row in cur.fetchall()]
+        self.conn.commit()
+        return due
+
+    def _claim(self, view: str) -> Optional[int]:
+        """Limpar o sinal antes do refresh (o que chegar depois gera novo ciclo)"""
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                UPDATE derived_view_refresh_state s
+                SET dirty_since = NULL, pending_signals = 0, last_refresh_started = now()
+                FROM (SELECT view_name, pending_signals FROM derived_view_refresh_state
+                      WHERE view_name = %s FOR UPDATE) previous
+                WHERE s.view_name = previous.view_name AND s.dirty_since IS NOT NULL
+                RETURNING previous.pending_signals
+            """, (view,))
+            row = cur.fetchone()
+        self.conn.commit()
+        return row[0] if row else None
+
+    def _refresh_view(self, view: str):
+        """CONCURRENTLY não bloqueia leitores (exige índice único e view já populada)"""
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}")
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            logging.warning(f"⚠️ REFRESH CONCURRENTLY indisponível para {view} ({e}); usando refresh normal")
+            with self.conn.cursor() as cur:
+                cur.execute(f"REFRESH MATERIALIZED VIEW {view}")
+            self.conn.commit()
+
+    def refresh(self, view: str) -> Optional[float]:
+        """Refresh de uma view; None se outro processo já está atualizando"""
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (f"refresh:{view}",))
+            locked = cur.fetchone()[0]
+        self.conn.commit()
+        if not locked:
+            logging.info(f"⏭️ {view}: refresh já em andamento em outro processo")
+            return None
+
+        try:
+            signals = self._claim(view)
+            if signals is None:
+                return None  # outro processo atualizou entre a consulta e o lock
+
+            started = time.time()
+            try:
+                self._refresh_view(view)
+            except Exception as e:
+                self.conn.rollback()
+                # Devolver o sinal para a próxima janela
+                with self.conn.cursor() as cur:
+                    cur.execute("""
+                        UPDATE derived_view_refresh_state
+                        SET dirty_since = COALESCE(dirty_since, last_refresh_started),
+                            pending_signals = pending_signals + %s, last_error = %s
+                        WHERE view_name = %s
+                    """, (signals, str(e)[:1000], view))
+                self.conn.commit()
+                logging.error(f"❌ Falha no refresh de {view}: {e}")
+                return None
+
+            duration = time.time() - started
+            duration_ms = int(duration * 1000)
+            with self.conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE derived_view_refresh_state
+                    SET last_refresh_finished = now(), last_duration_ms = %s,
+                        max_duration_ms = GREATEST(COALESCE(max_duration_ms, 0), %s),
+                        refresh_count = refresh_count + 1,
+                        coalesced_signals = coalesced_signals + %s, last_error = NULL
+                    WHERE view_name = %s
+                """, (duration_ms, duration_ms, signals, view))
+            self.conn.commit()
+
+            self.timings.setdefault(view, []).append(duration)
+            logging.info(f"🔄 {view} atualizada em {duration:.1f}s ({signals} sinais agrupados)")
+            return duration
+        finally:
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(hashtext(%s))", (f"refresh:{view}",))
+            self.conn.commit()
+
+    def run_once(self, force: bool = False) -> Dict[str, float]:
+        """
+        Atualizar as views vencidas; views sujas dentro da janela ficam para o
+        próximo ciclo, a menos que `force` (fim de uma carga que precisa das views atualizadas)
+        """
+        timings = {}
+        for view in self.due_views(force=force):
+            duration = self.refresh(view)
+            if duration is not None:
+                timings[view] = duration
+        return timings
+
+    def run_forever(self, poll_interval: float = 5.0):
+        """Loop do agendador (um processo por ambiente basta)"""
+        logging.info(f"⏱️ Agendador de refresh: janela {self.window:.0f}s, views {self.views}")
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                self.conn.rollback()
+                logging.error(f"❌ Erro no agendador de refresh: {e}")
+            time.sleep(poll_interval)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Estado persistido por view + durações desta execução"""
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT view_name, dirty_since, pending_signals, last_refresh_finished,
+                       last_duration_ms, max_duration_ms, refresh_count, coalesced_signals, last_error
+                FROM derived_view_refresh_state WHERE view_name = ANY(%s)
+            """, (self.views,))
+            columns = [desc[0] for desc in cur.description]
+            rows = cur.fetchall()
+        self.conn.commit()
+
+        metrics = {}
+        for row in rows:
+            state = dict(zip(columns, row))
+            view = state.pop('view_name')
+            durations = self.timings.get(view, [])
+            state['session_refreshes'] = len(durations)
+            state['session_seconds'] = sum(durations)
+            metrics[view] = state
+        return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh agrupado das views derivadas')
+    parser.add_argument('--window', type=float, default=DEFAULT_WINDOW, help='Janela mínima entre refreshes (s)')
+    parser.add_argument('--once', action='store_true', help='Executar um ciclo e sair')
+    parser.add_argument('--mark', nargs='*', metavar='VIEW', help='Apenas marcar views como sujas')
+    parser.add_argument('--metrics', action='store_true', help='Imprimir métricas e sair')
+    args = parser.parse_args()
+    configure_logging()
+
+    conn = connect_from_env()
+    try:
+        scheduler = ViewRefreshScheduler(conn, window=args.window)
+        if args.mark is not None:
+            mark_views_dirty(conn, args.mark or DERIVED_VIEWS)
+        elif args.metrics:
+            print(json.dumps(scheduler.metrics(), indent=2, default=str))
+        elif args.once:
+            scheduler.run_once()
+        else:
+            scheduler.run_forever()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+OUTBOX LOCAL DE ESCRITAS (WRITE-AHEAD)
+Os coletores gravam os lotes em um SQLite local (modo WAL) na velocidade da
+coleta; um drenador em background envia ao banco em lotes grandes, com
+retry e backoff. Cada entrada tem uma chave de idempotência: reenfileirar o
+mesmo conteúdo não duplica trabalho, e reenvios após falha ou queda do
+processo caem em upserts (ON CONFLICT), sem efeito duplicado no destino.
+Entradas com a mesma chave de ordenação (ex.: ticker) são aplicadas na
+ordem de chegada: uma versão nova espera a anterior sair do backoff
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+DEFAULT_OUTBOX_PATH = os.getenv('WRITE_OUTBOX_PATH', 'write_outbox.db')
+
+
+def idempotency_key(sink: str, items: Sequence[Dict[str, Any]]) -> str:
+    """Chave derivada do conteúdo (mesmo lote -> mesma chave)"""
+    payload = json.dumps(items, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.blake2b(f"{sink}\n{payload}".encode('utf-8'), digest_size=16).hexdigest()
+
+
+class WriteOutbox:
+    """Fila durável de lotes por destino (sink), persistida em SQLite"""
+
+    def __init__(self, path: str = DEFAULT_OUTBOX_PATH, max_attempts: int = 8, retry_backoff: float = 2.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sink TEXT NOT NULL,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                items INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                next_attempt_at REAL NOT NULL,
+                ordering_key TEXT
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        if 'ordering_key' not in columns:  # outbox criada antes da chave de ordenação
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN ordering_key TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (sink, status, next_attempt_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_ordering ON outbox (sink, ordering_key, status)")
+        self._conn.commit()
+
+    def enqueue(self, sink: str, items: Sequence[Dict[str, Any]], key: Optional[str] = None,
+                ordering_key: Optional[str] = None) -> str:
+        """Gravar um lote na outbox (ignorado se a chave já está na fila; uma entrada 'dead' é recriada)"""
+        items = list(items)
+        key = key or idempotency_key(sink, items)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox WHERE idempotency_key = ? AND status = 'dead'", (key,))
+            self._conn.execute("""
+                INSERT OR IGNORE INTO outbox
+                (sink, idempotency_key, payload, items, created_at, next_attempt_at, ordering_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (sink, key, json.dumps(items, default=str), len(items), now, now, ordering_key))
+            self._conn.commit()
+        return key
+
+    def claim(self, sink: str, max_items: int) -> List[Dict[str, Any]]:
+        """
+        Entradas pendentes e vencidas de um sink, em ordem de chegada, até
+        `max_items` itens. Uma entrada cuja chave de ordenação tem versão
+        anterior ainda em backoff fica para depois (a antiga não pode
+        sobrescrever a nova ao vencer)
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT o.id, o.idempotency_key, o.payload, o.items, o.attempts FROM outbox o
+                WHERE o.sink = ? AND o.status = 'pending' AND o.next_attempt_at <= ?
+                  AND (o.ordering_key IS NULL OR NOT EXISTS (
+                      SELECT 1 FROM outbox p
+                      WHERE p.sink = o.sink AND p.ordering_key = o.ordering_key
+                        AND p.status = 'pending' AND p.id < o.id AND p.next_attempt_at > ?))
+                ORDER BY o.id
+            """, (sink, now, now)).fetchall()
+
+        entries = []
+        total = 0
+        for entry_id, key, payload, items, attempts in rows:
+            if entries and total + items > max_items:
+                break
+            entries.append({'id': entry_id, 'key': key, 'items': json.loads(payload), 'attempts': attempts})
+            total += items
+        return entries
+
+    def ack(self, ids: Sequence[int]):
+        """Remover entradas confirmadas no destino"""
+        with self._lock:
+            self._conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def nack(self, ids: Sequence[int], error: str):
+        """Reagendar com backoff exponencial; após `max_attempts` a entrada vira 'dead'"""
+        now = time.time()
+        with self._lock:
+            for entry_id in ids:
+                (attempts,) = self._conn.execute("SELECT attempts FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+                attempts += 1
+                status = 'dead' if attempts >= self.max_attempts else 'pending'
+                delay = self.retry_backoff * 2 ** (attempts - 1)
+                self._conn.execute("""
+                    UPDATE outbox SET attempts = ?, status = ?, last_error = ?, next_attempt_at = ?
+                    WHERE id = ?
+                """, (attempts, status, error[:1000], now + delay, entry_id))
+            self._conn.commit()
+
+    def requeue_dead(self, sink: Optional[str] = None) -> int:
+        """Devolver entradas 'dead' à fila (após corrigir a causa da falha)"""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ? "
+                "WHERE status = 'dead' AND (? IS NULL OR sink = ?)",
+                (time.time(), sink, sink)
+            )
+            self._conn.commit()
+        return cur.rowcount
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Entradas e itens por sink e status"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT sink, status, COUNT(*), SUM(items) FROM outbox GROUP BY sink, status"
+            ).fetchall()
+        stats: Dict[str, Dict[str, int]] = {}
+        for sink, status, entries, items in rows:
+            stats.setdefault(sink, {})[f"{status}_entries"] = entries
+            stats[sink][f"{status}_items"] = items or 0
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class OutboxDrainer:
+    """
+    Thread que drena a outbox: junta as entradas pendentes de cada sink em
+    um lote grande e chama `handlers[sink](items)`. O handler deve ser
+    idempotente (upsert); exceção ou retorno False conta como falha do lote
+    """
+
+    def __init__(self, outbox: WriteOutbox, handlers: Dict[str, Callable[[List[Dict[str, Any]]], Any]],
+                 batch_items: int = 50, interval: float = 1.0):
+        self.outbox = outbox
+        self.handlers = handlers
+        self.batch_items = batch_items
+        self.interval = interval
+        self.stats = {'batches': 0, 'entries': 0, 'items': 0, 'failures': 0, 'busy_seconds': 0.0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def drain_once(self) -> int:
+        """Enviar um lote por sink; retorna quantas entradas foram confirmadas"""
+        acked = 0
+        for sink, handler in self.handlers.items():
+            entries = self.outbox.claim(sink, self.batch_items)
+            if not entries:
+                continue
+
+            ids = [entry['id'] for entry in entries]
+            items = [item for entry in entries for item in entry['items']]
+            started = time.time()
+            try:
+                if handler(items) is False:
+                    raise RuntimeError(f"handler de {sink} reportou falha")
+            except Exception as e:
+                self.stats['failures'] += 1
+                self.outbox.nack(ids, str(e))
+                logging.warning(f"⚠️ Outbox {sink}: lote de {len(entries)} entradas falhou, reagendado ({e})")
+                continue
+            finally:
+                self.stats['busy_seconds'] += time.time() - started
+
+            self.outbox.ack(ids)
+            acked += len(ids)
+            self.stats['batches'] += 1
+            self.stats['entries'] += len(ids)
+            self.stats['items'] += len(items)
+            logging.info(f"📤 Outbox {sink}: {len(entries)} entradas ({len(items)} itens) "
+                         f"enviadas em {time.time() - started:.2f}s")
+        return acked
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if not self.drain_once():
+                    self._stop.wait(self.interval)
+            except Exception as e:
+                logging.error(f"❌ Erro no drenador da outbox: {e}")
+                self._stop.wait(self.interval)
+
+    def start(self) -> 'OutboxDrainer':
+        self._thread = threading.Thread(target=self._loop, name='outbox-drainer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, drain: bool = True, timeout: Optional[float] = None):
+        """Parar a thread; com `drain`, envia o que estiver pronto antes de retornar"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if drain:
+            deadline = time.time() + timeout if timeout is not None else None
+            while self.drain_once():
+                if deadline is not None and time.time() > deadline:
+                    break
+        pending = self.outbox.stats()
+        logging.info(f"📭 Drenador parado: {self.stats}; restante na outbox: {pending}")
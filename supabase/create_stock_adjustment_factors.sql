@@ -0,0 +1,80 @@
+-- =====================================================================
+-- MIGRAÇÃO: FATORES DE AJUSTE POR EVENTOS CORPORATIVOS
+-- Objetivo: Guardar preços brutos em stock_prices_daily e uma série
+--           cumulativa de fatores por ticker, atualizada incrementalmente
+--           a cada novo dividendo/desdobramento (sem recoletar histórico)
+-- =====================================================================
+
+-- 1. FATORES CUMULATIVOS (um registro por evento corporativo)
+-- cumulative_factor vale para os pregões anteriores a ex_date
+-- (e posteriores ao evento anterior do mesmo ativo)
+CREATE TABLE IF NOT EXISTS stock_adjustment_factors (
+  id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  asset_id BIGINT NOT NULL REFERENCES assets_master(id) ON DELETE CASCADE,
+  ex_date DATE NOT NULL,
+  action_type TEXT NOT NULL CHECK (action_type IN ('dividend','split')),
+  value NUMERIC(18,8) NOT NULL,
+  ratio NUMERIC(18,10) NOT NULL,
+  cumulative_factor NUMERIC(18,10) NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT now(),
+  UNIQUE(asset_id, ex_date, action_type)
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_adjustment_factors_asset_date
+  ON stock_adjustment_factors (asset_id, ex_date);
+
+-- 2. PREÇOS AJUSTADOS CALCULADOS NA LEITURA
+-- stock_prices_daily.adj_close deixa de ser gravado pelos coletores (coluna
+-- legada): leituras de preço ajustado devem usar esta view
+-- Fator aplicável = cumulative_factor do primeiro evento com ex_date > date
+CREATE OR REPLACE VIEW stock_prices_adjusted AS
+SELECT
+  p.asset_id,
+  p.date,
+  p.close AS raw_close,
+  COALESCE(f.cumulative_factor, 1) AS adjustment_factor,
+  p.close * COALESCE(f.cumulative_factor, 1) AS adj_close,
+  p.volume
+FROM stock_prices_daily p
+LEFT JOIN LATERAL (
+  SELECT saf.cumulative_factor
+  FROM stock_adjustment_factors saf
+  WHERE saf.asset_id = p.asset_id
+    AND saf.ex_date > p.date
+  ORDER BY saf.ex_date, saf.id
+  LIMIT 1
+) f ON TRUE;
+
+-- 3. ATUALIZAÇÃO INCREMENTAL DE UM NOVO EVENTO
+-- Multiplica os fatores dos eventos anteriores pelo ratio e registra o novo;
+-- os preços brutos em stock_prices_daily não são reescritos
+CREATE OR REPLACE FUNCTION apply_corporate_action(
+  p_asset_id BIGINT,
+  p_ex_date DATE,
+  p_action_type TEXT,
+  p_value NUMERIC,
+  p_ratio NUMERIC
+) RETURNS VOID AS $$
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM stock_adjustment_factors
+    WHERE asset_id = p_asset_id AND ex_date = p_ex_date AND action_type = p_action_type
+  ) THEN
+    RETURN;
+  END IF;
+
+  UPDATE stock_adjustment_factors
+  SET cumulative_factor = cumulative_factor * p_ratio
+  WHERE asset_id = p_asset_id AND ex_date <= p_ex_date;
+
+  INSERT INTO stock_adjustment_factors (asset_id, ex_date, action_type, value, ratio, cumulative_factor)
+  VALUES (
+    p_asset_id, p_ex_date, p_action_type, p_value, p_ratio,
+    p_ratio * COALESCE((
+      SELECT cumulative_factor FROM stock_adjustment_factors
+      WHERE asset_id = p_asset_id AND ex_date > p_ex_date
+      ORDER BY ex_date, id LIMIT 1
+    ), 1)
+  );
+END;
+$$ LANGUAGE plpgsql;
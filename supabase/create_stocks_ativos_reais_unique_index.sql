@@ -0,0 +1,13 @@
+-- =====================================================================
+-- ÍNDICE ÚNICO EM stocks_ativos_reais
+-- Necessário para REFRESH MATERIALIZED VIEW CONCURRENTLY (leitores não
+-- bloqueiam durante o refresh). Usado por scripts/staging_merge.py
+-- =====================================================================
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_stocks_ativos_reais_symbol
+  ON stocks_ativos_reais (symbol);
+
+-- Limpeza de stagings órfãs (execuções interrompidas antes do merge)
+-- DELETE FROM staging_assets_master;
+-- DELETE FROM staging_stock_metrics_snapshot;
+-- DELETE FROM staging_stock_prices_daily;
@@ -0,0 +1,22 @@
+-- =====================================================================
+-- ESTADO DE REFRESH DAS VIEWS DERIVADAS
+-- Writers marcam a view como "suja" (dirty_since); scripts/view_refresh.py
+-- agrupa os sinais e executa no máximo um REFRESH CONCURRENTLY por janela
+-- =====================================================================
+
+CREATE TABLE IF NOT EXISTS derived_view_refresh_state (
+  view_name TEXT PRIMARY KEY,
+  dirty_since TIMESTAMPTZ,              -- primeiro sinal ainda não refletido na view
+  pending_signals INTEGER NOT NULL DEFAULT 0,
+  last_refresh_started TIMESTAMPTZ,
+  last_refresh_finished TIMESTAMPTZ,
+  last_duration_ms INTEGER,
+  max_duration_ms INTEGER,
+  refresh_count INTEGER NOT NULL DEFAULT 0,
+  coalesced_signals BIGINT NOT NULL DEFAULT 0, -- sinais absorvidos por refreshes já executados
+  last_error TEXT
+);
+
+INSERT INTO derived_view_refresh_state (view_name)
+VALUES ('stocks_ativos_reais')
+ON CONFLICT (view_name) DO NOTHING;